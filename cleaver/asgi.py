@@ -0,0 +1,372 @@
+from .base import Cleaver, _unrecorded, _record
+from .compat import string_types
+from .middleware import _parse_callback, _parse_overrides
+from .backend import CleaverBackend
+from .backend.aio import AsyncCleaverBackend, ThreadPoolBackend
+from .identity import CleaverIdentityProvider
+from .registry import default_registry
+
+__all__ = ['AsyncCleaver', 'AsyncSplitMiddleware']
+
+
+class AsyncCleaver(Cleaver):
+
+    def __init__(self, scope, identity, backend,
+                 count_humans_only=False,
+                 human_callback_token='__cleaver_human_verification__',
+                 experiment_registry=default_registry,
+                 hash_assignment=False, hash_salt=''):
+        """
+        Create a new asyncio-friendly Cleaver instance.
+
+        Not generally instantiated directly, but established automatically by
+        ``cleaver.asgi.AsyncSplitMiddleware`` and used within an ASGI
+        application via ``scope['cleaver']``.
+
+        Accepts the same arguments as ``cleaver.Cleaver``, except that
+        ``scope`` is the ASGI connection scope, and ``backend`` is any
+        implementation of ``backend.aio.AsyncCleaverBackend``.  ``split``,
+        ``split_many``, ``score``, ``human``, ``mark_human`` and
+        ``humanizing_javascript`` are coroutines.
+        """
+        super(AsyncCleaver, self).__init__(
+            scope, identity, backend,
+            count_humans_only=count_humans_only,
+            human_callback_token=human_callback_token,
+            experiment_registry=experiment_registry,
+            hash_assignment=hash_assignment,
+            hash_salt=hash_salt
+        )
+
+    def _check_backend(self, backend):
+        if not isinstance(backend, AsyncCleaverBackend):
+            raise RuntimeError(
+                '%s must implement '
+                'cleaver.backend.aio.AsyncCleaverBackend' % backend
+            )
+
+    async def human(self):
+        """
+        Whether the current visitor has been verified as a human.
+        """
+        if 'human' not in self._cache:
+            self._cache['human'] = await self._backend.is_verified_human(
+                self.identity
+            )
+        return self._cache['human']
+
+    async def mark_human(self):
+        """
+        Mark the current visitor as a verified human.
+        """
+        await self._backend.mark_human(self.identity)
+        self._cache['human'] = True
+
+    async def split(self, experiment_name, *variants):
+        """
+        Used to split and track user experience amongst one or more variants.
+
+        See ``cleaver.Cleaver.split``.
+        """
+        if not isinstance(experiment_name, string_types):
+            raise RuntimeError(
+                'Invalid experiment name: %s must be a string.' %
+                experiment_name
+            )
+        results = await self.split_many({experiment_name: variants})
+        return results[experiment_name]
+
+    async def split_many(self, experiments):
+        """
+        Used to split and track user experience amongst many experiments at
+        once.
+
+        See ``cleaver.Cleaver.split_many``.
+        """
+        specs = {}
+        for experiment_name, variants in experiments.items():
+            if not isinstance(experiment_name, string_types):
+                raise RuntimeError(
+                    'Invalid experiment name: %s must be a string.' %
+                    experiment_name
+                )
+            specs[experiment_name] = self._compile_variants(
+                experiment_name,
+                variants
+            )
+
+        if not specs:
+            return {}
+
+        b = self._backend
+        requested = dict((name, spec.keys) for name, spec in specs.items())
+
+        # Record any experiments that don't exist already
+        found = await self._get_experiments(requested)
+
+        if self.count_humans_only is False and await self.human() is not True:
+            await self.mark_human()
+
+        missing = [name for name in requested if found.get(name) is None]
+        if missing:
+            for name in missing:
+                await self._save_experiment(name, requested[name])
+            found.update(await self._get_experiments(
+                dict((name, requested[name]) for name in missing)
+            ))
+
+        for name, experiment in found.items():
+            self._check_variants(experiment, specs[name])
+
+        overrides = self._environ.get('cleaver.override', {})
+        chosen = {}
+        for name in specs:
+            if name in overrides:
+                chosen[name] = overrides[name]
+
+        lookup = [name for name in specs if name not in chosen]
+        if self.hash_assignment:
+            # Hashed variants are derived from the visitor's identity, so
+            # there's nothing to retrieve; just store the ones not yet stored
+            hashed = {}
+            for name in lookup:
+                hashed[name] = specs[name].hashed(self._hash_key(name))
+            if hashed:
+                await self._store_hashed(hashed)
+            chosen.update(hashed)
+        else:
+            # Retrieve the variants assigned to the current user...
+            assigned = {}
+            if lookup:
+                assigned = await b.get_variants(self.assignment_identity,
+                                                lookup)
+
+            # ...and choose (and store) the rest
+            new = {}
+            for name in lookup:
+                variant = assigned.get(name)
+                if variant is None:
+                    variant = new[name] = specs[name].random()
+                chosen[name] = variant
+
+            if new:
+                await b.participate_many(self.assignment_identity, new)
+
+        results = {}
+        for name, spec in specs.items():
+            results[name] = spec.value_of[chosen[name]]
+        return results
+
+    async def score(self, experiment_name):
+        """
+        Used to mark the current user's experiment variant as "converted".
+
+        See ``cleaver.Cleaver.score``.
+        """
+        variant = await self._backend.get_variant(
+            self.assignment_identity,
+            experiment_name
+        )
+        if variant and await self.human() is True:
+            await self._backend.mark_conversion(experiment_name, variant)
+
+    async def score_many(self, experiment_names):
+        """
+        See ``cleaver.Cleaver.score_many``.
+        """
+        experiment_names = list(experiment_names)
+        if not experiment_names:
+            return
+        variants = await self._backend.get_variants(
+            self.assignment_identity,
+            experiment_names
+        )
+        if variants and await self.human() is True:
+            await self._backend.mark_conversions(variants)
+
+    async def score_all(self):
+        """
+        See ``cleaver.Cleaver.score_all``.
+        """
+        variants = await self._backend.get_assignments(
+            self.assignment_identity
+        )
+        if variants and await self.human() is True:
+            await self._backend.mark_conversions(variants)
+
+    async def humanizing_javascript(self):
+        if await self.human():
+            return ''
+        return self._humanizing_javascript()
+
+    async def _store_hashed(self, variants):
+        # See ``cleaver.Cleaver._store_hashed``
+        b = self._backend
+        identity = self.assignment_identity
+        unrecorded = _unrecorded(b, identity, variants)
+        new = {}
+        for name, variant in unrecorded.items():
+            if await b.set_variant(identity, name, variant):
+                new[name] = variant
+        if new and await self.human() is True:
+            await b.mark_participants(new)
+        _record(b, identity, unrecorded)
+
+    async def _get_experiments(self, experiments):
+        if self.experiment_registry is None:
+            return await self._backend.get_experiments(experiments)
+        found, missing = self.experiment_registry.cached(
+            self._backend, experiments
+        )
+        if missing:
+            retrieved = await self._backend.get_experiments(missing)
+            self.experiment_registry.store(self._backend, retrieved)
+            found.update(retrieved)
+        return found
+
+    async def _save_experiment(self, name, variants):
+        await self._backend.save_experiment(name, variants)
+        if self.experiment_registry is not None:
+            self.experiment_registry.invalidate(self._backend, name)
+
+
+class AsyncSplitMiddleware(object):
+
+    def __init__(self, app, identity, backend, scope_key='cleaver',
+                 allow_override=False, count_humans_only=False,
+                 human_callback_token='__cleaver_human_verification__',
+                 experiment_registry=default_registry,
+                 hash_assignment=False, hash_salt='', max_body_size=1024):
+        """
+        The ASGI counterpart to ``cleaver.SplitMiddleware``; makes an
+        ``AsyncCleaver`` instance available every HTTP request under
+        ``scope['cleaver']``.
+
+        :param identity any implementation of
+                          ``identity.CleaverIdentityProvider`` or
+                          a callable that emulates
+                          ``identity.CleaverIdentityProvider.get_identity``
+                          (which will be passed the ASGI scope).
+        :param backend any implementation of
+                            ``cleaver.backend.aio.AsyncCleaverBackend``, or
+                            of ``cleaver.backend.CleaverBackend`` (which will
+                            be wrapped in a
+                            ``cleaver.backend.aio.ThreadPoolBackend``).
+        :param scope_key location where the Cleaver instance will be keyed in
+                         the ASGI scope
+        :param max_body_size the largest human verification request body (in
+                             bytes) that will be read.
+
+        Every other argument is the same as ``cleaver.SplitMiddleware``.
+        """
+        self.app = app
+
+        if not isinstance(identity, CleaverIdentityProvider) and \
+                not callable(identity):
+            raise RuntimeError(
+                '%s must be callable or implement '
+                'cleaver.identity.CleaverIdentityProvider' % identity
+            )
+        if isinstance(backend, CleaverBackend):
+            backend = ThreadPoolBackend(backend)
+        if not isinstance(backend, AsyncCleaverBackend):
+            raise RuntimeError(
+                '%s must implement cleaver.backend.CleaverBackend or '
+                'cleaver.backend.aio.AsyncCleaverBackend' % backend
+            )
+
+        self._identity = identity
+        self._backend = backend
+        self.scope_key = scope_key
+        self.allow_override = allow_override
+        self.count_humans_only = count_humans_only
+        self.human_callback_token = human_callback_token
+        self.experiment_registry = experiment_registry
+        self.hash_assignment = hash_assignment
+        self.hash_salt = hash_salt
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        scope = dict(scope)
+        cleaver = AsyncCleaver(
+            scope,
+            self._identity,
+            self._backend,
+            count_humans_only=self.count_humans_only,
+            human_callback_token=self.human_callback_token,
+            experiment_registry=self.experiment_registry,
+            hash_assignment=self.hash_assignment,
+            hash_salt=self.hash_salt
+        )
+        scope[self.scope_key] = cleaver
+
+        if self.allow_override:
+            self._handle_variant_overrides(scope)
+
+        #
+        # If human verification is required and this request represents
+        # a valid AJAX callback (which bots aren't generally capable of), then
+        # mark the visitor as human.
+        #
+        if self.count_humans_only and \
+                scope.get('method', '') == 'POST' and \
+                self.human_callback_token in scope.get('path', ''):
+
+            body = await self._read_body(receive)
+            status = 401
+            if body is not None:
+                x, y, z = _parse_callback(body)
+
+                # See ``cleaver.SplitMiddleware``
+                if x and y and z and x + y == z:
+                    await cleaver.mark_human()
+
+                    # If the visitor has been assigned any experiment
+                    # variants, tally their participation.
+                    assignments = await self._backend.get_assignments(
+                        cleaver.assignment_identity
+                    )
+                    if assignments:
+                        await self._backend.mark_participants(assignments)
+                    status = 204
+
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(b'content-type', b'text/plain')]
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        return await self.app(scope, receive, send)
+
+    async def _read_body(self, receive):
+        """
+        Read the request body (up to ``max_body_size`` bytes).
+
+        Returns ``bytes``, or ``None`` if the body is too large or the client
+        disconnected.
+        """
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                return None
+            body += message.get('body', b'')
+            if len(body) > self.max_body_size:
+                return None
+            if not message.get('more_body', False):
+                return body
+
+    def _handle_variant_overrides(self, scope):
+        # See ``cleaver.SplitMiddleware._handle_variant_overrides``
+        parsed = _parse_overrides(
+            scope.get('query_string', b'').decode('latin-1')
+        )
+        if parsed is not None:
+            overrides, query_string = parsed
+            scope['query_string'] = query_string.encode('latin-1')
+            scope.setdefault('cleaver.override', {}).update(overrides)
@@ -26,6 +26,22 @@ class CleaverBackend(object):
 
     __metaclass__ = abc.ABCMeta
 
+    def begin(self):
+        """
+        Start a unit of work (called by ``cleaver.SplitMiddleware`` at the
+        start of each request when ``unit_of_work`` is True).
+
+        Backends that support it may defer committing changes made by the
+        current thread until ``end`` is called; the default implementation
+        does nothing.
+        """
+
+    def end(self):
+        """
+        Commit (and finish) the unit of work started by ``begin``; the
+        default implementation does nothing.
+        """
+
     @abc.abstractmethod
     def all_experiments(self):
         """
@@ -47,6 +63,28 @@ class CleaverBackend(object):
         """
         return  # pragma: nocover
 
+    def get_experiments(self, experiments):
+        """
+        Retrieve many experiments at once.
+
+        The default implementation calls ``get_experiment`` for each
+        experiment; backends are encouraged to override it with a single
+        query.
+
+        :param experiments a dictionary mapping unique string experiment
+                           names to a list of variant names
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        found = {}
+        for name, variants in experiments.items():
+            experiment = self.get_experiment(name, variants)
+            if experiment is not None:
+                found[name] = experiment
+        return found
+
     @abc.abstractmethod
     def save_experiment(self, name, variants):
         """
@@ -80,6 +118,45 @@ class CleaverBackend(object):
         """
         return  # pragma: nocover
 
+    def get_variants(self, identity, experiment_names):
+        """
+        Retrieve the variants for a specific user and many experiments at
+        once.
+
+        The default implementation calls ``get_variant`` for each experiment;
+        backends are encouraged to override it with a single query.
+
+        :param identity a unique user identifier
+        :param experiment_names a list of string experiment names
+
+        Returns a dictionary mapping experiment names to variant names
+        (experiments the user hasn't been assigned a variant for are
+        omitted).
+        """
+        variants = {}
+        for experiment_name in experiment_names:
+            variant = self.get_variant(identity, experiment_name)
+            if variant is not None:
+                variants[experiment_name] = variant
+        return variants
+
+    def get_assignments(self, identity):
+        """
+        Retrieve every variant assigned to a specific user.
+
+        The default implementation calls ``all_experiments`` and
+        ``get_variants``; backends are encouraged to override it with
+        a single query.
+
+        :param identity a unique user identifier
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        return self.get_variants(
+            identity,
+            [e.name for e in self.all_experiments()]
+        )
+
     @abc.abstractmethod
     def set_variant(self, identity, experiment_name, variant):
         """
@@ -88,6 +165,9 @@ class CleaverBackend(object):
         :param identity a unique user identifier
         :param experiment_name the string name of the experiment
         :param variant the string name of the variant
+
+        Returns ``True`` if a new assignment was stored, and ``False`` if
+        the user already had a variant for the experiment.
         """
         return  # pragma: nocover
 
@@ -101,6 +181,20 @@ class CleaverBackend(object):
         """
         return  # pragma: nocover
 
+    def mark_participants(self, variants):
+        """
+        Mark a participation for many experiment variants at once.
+
+        The default implementation calls ``mark_events``.
+
+        :param variants a dictionary mapping string experiment names to
+                        string variant names
+        """
+        self.mark_events([
+            ('PARTICIPANT', experiment_name, variant)
+            for experiment_name, variant in variants.items()
+        ])
+
     def participate(self, identity, experiment_name, variant):
         """
         Set the variant for a specific user and mark a participation for the
@@ -114,6 +208,21 @@ class CleaverBackend(object):
         if self.is_verified_human(identity):
             self.mark_participant(experiment_name, variant)
 
+    def participate_many(self, identity, variants):
+        """
+        Set the variants for a specific user and mark a participation for
+        many experiments at once.
+
+        The default implementation calls ``participate`` for each experiment;
+        backends are encouraged to override it with a single transaction.
+
+        :param identity a unique user identifier
+        :param variants a dictionary mapping string experiment names to
+                        string variant names
+        """
+        for experiment_name, variant in variants.items():
+            self.participate(identity, experiment_name, variant)
+
     @abc.abstractmethod
     def mark_conversion(self, experiment_name, variant):
         """
@@ -124,6 +233,70 @@ class CleaverBackend(object):
         """
         return  # pragma: nocover
 
+    def mark_conversions(self, variants):
+        """
+        Mark a conversion for many experiment variants at once.
+
+        The default implementation calls ``mark_events``.
+
+        :param variants a dictionary mapping string experiment names to
+                        string variant names
+        """
+        self.mark_events([
+            ('CONVERSION', experiment_name, variant)
+            for experiment_name, variant in variants.items()
+        ])
+
+    def mark_events(self, events):
+        """
+        Mark many participations and conversions at once.
+
+        The default implementation calls ``write_many``.
+
+        :param events a list of (type, experiment_name, variant) tuples, where
+                      type is ``'PARTICIPANT'`` or ``'CONVERSION'``
+        """
+        if events:
+            self.write_many([], events)
+
+    def mark_event_totals(self, totals):
+        """
+        Add to many participation and conversion totals at once.
+
+        The default implementation calls ``mark_events`` (with each event
+        repeated ``amount`` times); backends that can add to a total directly
+        are encouraged to override it.
+
+        :param totals a dictionary mapping (type, experiment_name, variant)
+                      tuples, where type is ``'PARTICIPANT'`` or
+                      ``'CONVERSION'``, to integer amounts
+        """
+        events = []
+        for key, amount in totals.items():
+            events.extend([key] * amount)
+        self.mark_events(events)
+
+    def write_many(self, assignments, events):
+        """
+        Store many variant assignments and events at once.
+
+        The default implementation calls ``set_variant``, ``mark_participant``
+        and ``mark_conversion`` for each item; backends are encouraged to
+        override it with a single transaction.
+
+        :param assignments a list of (identity, experiment_name, variant)
+                           tuples
+        :param events a list of (type, experiment_name, variant) tuples, where
+                      type is ``'PARTICIPANT'`` or ``'CONVERSION'``
+        """
+        for identity, experiment_name, variant in assignments:
+            self.set_variant(identity, experiment_name, variant)
+        for type, experiment_name, variant in events:
+            if type == 'PARTICIPANT':
+                self.mark_participant(experiment_name, variant)
+            else:
+                self.mark_conversion(experiment_name, variant)
+
     @abc.abstractmethod
     def participants(self, experiment_name, variant):
         """
@@ -141,3 +314,34 @@ class CleaverBackend(object):
         Returns an integer.
         """
         return  # pragma: nocover
+
+    def stats(self, experiment_names):
+        """
+        Retrieve the participant and conversion totals for every variant of
+        many experiments at once.
+
+        The default implementation calls ``get_experiments``, and then
+        ``participants`` and ``conversions`` for each variant; backends are
+        encouraged to override it with a single query.
+
+        :param experiment_names a list of string experiment names
+
+        Returns a dictionary mapping experiment names to dictionaries mapping
+        variant names to (participants, conversions) tuples (experiments that
+        don't exist are omitted).
+        """
+        if not experiment_names:
+            return {}
+        experiments = self.get_experiments(
+            dict((name, None) for name in experiment_names)
+        )
+        return dict(
+            (name, dict(
+                (variant, (
+                    self.participants(name, variant),
+                    self.conversions(name, variant)
+                ))
+                for variant in experiment.variants
+            ))
+            for name, experiment in experiments.items()
+        )
@@ -0,0 +1,267 @@
+import atexit
+import logging
+import os
+import threading
+
+from cleaver.backend import CleaverBackend
+
+log = logging.getLogger(__name__)
+
+
+class AggregatingBackend(CleaverBackend):
+    """
+    Wraps another ``CleaverBackend`` and tallies participations and
+    conversions in memory, writing them to the wrapped backend in batches
+    (with a single call to ``CleaverBackend.mark_event_totals``) from
+    a background thread.
+
+    Thousands of increments to the same (experiment, variant) total between
+    flushes become a single write.  Everything else (including variant
+    assignments) is passed straight through to the wrapped backend.
+
+    Pending tallies are written every ``interval`` seconds, as soon as
+    ``max_pending`` increments have accumulated, and when the process exits.
+    They're never written from the thread that records them, so a slow (or
+    failing) backend doesn't hold up requests.
+
+    If a write fails, the tallies are kept and retried after ``interval``
+    seconds, unless that would mean keeping more than ``max_pending``
+    increments, in which case they're discarded (and an error is logged);
+    this limits how much data can be lost if the process crashes.
+
+    :param backend any implementation of ``cleaver.backend.CleaverBackend``
+    :param interval the number of seconds between background flushes
+    :param max_pending the number of pending increments which triggers an
+                       immediate (background) flush, and the most that are
+                       kept after a failed flush
+    """
+
+    def __init__(self, backend, interval=5, max_pending=10000):
+        if not isinstance(backend, CleaverBackend):
+            raise RuntimeError(
+                '%s must implement cleaver.backend.CleaverBackend' % backend
+            )
+        if interval <= 0 or max_pending < 1:
+            raise RuntimeError(
+                '`interval` and `max_pending` must be positive.'
+            )
+        self.backend = backend
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._counts = {}  # (type, experiment_name, variant) -> increments
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._pid = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        atexit.register(self.close)
+
+    def _start(self):
+        # Threads don't survive a fork, and tallies inherited from the
+        # parent process are the parent's to write.
+        if self._pid == os.getpid():
+            return
+        self._lock.acquire()
+        try:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._counts, self._pending = {}, 0
+            self._pid = os.getpid()
+            self._stopped = threading.Event()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='cleaver-aggregator'
+            )
+            self._thread.daemon = True
+            self._thread.start()
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        stopped, wake = self._stopped, self._wake
+        while True:
+            wake.wait(self.interval)
+            wake.clear()
+            if stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to write pending Cleaver events')
+                # Retry after a full interval, rather than as soon as
+                # ``max_pending`` is reached again
+                if stopped.wait(self.interval):
+                    break
+
+    def close(self):
+        """
+        Stop the background thread, and write any pending tallies.
+        """
+        self._stopped.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        self._pid = None
+        self.flush()
+
+    def flush(self):
+        """
+        Write every pending tally to the wrapped backend.
+
+        If the write fails, the tallies are kept (and retried by the next
+        flush) unless that would mean keeping more than ``max_pending``
+        increments, and the exception is raised.
+        """
+        self._lock.acquire()
+        try:
+            counts, self._counts = self._counts, {}
+            pending, self._pending = self._pending, 0
+        finally:
+            self._lock.release()
+        if not counts:
+            return
+
+        try:
+            self.backend.mark_event_totals(counts)
+        except Exception:
+            self._retain(counts, pending)
+            raise
+
+    def _retain(self, counts, pending):
+        self._lock.acquire()
+        try:
+            retained = self._pending + pending <= self.max_pending
+            if retained:
+                self._merge(counts)
+        finally:
+            self._lock.release()
+        if not retained:
+            log.error(
+                'Discarded %d pending Cleaver events (more than %d are '
+                'pending)', pending, self.max_pending
+            )
+
+    def _merge(self, counts):
+        # Called with the lock held
+        for key, amount in counts.items():
+            self._counts[key] = self._counts.get(key, 0) + amount
+            self._pending += amount
+
+    def _add(self, counts):
+        if not counts:
+            return
+        self._start()
+        self._lock.acquire()
+        try:
+            self._merge(counts)
+            full = self._pending >= self.max_pending
+        finally:
+            self._lock.release()
+        if full:
+            self._wake.set()
+
+    def _increment(self, events):
+        counts = {}
+        for key in events:
+            counts[key] = counts.get(key, 0) + 1
+        self._add(counts)
+
+    def mark_event_totals(self, totals):
+        self._add(dict(
+            (key, amount) for key, amount in totals.items() if amount
+        ))
+
+    def begin(self):
+        self.backend.begin()
+
+    def end(self):
+        self.backend.end()
+
+    def all_experiments(self):
+        return self.backend.all_experiments()
+
+    def get_experiment(self, name, variants):
+        return self.backend.get_experiment(name, variants)
+
+    def get_experiments(self, experiments):
+        return self.backend.get_experiments(experiments)
+
+    def save_experiment(self, name, variants):
+        return self.backend.save_experiment(name, variants)
+
+    def is_verified_human(self, identity):
+        return self.backend.is_verified_human(identity)
+
+    def mark_human(self, identity):
+        return self.backend.mark_human(identity)
+
+    def get_variant(self, identity, experiment_name):
+        return self.backend.get_variant(identity, experiment_name)
+
+    def get_variants(self, identity, experiment_names):
+        return self.backend.get_variants(identity, experiment_names)
+
+    def get_assignments(self, identity):
+        return self.backend.get_assignments(identity)
+
+    def set_variant(self, identity, experiment_name, variant):
+        return self.backend.set_variant(identity, experiment_name, variant)
+
+    def participate_many(self, identity, variants):
+        assigned = self.backend.get_variants(identity, list(variants))
+        new = [
+            (experiment_name, variant)
+            for experiment_name, variant in variants.items()
+            if experiment_name not in assigned
+        ]
+        if not new:
+            return
+        self.backend.write_many([
+            (identity, experiment_name, variant)
+            for experiment_name, variant in new
+        ], [])
+        if self.is_verified_human(identity):
+            self._increment([
+                ('PARTICIPANT', experiment_name, variant)
+                for experiment_name, variant in new
+            ])
+
+    def mark_participant(self, experiment_name, variant):
+        self._increment([('PARTICIPANT', experiment_name, variant)])
+
+    def mark_conversion(self, experiment_name, variant):
+        self._increment([('CONVERSION', experiment_name, variant)])
+
+    def write_many(self, assignments, events):
+        if assignments:
+            self.backend.write_many(assignments, [])
+        self._increment(events)
+
+    def participants(self, experiment_name, variant):
+        return self.backend.participants(experiment_name, variant) + \
+            self._counts.get(('PARTICIPANT', experiment_name, variant), 0)
+
+    def conversions(self, experiment_name, variant):
+        return self.backend.conversions(experiment_name, variant) + \
+            self._counts.get(('CONVERSION', experiment_name, variant), 0)
+
+    def stats(self, experiment_names):
+        stats = self.backend.stats(experiment_names)
+        for experiment_name, variants in stats.items():
+            for variant, (participants, conversions) in variants.items():
+                variants[variant] = (
+                    participants + self._counts.get(
+                        ('PARTICIPANT', experiment_name, variant), 0
+                    ),
+                    conversions + self._counts.get(
+                        ('CONVERSION', experiment_name, variant), 0
+                    )
+                )
+        return stats
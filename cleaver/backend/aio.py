@@ -0,0 +1,316 @@
+import asyncio
+import abc
+from functools import partial
+
+from cleaver.backend import CleaverBackend
+
+
+class AsyncCleaverBackend(abc.ABC):
+    """
+    The asyncio counterpart to ``cleaver.backend.CleaverBackend``, used by
+    ``cleaver.asgi.AsyncSplitMiddleware``.
+
+    Every method mirrors the method of the same name on ``CleaverBackend``,
+    but is a coroutine.  Existing (synchronous) backends can be adapted with
+    ``ThreadPoolBackend``.
+    """
+
+    @abc.abstractmethod
+    async def all_experiments(self):
+        """
+        Retrieve every available experiment.
+
+        Returns a list of ``cleaver.experiment.Experiment``s
+        """
+        return  # pragma: nocover
+
+    @abc.abstractmethod
+    async def get_experiment(self, name, variants):
+        """
+        Retrieve an experiment by its name and variants (assuming it exists).
+
+        Returns a ``cleaver.experiment.Experiment`` or ``None``
+        """
+        return  # pragma: nocover
+
+    async def get_experiments(self, experiments):
+        """
+        Retrieve many experiments at once.
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        found = {}
+        for name, variants in experiments.items():
+            experiment = await self.get_experiment(name, variants)
+            if experiment is not None:
+                found[name] = experiment
+        return found
+
+    @abc.abstractmethod
+    async def save_experiment(self, name, variants):
+        """
+        Persist an experiment and its variants (unless they already exist).
+        """
+        return  # pragma: nocover
+
+    @abc.abstractmethod
+    async def is_verified_human(self, identity):
+        return  # pragma: nocover
+
+    @abc.abstractmethod
+    async def mark_human(self, identity):
+        return  # pragma: nocover
+
+    @abc.abstractmethod
+    async def get_variant(self, identity, experiment_name):
+        """
+        Retrieve the variant for a specific user and experiment (if it exists).
+
+        Returns a ``String`` or `None`
+        """
+        return  # pragma: nocover
+
+    async def get_variants(self, identity, experiment_names):
+        """
+        Retrieve the variants for a specific user and many experiments at
+        once.
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        variants = {}
+        for experiment_name in experiment_names:
+            variant = await self.get_variant(identity, experiment_name)
+            if variant is not None:
+                variants[experiment_name] = variant
+        return variants
+
+    async def get_assignments(self, identity):
+        """
+        Retrieve every variant assigned to a specific user.
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        return await self.get_variants(
+            identity,
+            [e.name for e in await self.all_experiments()]
+        )
+
+    @abc.abstractmethod
+    async def set_variant(self, identity, experiment_name, variant):
+        """
+        Set the variant for a specific user.
+
+        Returns ``True`` if a new assignment was stored, and ``False`` if
+        the user already had a variant for the experiment.
+        """
+        return  # pragma: nocover
+
+    @abc.abstractmethod
+    async def mark_participant(self, experiment_name, variant):
+        """
+        Mark a participation for a specific experiment variant.
+        """
+        return  # pragma: nocover
+
+    async def mark_participants(self, variants):
+        """
+        Mark a participation for many experiment variants at once.
+        """
+        await self.mark_events([
+            ('PARTICIPANT', experiment_name, variant)
+            for experiment_name, variant in variants.items()
+        ])
+
+    async def participate(self, identity, experiment_name, variant):
+        """
+        Set the variant for a specific user and mark a participation for the
+        experiment (for verified humans only).
+        """
+        await self.set_variant(identity, experiment_name, variant)
+        if await self.is_verified_human(identity):
+            await self.mark_participant(experiment_name, variant)
+
+    async def participate_many(self, identity, variants):
+        """
+        Set the variants for a specific user and mark a participation for
+        many experiments at once.
+        """
+        for experiment_name, variant in variants.items():
+            await self.set_variant(identity, experiment_name, variant)
+        if variants and await self.is_verified_human(identity):
+            for experiment_name, variant in variants.items():
+                await self.mark_participant(experiment_name, variant)
+
+    @abc.abstractmethod
+    async def mark_conversion(self, experiment_name, variant):
+        """
+        Mark a conversion for a specific experiment variant.
+        """
+        return  # pragma: nocover
+
+    async def mark_conversions(self, variants):
+        """
+        Mark a conversion for many experiment variants at once.
+        """
+        await self.mark_events([
+            ('CONVERSION', experiment_name, variant)
+            for experiment_name, variant in variants.items()
+        ])
+
+    async def mark_events(self, events):
+        """
+        Mark many participations and conversions at once.
+        """
+        if events:
+            await self.write_many([], events)
+
+    async def write_many(self, assignments, events):
+        """
+        Store many variant assignments and events at once.
+        """
+        for identity, experiment_name, variant in assignments:
+            await self.set_variant(identity, experiment_name, variant)
+        for type, experiment_name, variant in events:
+            if type == 'PARTICIPANT':
+                await self.mark_participant(experiment_name, variant)
+            else:
+                await self.mark_conversion(experiment_name, variant)
+
+    @abc.abstractmethod
+    async def participants(self, experiment_name, variant):
+        """
+        The number of participants for a certain variant.
+
+        Returns an integer.
+        """
+        return  # pragma: nocover
+
+    @abc.abstractmethod
+    async def conversions(self, experiment_name, variant):
+        """
+        The number of conversions for a certain variant.
+
+        Returns an integer.
+        """
+        return  # pragma: nocover
+
+    async def stats(self, experiment_names):
+        """
+        Retrieve the participant and conversion totals for every variant of
+        many experiments at once.
+
+        Returns a dictionary mapping experiment names to dictionaries mapping
+        variant names to (participants, conversions) tuples (experiments that
+        don't exist are omitted).
+        """
+        if not experiment_names:
+            return {}
+        experiments = await self.get_experiments(
+            dict((name, None) for name in experiment_names)
+        )
+        found = {}
+        for name, experiment in experiments.items():
+            found[name] = {}
+            for variant in experiment.variants:
+                found[name][variant] = (
+                    await self.participants(name, variant),
+                    await self.conversions(name, variant)
+                )
+        return found
+
+
+class ThreadPoolBackend(AsyncCleaverBackend):
+    """
+    Adapts a synchronous ``cleaver.backend.CleaverBackend`` (like
+    ``cleaver.backend.db.SQLAlchemyBackend``) to ``AsyncCleaverBackend`` by
+    running each call in a thread pool, so that the event loop is never
+    blocked on experiment I/O.
+
+    :param backend any implementation of ``cleaver.backend.CleaverBackend``
+    :param executor a ``concurrent.futures.Executor`` to run calls in
+                    (defaults to the event loop's default executor).
+    """
+
+    def __init__(self, backend, executor=None):
+        if not isinstance(backend, CleaverBackend):
+            raise RuntimeError(
+                '%s must implement cleaver.backend.CleaverBackend' % backend
+            )
+        self.backend = backend
+        self.executor = executor
+
+    def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self.executor,
+            partial(getattr(self.backend, method), *args)
+        )
+
+    async def all_experiments(self):
+        return await self._run('all_experiments')
+
+    async def get_experiment(self, name, variants):
+        return await self._run('get_experiment', name, variants)
+
+    async def get_experiments(self, experiments):
+        return await self._run('get_experiments', experiments)
+
+    async def save_experiment(self, name, variants):
+        return await self._run('save_experiment', name, variants)
+
+    async def is_verified_human(self, identity):
+        return await self._run('is_verified_human', identity)
+
+    async def mark_human(self, identity):
+        return await self._run('mark_human', identity)
+
+    async def get_variant(self, identity, experiment_name):
+        return await self._run('get_variant', identity, experiment_name)
+
+    async def get_variants(self, identity, experiment_names):
+        return await self._run('get_variants', identity, experiment_names)
+
+    async def get_assignments(self, identity):
+        return await self._run('get_assignments', identity)
+
+    async def set_variant(self, identity, experiment_name, variant):
+        return await self._run(
+            'set_variant', identity, experiment_name, variant
+        )
+
+    async def mark_participant(self, experiment_name, variant):
+        return await self._run('mark_participant', experiment_name, variant)
+
+    async def mark_participants(self, variants):
+        return await self._run('mark_participants', variants)
+
+    async def participate(self, identity, experiment_name, variant):
+        return await self._run(
+            'participate', identity, experiment_name, variant
+        )
+
+    async def participate_many(self, identity, variants):
+        return await self._run('participate_many', identity, variants)
+
+    async def mark_conversion(self, experiment_name, variant):
+        return await self._run('mark_conversion', experiment_name, variant)
+
+    async def mark_conversions(self, variants):
+        return await self._run('mark_conversions', variants)
+
+    async def mark_events(self, events):
+        return await self._run('mark_events', events)
+
+    async def write_many(self, assignments, events):
+        return await self._run('write_many', assignments, events)
+
+    async def participants(self, experiment_name, variant):
+        return await self._run('participants', experiment_name, variant)
+
+    async def conversions(self, experiment_name, variant):
+        return await self._run('conversions', experiment_name, variant)
+
+    async def stats(self, experiment_names):
+        return await self._run('stats', experiment_names)
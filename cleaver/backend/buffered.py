@@ -0,0 +1,123 @@
+from cleaver.backend import CleaverBackend
+
+
+class BufferedBackend(CleaverBackend):
+    """
+    Wraps another ``CleaverBackend`` and holds on to variant assignments,
+    participations and conversions in memory until ``flush`` is called, at
+    which point they're written with a single call to
+    ``CleaverBackend.write_many``.
+
+    Reads made before the flush take pending writes into account.
+
+    Not generally instantiated directly; used by ``cleaver.SplitMiddleware``
+    (when ``buffer_writes`` is True) to defer writes until the end of each
+    request.
+
+    :param backend any implementation of ``cleaver.backend.CleaverBackend``
+    """
+
+    def __init__(self, backend):
+        if not isinstance(backend, CleaverBackend):
+            raise RuntimeError(
+                '%s must implement cleaver.backend.CleaverBackend' % backend
+            )
+        self.backend = backend
+        self.assignments = []
+        self.events = []
+        self._variants = {}
+
+    def flush(self):
+        """
+        Write every pending assignment and event to the wrapped backend.
+        """
+        assignments, events = self.assignments, self.events
+        self.assignments, self.events = [], []
+        self._variants = {}
+        if assignments or events:
+            self.backend.write_many(assignments, events)
+
+    def all_experiments(self):
+        return self.backend.all_experiments()
+
+    def get_experiment(self, name, variants):
+        return self.backend.get_experiment(name, variants)
+
+    def get_experiments(self, experiments):
+        return self.backend.get_experiments(experiments)
+
+    def save_experiment(self, name, variants):
+        return self.backend.save_experiment(name, variants)
+
+    def is_verified_human(self, identity):
+        return self.backend.is_verified_human(identity)
+
+    def mark_human(self, identity):
+        return self.backend.mark_human(identity)
+
+    def get_variant(self, identity, experiment_name):
+        if (identity, experiment_name) in self._variants:
+            return self._variants[(identity, experiment_name)]
+        return self.backend.get_variant(identity, experiment_name)
+
+    def get_variants(self, identity, experiment_names):
+        variants = self.backend.get_variants(identity, [
+            experiment_name for experiment_name in experiment_names
+            if (identity, experiment_name) not in self._variants
+        ])
+        for experiment_name in experiment_names:
+            if (identity, experiment_name) in self._variants:
+                variants[experiment_name] = self._variants[
+                    (identity, experiment_name)
+                ]
+        return variants
+
+    def get_assignments(self, identity):
+        variants = self.backend.get_assignments(identity)
+        for (i, experiment_name), variant in self._variants.items():
+            if i == identity:
+                variants[experiment_name] = variant
+        return variants
+
+    def set_variant(self, identity, experiment_name, variant):
+        if self.get_variant(identity, experiment_name) is not None:
+            return False
+        self._variants[(identity, experiment_name)] = variant
+        self.assignments.append((identity, experiment_name, variant))
+        return True
+
+    def participate_many(self, identity, variants):
+        assigned = self.get_variants(identity, list(variants))
+        new = [
+            (experiment_name, variant)
+            for experiment_name, variant in variants.items()
+            if experiment_name not in assigned
+        ]
+        if not new:
+            return
+        for experiment_name, variant in new:
+            self._variants[(identity, experiment_name)] = variant
+            self.assignments.append((identity, experiment_name, variant))
+        if self.is_verified_human(identity):
+            for experiment_name, variant in new:
+                self.mark_participant(experiment_name, variant)
+
+    def mark_participant(self, experiment_name, variant):
+        self.events.append(('PARTICIPANT', experiment_name, variant))
+
+    def mark_conversion(self, experiment_name, variant):
+        self.events.append(('CONVERSION', experiment_name, variant))
+
+    def _pending(self, type, experiment_name, variant):
+        return len([
+            e for e in self.events
+            if e == (type, experiment_name, variant)
+        ])
+
+    def participants(self, experiment_name, variant):
+        return self.backend.participants(experiment_name, variant) + \
+            self._pending('PARTICIPANT', experiment_name, variant)
+
+    def conversions(self, experiment_name, variant):
+        return self.backend.conversions(experiment_name, variant) + \
+            self._pending('CONVERSION', experiment_name, variant)
@@ -1,3 +1,5 @@
+import random
+import threading
 from datetime import datetime
 
 from . import model
@@ -18,26 +20,386 @@ def _sqlalchemy_installed():
     return sqlalchemy
 _sqlalchemy_installed()
 
-from sqlalchemy import and_  # noqa
+from sqlalchemy import and_, bindparam, func, select, text  # noqa
+from sqlalchemy.orm import joinedload  # noqa
+from sqlalchemy.exc import IntegrityError  # noqa
 
+# SQLAlchemy 1.4 accepts ``select(a, b)``, which 2.0 requires; earlier
+# versions only accept ``select([a, b])``
+_LEGACY_SELECT = tuple(
+    int(part) for part in _sqlalchemy_installed().__version__.split('.')[:2]
+) < (1, 4)
 
-class SQLAlchemyBackend(CleaverBackend):
+
+def _select(*columns):
+    if _LEGACY_SELECT:
+        return select(list(columns))  # pragma: nocover
+    return select(*columns)
+
+
+def _build_upsert(dialect):
+    """
+    Build a dialect-specific statement that inserts a ``TrackedEvent`` row
+    or, if it already exists, adds to its total.
+
+    Returns ``None`` for databases without upsert support.
+    """
+    table = model.TrackedEvent.__table__
+    statement = None
+
+    if dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['type', 'experiment_id', 'variant_id',
+                            'shard'],
+            set_={'total': table.c.total + statement.excluded.total}
+        )
+    elif dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        statement = statement.on_duplicate_key_update(
+            total=table.c.total + statement.inserted.total
+        )
+    elif dialect.name == 'sqlite' and \
+            getattr(dialect.dbapi, 'sqlite_version_info', ()) >= (3, 24):
+        statement = text(
+            'INSERT INTO %s (type, experiment_id, variant_id, shard, '
+            'total) VALUES (:type, :experiment_id, :variant_id, :shard, '
+            ':total) ON CONFLICT (type, experiment_id, variant_id, shard) '
+            'DO UPDATE SET total = total + excluded.total' % table.name
+        ).bindparams(bindparam('type', type_=table.c.type.type))
+    return statement
+
+
+def _build_insert_ignore(dialect):
+    """
+    Build a dialect-specific statement that inserts a ``Participant`` row
+    unless the visitor already has one for the experiment (in which case it
+    does nothing, rather than raising an ``IntegrityError``).
+
+    Returns ``None`` for databases without support for ignoring conflicts.
+    """
+    table = model.Participant.__table__
+    statement = None
+
+    if dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).on_conflict_do_nothing(
+            index_elements=['identity', 'experiment_id']
+        )
+    elif dialect.name == 'mysql':
+        statement = table.insert().prefix_with('IGNORE')
+    elif dialect.name == 'sqlite' and \
+            getattr(dialect.dbapi, 'sqlite_version_info', ()) >= (3, 24):
+        statement = text(
+            'INSERT INTO %s (identity, experiment_id, variant_id) VALUES '
+            '(:identity, :experiment_id, :variant_id) ON CONFLICT '
+            '(identity, experiment_id) DO NOTHING' % table.name
+        ).bindparams(bindparam('identity', type_=table.c.identity.type))
+    return statement
+
+
+class _BaseSQLAlchemyBackend(object):
+    """
+    The parts of ``SQLAlchemyBackend`` (and ``AsyncSQLAlchemyBackend``) that
+    don't depend on how statements are executed, including an in-memory cache
+    of experiment and variant IDs (experiments and their variants are never
+    changed once saved).
+    """
+
+    def _init_id_cache(self):
+        # experiment name -> (experiment_id, {variant name: variant_id}), and
+        # experiment_id -> (experiment name, {variant_id: variant name})
+        self._ids = {}
+        self._names = {}
+        self._ids_lock = threading.Lock()
+
+    def clear_id_cache(self):
+        """
+        Forget every cached experiment and variant ID (e.g., after experiments
+        have been removed from the database by hand).
+        """
+        self._ids_lock.acquire()
+        try:
+            self._ids = {}
+            self._names = {}
+        finally:
+            self._ids_lock.release()
+
+    def _remember(self, rows):
+        """
+        Cache the IDs in a list of (experiment_id, experiment_name,
+        variant_id, variant_name) tuples.
+        """
+        ids, names = {}, {}
+        for experiment_id, experiment_name, variant_id, variant_name in rows:
+            ids.setdefault(
+                experiment_name, (experiment_id, {})
+            )[1][variant_name] = variant_id
+            names.setdefault(
+                experiment_id, (experiment_name, {})
+            )[1][variant_id] = variant_name
+
+        # Entries are only ever added whole, so that lookups (which don't
+        # acquire the lock) never see an experiment without all of its
+        # variants.
+        self._ids_lock.acquire()
+        try:
+            self._ids.update(ids)
+            self._names.update(names)
+        finally:
+            self._ids_lock.release()
+
+    def _id_queries(self, experiment_names=(), experiment_ids=()):
+        """
+        Build the queries for the IDs of any of a list of experiment names (or
+        IDs) that aren't cached yet.
+
+        Each query selects (experiment_id, experiment_name, variant_id,
+        variant_name) rows.
+        """
+        names = [n for n in set(experiment_names) if n not in self._ids]
+        ids = [i for i in set(experiment_ids) if i not in self._names]
+        experiments = model.Experiment.__table__
+        variants = model.Variant.__table__
+        query = _select(
+            experiments.c.id,
+            experiments.c.name,
+            variants.c.id,
+            variants.c.name
+        ).select_from(experiments.join(
+            variants,
+            variants.c.experiment_id == experiments.c.id
+        ))
+        queries = []
+        if names:
+            queries.append(query.where(experiments.c.name.in_(names)))
+        if ids:
+            queries.append(query.where(experiments.c.id.in_(ids)))
+        return queries
+
+    def _experiment_ids(self, experiment_names):
+        """
+        Resolve a list of experiment names into a list of (cached) experiment
+        IDs (experiments that don't exist are omitted).
+        """
+        ids = [
+            self._ids.get(name, (None,))[0]
+            for name in set(experiment_names)
+        ]
+        return [i for i in ids if i is not None]
+
+    def _cached_variant_ids(self, pairs):
+        ids = {}
+        for experiment_name, variant_name in pairs:
+            experiment_id, variants = self._ids.get(
+                experiment_name, (None, {})
+            )
+            if variant_name in variants:
+                ids[(experiment_name, variant_name)] = (
+                    experiment_id,
+                    variants[variant_name]
+                )
+        return ids
+
+    def _variant_names(self, rows):
+        """
+        Resolve a list of (experiment_id, variant_id) tuples into
+        a dictionary mapping experiment names to variant names.
+        """
+        names = {}
+        for experiment_id, variant_id in rows:
+            experiment_name, variants = self._names.get(
+                experiment_id, (None, {})
+            )
+            if variant_id in variants:
+                names[experiment_name] = variants[variant_id]
+        return names
+
+    def _event_amounts(self, ids):
+        """
+        Tally a list of (experiment_id, variant_id) tuples, choosing a shard
+        for each.
+
+        Returns a dictionary mapping (experiment_id, variant_id, shard) tuples
+        to amounts.
+        """
+        amounts = {}
+        for key in ids:
+            amounts[key] = amounts.get(key, 0) + 1
+        return dict(
+            ((experiment_id, variant_id, self._shard()), amount)
+            for (experiment_id, variant_id), amount in amounts.items()
+        )
+
+    def _shard(self):
+        if self.event_shards == 1:
+            return 0
+        return random.randrange(self.event_shards)
+
+    def _event_rows(self, type, amounts):
+        return [{
+            'type': type,
+            'experiment_id': experiment_id,
+            'variant_id': variant_id,
+            'shard': shard,
+            'total': amount
+        } for (experiment_id, variant_id, shard), amount in amounts.items()]
+
+    def _stats_query(self, experiment_ids):
+        """
+        Build a query for the (type, experiment_id, variant_id, total) event
+        totals of a list of experiment IDs (summed across shards).
+        """
+        table = model.TrackedEvent.__table__
+        return _select(
+            table.c.type,
+            table.c.experiment_id,
+            table.c.variant_id,
+            func.sum(table.c.total)
+        ).where(
+            table.c.experiment_id.in_(experiment_ids)
+        ).group_by(
+            table.c.type,
+            table.c.experiment_id,
+            table.c.variant_id
+        )
+
+    def _stats(self, experiment_ids, rows):
+        """
+        Build the result of ``stats`` from a list of cached experiment IDs
+        and the rows selected by ``_stats_query``.
+        """
+        totals = {}
+        for type, experiment_id, variant_id, total in rows:
+            totals[(type, experiment_id, variant_id)] = int(total or 0)
+
+        stats = {}
+        for experiment_id in experiment_ids:
+            experiment_name, variants = self._names[experiment_id]
+            stats[experiment_name] = dict(
+                (variant_name, (
+                    totals.get(('PARTICIPANT', experiment_id, variant_id), 0),
+                    totals.get(('CONVERSION', experiment_id, variant_id), 0)
+                ))
+                for variant_id, variant_name in variants.items()
+            )
+        return stats
+
+
+class SQLAlchemyBackend(_BaseSQLAlchemyBackend, CleaverBackend):
     """
     Provides an interface for persisting and retrieving A/B test results
     to a SQLAlchemy-supported database.
+
+    By default, every method uses (and commits) its own transaction.  Between
+    calls to ``begin`` and ``end`` (e.g., for the duration of a request, when
+    ``cleaver.SplitMiddleware`` is configured with ``unit_of_work=True``),
+    every method in the current thread shares a single session (and
+    connection), and changes are committed once, by ``end``.
+
+    Experiment and variant IDs are cached in memory (experiments and their
+    variants are never changed once saved), so that assigning variants and
+    counting events can write foreign keys directly, without first looking
+    them up by name.
+
+    Each variant's participant and conversion totals are normally kept in
+    a single row, which every increment must lock.  Under heavy concurrent
+    traffic, ``event_shards`` spreads each total across several rows (with
+    each increment going to one at random), and totals are summed when read.
+
+    Backends with the same ``dburi`` and ``engine_options`` share an engine
+    (and connection pool).
+
+    :param dburi a SQLAlchemy database URI
+    :param engine_options keyword arguments for ``sqlalchemy.create_engine``,
+                          e.g., pool configuration like ``pool_size``,
+                          ``max_overflow``, ``pool_recycle`` or
+                          ``pool_pre_ping``
+    :param event_shards the number of rows to spread each event total across
+    :param create_tables when True, Cleaver's tables are created (if they
+                         don't exist yet) the first time the database is used
     """
 
-    def __init__(self, dburi='sqlite://', engine_options={}):
+    def __init__(self, dburi='sqlite://', engine_options={}, event_shards=1,
+                 create_tables=True):
+        if event_shards < 1:
+            raise RuntimeError('`event_shards` must be at least 1.')
         self.dburi = dburi
         self.engine_options = engine_options
+        self.event_shards = event_shards
         self.Session = session_for(
             dburi=self.dburi,
+            create_tables=create_tables,
             **self.engine_options
         )
+        self._local = threading.local()
+        self._upsert = self._build_upsert()
+        self._insert_ignore = _build_insert_ignore(
+            self.Session.bind.dialect
+        )
+        self._init_id_cache()
+
+    def begin(self):
+        """
+        Start a unit of work in the current thread.
+        """
+        self.Session.close()
+        self._local.active = True
+
+    def end(self):
+        """
+        Commit (and finish) the current thread's unit of work.
+        """
+        if not self._in_unit_of_work():
+            return
+        self._local.active = False
+        try:
+            self.Session.commit()
+        except Exception:
+            # IDs cached during the unit of work may have been rolled back
+            self.clear_id_cache()
+            raise
+        finally:
+            self.Session.close()
+
+    def _in_unit_of_work(self):
+        return getattr(self._local, 'active', False)
+
+    def _commit(self):
+        # Within a unit of work, changes are only flushed (so that they're
+        # visible to subsequent queries) until ``end`` is called.
+        if self._in_unit_of_work():
+            self.Session.flush()
+        else:
+            self.Session.commit()
+
+    def _close(self):
+        if not self._in_unit_of_work():
+            self.Session.close()
+
+    def _remember_experiment(self, experiment):
+        self._remember([
+            (experiment.id, experiment.name, v.id, v.name)
+            for v in experiment.variants
+        ])
+
+    def _load_ids(self, experiment_names=(), experiment_ids=()):
+        """
+        Cache the IDs for any of a list of experiment names (or IDs) that
+        aren't cached yet.
+        """
+        for query in self._id_queries(experiment_names, experiment_ids):
+            self._remember(self.Session.execute(query).fetchall())
+
+    def _get_by(self, cls, **kwargs):
+        return self.Session.query(cls).filter_by(**kwargs).first()
 
     def experiment_factory(self, experiment):
         if experiment is None:
             return None
+        self._remember_experiment(experiment)
         return CleaverExperiment(
             backend=self,
             name=experiment.name,
@@ -54,10 +416,10 @@ class SQLAlchemyBackend(CleaverBackend):
         try:
             return [
                 self.experiment_factory(e)
-                for e in model.Experiment.query.all()
+                for e in self.Session.query(model.Experiment).all()
             ]
         finally:
-            self.Session.close()
+            self._close()
 
     def get_experiment(self, name, variants):
         """
@@ -69,9 +431,36 @@ class SQLAlchemyBackend(CleaverBackend):
         Returns a ``cleaver.experiment.Experiment`` or ``None``
         """
         try:
-            return self.experiment_factory(model.Experiment.get_by(name=name))
+            return self.experiment_factory(
+                self._get_by(model.Experiment, name=name)
+            )
         finally:
-            self.Session.close()
+            self._close()
+
+    def get_experiments(self, experiments):
+        """
+        Retrieve many experiments at once.
+
+        :param experiments a dictionary mapping unique string experiment
+                           names to a list of variant names
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        if not experiments:
+            return {}
+        try:
+            return dict(
+                (e.name, self.experiment_factory(e))
+                for e in self.Session.query(model.Experiment).options(
+                    joinedload(model.Experiment.variants)
+                ).filter(
+                    model.Experiment.name.in_(list(experiments))
+                ).all()
+            )
+        finally:
+            self._close()
 
     def save_experiment(self, name, variants):
         """
@@ -81,7 +470,7 @@ class SQLAlchemyBackend(CleaverBackend):
         :param variants a list of strings, each with a unique variant name
         """
         try:
-            model.Experiment(
+            experiment = model.Experiment(
                 name=name,
                 started_on=datetime.utcnow(),
                 variants=[
@@ -89,23 +478,28 @@ class SQLAlchemyBackend(CleaverBackend):
                     for i, v in enumerate(variants)
                 ]
             )
-            self.Session.commit()
+            self.Session.add(experiment)
+            self._commit()
+            self._remember_experiment(experiment)
         finally:
-            self.Session.close()
+            self._close()
 
     def is_verified_human(self, identity):
         try:
-            return model.VerifiedHuman.get_by(identity=identity) is not None
+            return self._get_by(
+                model.VerifiedHuman,
+                identity=identity
+            ) is not None
         finally:
-            self.Session.close()
+            self._close()
 
     def mark_human(self, identity):
         try:
-            if model.VerifiedHuman.get_by(identity=identity) is None:
-                model.VerifiedHuman(identity=identity)
-                self.Session.commit()
+            if self._get_by(model.VerifiedHuman, identity=identity) is None:
+                self.Session.add(model.VerifiedHuman(identity=identity))
+                self._commit()
         finally:
-            self.Session.close()
+            self._close()
 
     def get_variant(self, identity, experiment_name):
         """
@@ -117,15 +511,73 @@ class SQLAlchemyBackend(CleaverBackend):
         Returns a ``String`` or `None`
         """
         try:
-            match = model.Participant.query.join(
-                model.Experiment
+            self._load_ids([experiment_name])
+            experiment_ids = self._experiment_ids([experiment_name])
+            if not experiment_ids:
+                return None
+            experiment_id = experiment_ids[0]
+            match = self.Session.query(
+                model.Participant.variant_id
             ).filter(and_(
                 model.Participant.identity == identity,
-                model.Experiment.name == experiment_name
+                model.Participant.experiment_id == experiment_id
             )).first()
-            return match.variant.name if match else None
+            if match is None:
+                return None
+            return self._variant_names([
+                (experiment_id, match[0])
+            ]).get(experiment_name)
         finally:
-            self.Session.close()
+            self._close()
+
+    def get_variants(self, identity, experiment_names):
+        """
+        Retrieve the variants for a specific user and many experiments at
+        once.
+
+        :param identity a unique user identifier
+        :param experiment_names a list of string experiment names
+
+        Returns a dictionary mapping experiment names to variant names
+        (experiments the user hasn't been assigned a variant for are
+        omitted).
+        """
+        if not experiment_names:
+            return {}
+        try:
+            self._load_ids(experiment_names)
+            experiment_ids = self._experiment_ids(experiment_names)
+            if not experiment_ids:
+                return {}
+            return self._variant_names(self.Session.query(
+                model.Participant.experiment_id,
+                model.Participant.variant_id
+            ).filter(and_(
+                model.Participant.identity == identity,
+                model.Participant.experiment_id.in_(experiment_ids)
+            )).all())
+        finally:
+            self._close()
+
+    def get_assignments(self, identity):
+        """
+        Retrieve every variant assigned to a specific user.
+
+        :param identity a unique user identifier
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        try:
+            rows = self.Session.query(
+                model.Participant.experiment_id,
+                model.Participant.variant_id
+            ).filter(
+                model.Participant.identity == identity
+            ).all()
+            self._load_ids(experiment_ids=[e for e, _ in rows])
+            return self._variant_names(rows)
+        finally:
+            self._close()
 
     def set_variant(self, identity, experiment_name, variant_name):
         """
@@ -134,62 +586,284 @@ class SQLAlchemyBackend(CleaverBackend):
         :param identity a unique user identifier
         :param experiment_name the string name of the experiment
         :param variant_name the string name of the variant
+
+        Returns ``True`` if a new assignment was stored, and ``False`` if
+        the user already had a variant for the experiment.
         """
         try:
-            experiment = model.Experiment.get_by(name=experiment_name)
-            variant = model.Variant.get_by(name=variant_name)
-            if experiment and variant and model.Participant.query.filter(and_(
-                model.Participant.identity == identity,
-                model.Participant.experiment_id == experiment.id,
-                model.Participant.variant_id == variant.id
-            )).count() == 0:
-                model.Participant(
-                    identity=identity,
-                    experiment=experiment,
-                    variant=variant
-                )
-                self.Session.commit()
+            ids = self._variant_ids([(experiment_name, variant_name)])
+            if not ids:
+                return False
+            experiment_id, variant_id = ids[(experiment_name, variant_name)]
+            row = {
+                'identity': identity,
+                'experiment_id': experiment_id,
+                'variant_id': variant_id
+            }
+
+            # Where the database supports it, skip existing assignments
+            # without failing (and rolling back) the insert.
+            if self._insert_ignore is not None:
+                result = self.Session.execute(self._insert_ignore, row)
+                self._commit()
+                return result.rowcount == 1
+
+            # Within a unit of work, use a savepoint so that a failed insert
+            # doesn't discard the rest of the unit of work.
+            transaction = self.Session
+            if self._in_unit_of_work():
+                transaction = self.Session.begin_nested()
+
+            # Rather than checking for an existing assignment first, rely on
+            # the unique (identity, experiment_id) constraint.
+            self.Session.add(model.Participant(**row))
+            try:
+                transaction.commit()
+            except IntegrityError:
+                transaction.rollback()
+                return False
+            return True
         finally:
-            self.Session.close()
+            self._close()
 
-    def _mark_event(self, type, experiment_name, variant_name):
+    def participate_many(self, identity, variants):
+        """
+        Set the variants for a specific user and mark a participation for
+        many experiments at once (in a single transaction).
+
+        :param identity a unique user identifier
+        :param variants a dictionary mapping string experiment names to
+                        string variant names
+        """
+        if not variants:
+            return
         try:
-            experiment = model.Experiment.get_by(name=experiment_name)
-            variant = model.Variant.get_by(name=variant_name)
-            if experiment and variant and model.TrackedEvent.query.filter(and_(
-                model.TrackedEvent.type == type,
-                model.TrackedEvent.experiment_id == experiment.id,
-                model.TrackedEvent.variant_id == variant.id
-            )).first() is None:
-                model.TrackedEvent(
-                    type=type,
-                    experiment=experiment,
-                    variant=variant
-                )
-                self.Session.commit()
+            ids = list(self._variant_ids(variants.items()).values())
+
+            # Only store (and count) assignments the user doesn't have yet
+            assigned = self._assigned(
+                [identity],
+                [experiment_id for experiment_id, _ in ids]
+            )
+            new = self._insert_assignments(dict(
+                ((identity, experiment_id), variant_id)
+                for experiment_id, variant_id in ids
+                if (identity, experiment_id) not in assigned
+            ))
+            if not new:
+                return
+
+            if self._get_by(model.VerifiedHuman, identity=identity):
+                self._increment_events('PARTICIPANT', [
+                    (experiment_id, variant_id)
+                    for (_, experiment_id), variant_id in new.items()
+                ])
+            self._commit()
         finally:
-            self.Session.close()
+            self._close()
 
+    def write_many(self, assignments, events):
+        """
+        Store many variant assignments and events at once (in a single
+        transaction).
+
+        :param assignments a list of (identity, experiment_name, variant)
+                           tuples
+        :param events a list of (type, experiment_name, variant) tuples, where
+                      type is ``'PARTICIPANT'`` or ``'CONVERSION'``
+        """
+        if not assignments and not events:
+            return
         try:
-            experiment = model.Experiment.get_by(name=experiment_name)
-            variant = model.Variant.get_by(name=variant_name)
-            if experiment and variant:
-                self.Session.execute(
-                    'UPDATE %s SET total = total + 1 '
-                    'WHERE experiment_id = :experiment_id '
-                    'AND variant_id = :variant_id '
-                    'AND `type` = :type' % (
-                        model.TrackedEvent.__tablename__
-                    ),
-                    {
-                        'experiment_id': experiment.id,
-                        'variant_id': variant.id,
-                        'type': type
-                    }
-                )
-                self.Session.commit()
+            ids = self._variant_ids(
+                [(e, v) for _, e, v in assignments] +
+                [(e, v) for _, e, v in events]
+            )
+
+            rows = {}
+            for identity, experiment_name, variant in assignments:
+                if (experiment_name, variant) in ids:
+                    experiment_id, variant_id = ids[
+                        (experiment_name, variant)
+                    ]
+                    rows.setdefault((identity, experiment_id), variant_id)
+            for key in self._assigned(
+                set(identity for identity, _ in rows),
+                [experiment_id for _, experiment_id in rows]
+            ):
+                rows.pop(key, None)
+            self._insert_assignments(rows)
+
+            for type in model.TrackedEvent.TYPES:
+                matching = [
+                    ids[(e, v)] for t, e, v in events
+                    if t == type and (e, v) in ids
+                ]
+                if matching:
+                    self._increment_events(type, matching)
+
+            self._commit()
         finally:
-            self.Session.close()
+            self._close()
+
+    def mark_event_totals(self, totals):
+        """
+        Add to many participation and conversion totals at once (in a single
+        transaction).
+
+        :param totals a dictionary mapping (type, experiment_name, variant)
+                      tuples, where type is ``'PARTICIPANT'`` or
+                      ``'CONVERSION'``, to integer amounts
+        """
+        if not totals:
+            return
+        try:
+            ids = self._variant_ids([(e, v) for _, e, v in totals])
+            for type in model.TrackedEvent.TYPES:
+                amounts = {}
+                for (t, e, v), amount in totals.items():
+                    if t == type and (e, v) in ids:
+                        key = ids[(e, v)] + (self._shard(),)
+                        amounts[key] = amounts.get(key, 0) + amount
+                if amounts:
+                    self._add_events(type, amounts)
+            self._commit()
+        finally:
+            self._close()
+
+    def _variant_ids(self, pairs):
+        """
+        Resolve a list of (experiment_name, variant_name) tuples into
+        a dictionary mapping each tuple to an (experiment_id, variant_id)
+        tuple (pairs that don't exist are omitted).
+        """
+        pairs = set(pairs)
+        self._load_ids([e for e, _ in pairs])
+        return self._cached_variant_ids(pairs)
+
+    def _assigned(self, identities, experiment_ids):
+        """
+        Find the existing assignments amongst a list of identities and
+        experiment IDs.
+
+        Returns a set of (identity, experiment_id) tuples.
+        """
+        if not identities or not experiment_ids:
+            return set()
+        return set(
+            (identity, experiment_id)
+            for identity, experiment_id in self.Session.query(
+                model.Participant.identity,
+                model.Participant.experiment_id
+            ).filter(and_(
+                model.Participant.identity.in_(list(identities)),
+                model.Participant.experiment_id.in_(list(set(experiment_ids)))
+            ))
+        )
+
+    def _insert_assignments(self, rows):
+        """
+        Store a dictionary mapping (identity, experiment_id) tuples to variant
+        IDs within the current transaction.
+
+        Where the database supports it, assignments stored concurrently (e.g.,
+        by a visitor's simultaneous first requests) are skipped rather than
+        failing the transaction.
+
+        Returns a dictionary of the assignments that were stored.
+        """
+        if not rows:
+            return rows
+        values = [{
+            'identity': identity,
+            'experiment_id': experiment_id,
+            'variant_id': variant_id
+        } for (identity, experiment_id), variant_id in rows.items()]
+
+        if self._insert_ignore is None:
+            self.Session.execute(model.Participant.__table__.insert(), values)
+            return rows
+
+        # Only a single-row insert reports whether *its* row was stored
+        stored = {}
+        for key, row in zip(rows, values):
+            if self.Session.execute(self._insert_ignore, row).rowcount == 1:
+                stored[key] = rows[key]
+        return stored
+
+    def _increment_events(self, type, ids):
+        """
+        Increment the running tally of events of a certain type for a list of
+        (experiment_id, variant_id) tuples within the current transaction.
+
+        Where the database supports it, each tally is incremented with
+        a single atomic upsert.
+        """
+        self._add_events(type, self._event_amounts(ids))
+
+    def _add_events(self, type, amounts):
+        """
+        Add amounts to the running tally of events of a certain type for
+        a dictionary mapping (experiment_id, variant_id, shard) tuples to
+        amounts within the current transaction.
+        """
+        statement = self._upsert
+        if statement is None:
+            return self._increment_events_fallback(type, amounts)
+
+        self.Session.execute(statement, self._event_rows(type, amounts))
+
+    def _build_upsert(self):
+        return _build_upsert(self.Session.bind.dialect)
+
+    def _increment_events_fallback(self, type, amounts):
+        table = model.TrackedEvent.__table__
+        existing = set(self.Session.query(
+            model.TrackedEvent.experiment_id,
+            model.TrackedEvent.variant_id,
+            model.TrackedEvent.shard
+        ).filter(and_(
+            model.TrackedEvent.type == type,
+            model.TrackedEvent.experiment_id.in_(
+                [experiment_id for experiment_id, _, _ in amounts]
+            )
+        )))
+
+        missing = set(amounts) - existing
+        if missing:
+            self.Session.execute(table.insert(), [{
+                'type': type,
+                'experiment_id': experiment_id,
+                'variant_id': variant_id,
+                'shard': shard,
+                'total': 0
+            } for experiment_id, variant_id, shard in missing])
+
+        self.Session.execute(
+            table.update().where(and_(
+                table.c.type == bindparam('_type'),
+                table.c.experiment_id == bindparam('_experiment_id'),
+                table.c.variant_id == bindparam('_variant_id'),
+                table.c.shard == bindparam('_shard')
+            )).values(total=table.c.total + bindparam('_amount')),
+            [{
+                '_type': type,
+                '_experiment_id': experiment_id,
+                '_variant_id': variant_id,
+                '_shard': shard,
+                '_amount': amount
+            } for (experiment_id, variant_id, shard), amount
+                in amounts.items()]
+        )
+
+    def _mark_event(self, type, experiment_name, variant_name):
+        try:
+            ids = self._variant_ids([(experiment_name, variant_name)])
+            if ids:
+                self._increment_events(type, list(ids.values()))
+                self._commit()
+        finally:
+            self._close()
 
     def mark_participant(self, experiment_name, variant):
         """
@@ -211,20 +885,20 @@ class SQLAlchemyBackend(CleaverBackend):
 
     def _total_events(self, type, experiment_name, variant):
         try:
-            row = model.TrackedEvent.query.join(
-                model.Experiment
-            ).join(
-                model.Variant
+            ids = self._variant_ids([(experiment_name, variant)])
+            if not ids:
+                return 0
+            experiment_id, variant_id = ids[(experiment_name, variant)]
+            total = self.Session.query(
+                func.sum(model.TrackedEvent.total)
             ).filter(and_(
                 model.TrackedEvent.type == type,
-                model.TrackedEvent.experiment_id == model.Experiment.id,
-                model.TrackedEvent.variant_id == model.Variant.id,
-                model.Experiment.name == experiment_name,
-                model.Variant.name == variant
-            )).first()
-            return row.total if row else 0
+                model.TrackedEvent.experiment_id == experiment_id,
+                model.TrackedEvent.variant_id == variant_id
+            )).scalar()
+            return int(total or 0)
         finally:
-            self.Session.close()
+            self._close()
 
     def participants(self, experiment_name, variant):
         """
@@ -241,3 +915,26 @@ class SQLAlchemyBackend(CleaverBackend):
         Returns an integer.
         """
         return self._total_events('CONVERSION', experiment_name, variant)
+
+    def stats(self, experiment_names):
+        """
+        Retrieve the participant and conversion totals for every variant of
+        many experiments at once (with a single query).
+
+        :param experiment_names a list of string experiment names
+
+        Returns a dictionary mapping experiment names to dictionaries mapping
+        variant names to (participants, conversions) tuples (experiments that
+        don't exist are omitted).
+        """
+        try:
+            self._load_ids(experiment_names)
+            ids = self._experiment_ids(experiment_names)
+            if not ids:
+                return {}
+            return self._stats(
+                ids,
+                self.Session.execute(self._stats_query(ids)).fetchall()
+            )
+        finally:
+            self._close()
@@ -0,0 +1,454 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.exc import IntegrityError
+
+from . import (model, _BaseSQLAlchemyBackend, _build_upsert,
+               _build_insert_ignore)
+
+from cleaver.experiment import Experiment as CleaverExperiment
+from cleaver.backend.aio import AsyncCleaverBackend
+
+
+def _sqlalchemy_asyncio_installed():
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError as e:  # pragma: nocover
+        raise ImportError(
+            'The asyncio database backend requires SQLAlchemy 1.4 (or newer) '
+            'and its asyncio dependencies (like greenlet) to be installed '
+            '(%s).  See http://pypi.python.org/pypi/SQLAlchemy' % e
+        ) from e
+    return create_async_engine
+create_async_engine = _sqlalchemy_asyncio_installed()
+
+experiment_table = model.Experiment.__table__
+variant_table = model.Variant.__table__
+participant_table = model.Participant.__table__
+event_table = model.TrackedEvent.__table__
+human_table = model.VerifiedHuman.__table__
+
+
+class AsyncSQLAlchemyBackend(_BaseSQLAlchemyBackend, AsyncCleaverBackend):
+    """
+    Provides an (asyncio) interface for persisting and retrieving A/B test
+    results to a SQLAlchemy-supported database with an async driver (like
+    ``aiosqlite``, ``asyncpg`` or ``aiomysql``), using the same schema as
+    ``cleaver.backend.db.SQLAlchemyBackend``.
+
+    Every method uses (and commits) its own transaction, issued with
+    SQLAlchemy Core statements on an ``AsyncEngine``.
+
+    :param dburi a SQLAlchemy database URI, e.g.,
+                 ``sqlite+aiosqlite:///experiment.data``
+    :param engine_options keyword arguments for
+                          ``sqlalchemy.ext.asyncio.create_async_engine``
+    :param event_shards the number of rows to spread each event total across
+                        (see ``SQLAlchemyBackend``)
+    :param create_tables when True, Cleaver's tables are created (if they
+                         don't exist yet) the first time the database is used
+    """
+
+    def __init__(self, dburi='sqlite+aiosqlite://', engine_options={},
+                 event_shards=1, create_tables=True):
+        if event_shards < 1:
+            raise RuntimeError('`event_shards` must be at least 1.')
+        self.dburi = dburi
+        self.engine_options = engine_options
+        self.event_shards = event_shards
+        self.engine = create_async_engine(dburi, **engine_options)
+
+        self._upsert = _build_upsert(self.engine.sync_engine.dialect)
+        if self._upsert is None:
+            raise RuntimeError(
+                '%s requires a database that supports upserts.' %
+                self.__class__.__name__
+            )
+        self._insert_ignore = _build_insert_ignore(
+            self.engine.sync_engine.dialect
+        )
+        self._tables_created = not create_tables
+        self._setup_lock = None
+        self._init_id_cache()
+
+    async def _setup(self):
+        if self._tables_created:
+            return
+        if self._setup_lock is None:
+            self._setup_lock = asyncio.Lock()
+        async with self._setup_lock:
+            if not self._tables_created:
+                async with self.engine.begin() as conn:
+                    await conn.run_sync(model.ModelBase.metadata.create_all)
+                self._tables_created = True
+
+    async def _begin(self):
+        await self._setup()
+        return self.engine.begin()
+
+    async def close(self):
+        """
+        Close every connection in the engine's pool.
+        """
+        await self.engine.dispose()
+
+    async def _load_ids(self, conn, experiment_names=(), experiment_ids=()):
+        for query in self._id_queries(experiment_names, experiment_ids):
+            self._remember((await conn.execute(query)).fetchall())
+
+    async def _variant_ids(self, conn, pairs):
+        pairs = set(pairs)
+        await self._load_ids(conn, [e for e, _ in pairs])
+        return self._cached_variant_ids(pairs)
+
+    async def _experiments(self, conn, where=None):
+        query = select(
+            experiment_table.c.id,
+            experiment_table.c.name,
+            experiment_table.c.started_on,
+            variant_table.c.id,
+            variant_table.c.name
+        ).select_from(experiment_table.outerjoin(
+            variant_table,
+            variant_table.c.experiment_id == experiment_table.c.id
+        )).order_by(experiment_table.c.id, variant_table.c.order)
+        if where is not None:
+            query = query.where(where)
+
+        found = []
+        for experiment_id, name, started_on, variant_id, variant_name in (
+            await conn.execute(query)
+        ).fetchall():
+            if not found or found[-1][0] != experiment_id:
+                found.append((experiment_id, name, started_on, []))
+            if variant_id is not None:
+                found[-1][3].append((variant_id, variant_name))
+
+        for experiment_id, name, started_on, vs in found:
+            self._remember([
+                (experiment_id, name, variant_id, variant_name)
+                for variant_id, variant_name in vs
+            ])
+        return [
+            CleaverExperiment(
+                backend=self,
+                name=name,
+                started_on=started_on,
+                variants=tuple(variant_name for _, variant_name in vs)
+            ) for _, name, started_on, vs in found
+        ]
+
+    async def all_experiments(self):
+        """
+        Retrieve every available experiment.
+
+        Returns a list of ``cleaver.experiment.Experiment``s
+        """
+        async with await self._begin() as conn:
+            return await self._experiments(conn)
+
+    async def get_experiment(self, name, variants):
+        """
+        Retrieve an experiment by its name and variants (assuming it exists).
+
+        Returns a ``cleaver.experiment.Experiment`` or ``None``
+        """
+        async with await self._begin() as conn:
+            found = await self._experiments(
+                conn,
+                experiment_table.c.name == name
+            )
+        return found[0] if found else None
+
+    async def get_experiments(self, experiments):
+        """
+        Retrieve many experiments at once.
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        if not experiments:
+            return {}
+        async with await self._begin() as conn:
+            found = await self._experiments(
+                conn,
+                experiment_table.c.name.in_(list(experiments))
+            )
+        return dict((e.name, e) for e in found)
+
+    async def save_experiment(self, name, variants):
+        """
+        Persist an experiment and its variants (unless they already exist).
+        """
+        try:
+            async with await self._begin() as conn:
+                result = await conn.execute(experiment_table.insert().values(
+                    name=name,
+                    started_on=datetime.utcnow()
+                ))
+                experiment_id = result.inserted_primary_key[0]
+                if variants:
+                    await conn.execute(variant_table.insert(), [{
+                        'name': v,
+                        'order': i,
+                        'experiment_id': experiment_id
+                    } for i, v in enumerate(variants)])
+        except IntegrityError:
+            pass
+
+    async def _is_human(self, conn, identity):
+        return (await conn.execute(select(human_table.c.id).where(
+            human_table.c.identity == identity
+        ))).first() is not None
+
+    async def is_verified_human(self, identity):
+        async with await self._begin() as conn:
+            return await self._is_human(conn, identity)
+
+    async def mark_human(self, identity):
+        try:
+            async with await self._begin() as conn:
+                await conn.execute(
+                    human_table.insert().values(identity=identity)
+                )
+        except IntegrityError:
+            pass
+
+    async def get_variant(self, identity, experiment_name):
+        """
+        Retrieve the variant for a specific user and experiment (if it exists).
+
+        Returns a ``String`` or `None`
+        """
+        found = await self.get_variants(identity, [experiment_name])
+        return found.get(experiment_name)
+
+    async def get_variants(self, identity, experiment_names):
+        """
+        Retrieve the variants for a specific user and many experiments at
+        once.
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        if not experiment_names:
+            return {}
+        async with await self._begin() as conn:
+            await self._load_ids(conn, experiment_names)
+            experiment_ids = self._experiment_ids(experiment_names)
+            if not experiment_ids:
+                return {}
+            return self._variant_names((await conn.execute(select(
+                participant_table.c.experiment_id,
+                participant_table.c.variant_id
+            ).where(and_(
+                participant_table.c.identity == identity,
+                participant_table.c.experiment_id.in_(experiment_ids)
+            )))).fetchall())
+
+    async def get_assignments(self, identity):
+        """
+        Retrieve every variant assigned to a specific user.
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        async with await self._begin() as conn:
+            rows = (await conn.execute(select(
+                participant_table.c.experiment_id,
+                participant_table.c.variant_id
+            ).where(participant_table.c.identity == identity))).fetchall()
+            await self._load_ids(conn, experiment_ids=[e for e, _ in rows])
+            return self._variant_names(rows)
+
+    async def set_variant(self, identity, experiment_name, variant_name):
+        """
+        Set the variant for a specific user.
+
+        Returns ``True`` if a new assignment was stored, and ``False`` if
+        the user already had a variant for the experiment.
+        """
+        async with await self._begin() as conn:
+            ids = await self._variant_ids(
+                conn,
+                [(experiment_name, variant_name)]
+            )
+            if not ids:
+                return False
+            experiment_id, variant_id = ids[(experiment_name, variant_name)]
+
+            # Rather than checking for an existing assignment first, skip
+            # it (without failing the insert) if there is one.
+            result = await conn.execute(self._insert_ignore, {
+                'identity': identity,
+                'experiment_id': experiment_id,
+                'variant_id': variant_id
+            })
+        return result.rowcount == 1
+
+    async def _unassigned(self, conn, rows):
+        """
+        Store the assignments in a dictionary mapping (identity,
+        experiment_id) tuples to variant IDs that don't exist yet.
+
+        Returns a dictionary of the assignments that were stored.
+        """
+        if not rows:
+            return rows
+        existing = (await conn.execute(select(
+            participant_table.c.identity,
+            participant_table.c.experiment_id
+        ).where(and_(
+            participant_table.c.identity.in_(
+                list(set(identity for identity, _ in rows))
+            ),
+            participant_table.c.experiment_id.in_(
+                list(set(experiment_id for _, experiment_id in rows))
+            )
+        )))).fetchall()
+        for identity, experiment_id in existing:
+            rows.pop((identity, experiment_id), None)
+
+        # Skip (rather than fail on) any assignments stored concurrently; only
+        # a single-row insert reports whether *its* row was stored
+        stored = {}
+        for (identity, experiment_id), variant_id in rows.items():
+            result = await conn.execute(self._insert_ignore, {
+                'identity': identity,
+                'experiment_id': experiment_id,
+                'variant_id': variant_id
+            })
+            if result.rowcount == 1:
+                stored[(identity, experiment_id)] = variant_id
+        return stored
+
+    async def participate_many(self, identity, variants):
+        """
+        Set the variants for a specific user and mark a participation for
+        many experiments at once (in a single transaction).
+        """
+        if not variants:
+            return
+        async with await self._begin() as conn:
+            ids = await self._variant_ids(conn, variants.items())
+
+            # Only store (and count) assignments the user doesn't have yet
+            new = await self._unassigned(conn, dict(
+                ((identity, experiment_id), variant_id)
+                for experiment_id, variant_id in ids.values()
+            ))
+            if new and await self._is_human(conn, identity):
+                await self._increment_events(conn, 'PARTICIPANT', [
+                    (experiment_id, variant_id)
+                    for (_, experiment_id), variant_id in new.items()
+                ])
+
+    async def write_many(self, assignments, events):
+        """
+        Store many variant assignments and events at once (in a single
+        transaction).
+        """
+        if not assignments and not events:
+            return
+        async with await self._begin() as conn:
+            ids = await self._variant_ids(
+                conn,
+                [(e, v) for _, e, v in assignments] +
+                [(e, v) for _, e, v in events]
+            )
+
+            rows = {}
+            for identity, experiment_name, variant in assignments:
+                if (experiment_name, variant) in ids:
+                    experiment_id, variant_id = ids[
+                        (experiment_name, variant)
+                    ]
+                    rows.setdefault((identity, experiment_id), variant_id)
+            await self._unassigned(conn, rows)
+
+            for type in model.TrackedEvent.TYPES:
+                matching = [
+                    ids[(e, v)] for t, e, v in events
+                    if t == type and (e, v) in ids
+                ]
+                if matching:
+                    await self._increment_events(conn, type, matching)
+
+    async def _increment_events(self, conn, type, ids):
+        await conn.execute(
+            self._upsert,
+            self._event_rows(type, self._event_amounts(ids))
+        )
+
+    async def _mark_event(self, type, experiment_name, variant_name):
+        async with await self._begin() as conn:
+            ids = await self._variant_ids(
+                conn,
+                [(experiment_name, variant_name)]
+            )
+            if ids:
+                await self._increment_events(conn, type, list(ids.values()))
+
+    async def mark_participant(self, experiment_name, variant):
+        """
+        Mark a participation for a specific experiment variant.
+        """
+        await self._mark_event('PARTICIPANT', experiment_name, variant)
+
+    async def mark_conversion(self, experiment_name, variant):
+        """
+        Mark a conversion for a specific experiment variant.
+        """
+        await self._mark_event('CONVERSION', experiment_name, variant)
+
+    async def _total_events(self, type, experiment_name, variant):
+        async with await self._begin() as conn:
+            ids = await self._variant_ids(conn, [(experiment_name, variant)])
+            if not ids:
+                return 0
+            experiment_id, variant_id = ids[(experiment_name, variant)]
+            total = (await conn.execute(select(
+                func.sum(event_table.c.total)
+            ).where(and_(
+                event_table.c.type == type,
+                event_table.c.experiment_id == experiment_id,
+                event_table.c.variant_id == variant_id
+            )))).scalar()
+            return int(total or 0)
+
+    async def participants(self, experiment_name, variant):
+        """
+        The number of participants for a certain variant.
+
+        Returns an integer.
+        """
+        return await self._total_events(
+            'PARTICIPANT',
+            experiment_name,
+            variant
+        )
+
+    async def conversions(self, experiment_name, variant):
+        """
+        The number of conversions for a certain variant.
+
+        Returns an integer.
+        """
+        return await self._total_events('CONVERSION', experiment_name, variant)
+
+    async def stats(self, experiment_names):
+        """
+        Retrieve the participant and conversion totals for every variant of
+        many experiments at once (with a single query).
+
+        Returns a dictionary mapping experiment names to dictionaries mapping
+        variant names to (participants, conversions) tuples (experiments that
+        don't exist are omitted).
+        """
+        async with await self._begin() as conn:
+            await self._load_ids(conn, experiment_names)
+            ids = self._experiment_ids(experiment_names)
+            if not ids:
+                return {}
+            result = await conn.execute(self._stats_query(ids))
+            return self._stats(ids, result.fetchall())
@@ -0,0 +1,179 @@
+"""
+Upgrades databases created by earlier versions of Cleaver to the current
+schema:
+
+* Variant names are unique per experiment (rather than globally).
+* Assignments are unique per (identity, experiment_id), with an index that
+  also covers variant_id where the database supports it.
+* Event types are stored as small integers.
+* Event totals can be split across several (sharded) rows.
+
+Usage::
+
+    $ python -m cleaver.backend.db.migrate sqlite:///experiment.data
+"""
+import sys
+
+import sqlalchemy as sa
+from sqlalchemy.schema import AddConstraint
+
+from . import model, _select
+
+
+def _legacy_variant_constraints(inspector):
+    """
+    Find the unique constraints (and indexes) on variant names alone.
+    """
+    table = model.Variant.__tablename__
+    found = []
+    for constraint in inspector.get_unique_constraints(table):
+        if constraint['column_names'] == ['name']:
+            found.append(constraint['name'])
+    for index in inspector.get_indexes(table):
+        if index['unique'] and index['column_names'] == ['name'] and \
+                index['name'] not in found:
+            found.append(index['name'])
+    return found
+
+
+def _migrate_variants(conn, inspector):
+    legacy = _legacy_variant_constraints(inspector)
+    if not legacy:
+        return False
+
+    table = model.Variant.__table__
+    if conn.dialect.name == 'sqlite':
+        # SQLite can't drop constraints, so the table is rebuilt (and
+        # renamed into place)
+        metadata = sa.MetaData()
+        model.Experiment.__table__.tometadata(metadata)
+        rebuilt = table.tometadata(metadata, name='%s_migrating' % table.name)
+        rebuilt.create(conn)
+        columns = ', '.join(
+            conn.dialect.identifier_preparer.quote(c.name)
+            for c in table.columns
+        )
+        conn.execute(sa.text('INSERT INTO %s (%s) SELECT %s FROM %s' % (
+            rebuilt.name, columns, columns, table.name
+        )))
+        conn.execute(sa.text('DROP TABLE %s' % table.name))
+        conn.execute(sa.text('ALTER TABLE %s RENAME TO %s' % (
+            rebuilt.name, table.name
+        )))
+        return True
+
+    for name in legacy:
+        if conn.dialect.name == 'mysql':
+            conn.execute(sa.text(
+                'ALTER TABLE %s DROP INDEX %s' % (table.name, name)
+            ))
+        else:
+            conn.execute(sa.text(
+                'ALTER TABLE %s DROP CONSTRAINT %s' % (table.name, name)
+            ))
+    for constraint in table.constraints:
+        if isinstance(constraint, sa.UniqueConstraint):
+            conn.execute(AddConstraint(constraint))
+    return True
+
+
+def _migrate_participants(conn, inspector):
+    table = model.Participant.__table__
+    assignment = [i for i in table.indexes if i.unique][0]
+    columns = sorted(c.name for c in assignment.columns)
+
+    if assignment.name in [
+        i['name'] for i in inspector.get_indexes(table.name)
+    ]:
+        return False
+
+    legacy = [
+        c['name'] for c in inspector.get_unique_constraints(table.name)
+        if sorted(c['column_names']) == columns
+    ]
+    if legacy and conn.dialect.name not in ('postgresql', 'mssql'):
+        # Without covering indexes, the existing unique constraint is
+        # equivalent
+        return False
+
+    for name in legacy:
+        conn.execute(sa.text(
+            'ALTER TABLE %s DROP CONSTRAINT %s' % (table.name, name)
+        ))
+    assignment.create(conn)
+    return True
+
+
+def _migrate_events(conn, inspector):
+    table = model.TrackedEvent.__table__
+    # Integer event types and sharded totals were introduced together, so
+    # only tables with the original Enum type need rebuilding
+    for column in inspector.get_columns(table.name):
+        if column['name'] == 'type' and isinstance(column['type'], sa.Integer):
+            return False
+
+    # Event tallies (one row per variant and type) are few, so they're
+    # simply read, and written back to a new table
+    columns = ('type', 'experiment_id', 'variant_id', 'total')
+    rows = [
+        dict(zip(columns, row)) for row in conn.execute(_select(
+            *[sa.column(c) for c in columns]
+        ).select_from(sa.table(table.name)))
+    ]
+    table.drop(conn)
+    table.create(conn)
+    if rows:
+        conn.execute(table.insert(), rows)
+    return True
+
+
+def migrate(dburi, **engine_options):
+    """
+    Upgrade a Cleaver database to the current schema (creating it, if it
+    doesn't exist yet).  Databases that are already up to date are left as
+    they are.
+
+    :param dburi a SQLAlchemy database URI
+    :param engine_options keyword arguments for ``sqlalchemy.create_engine``
+
+    Returns ``True`` if anything was changed.
+    """
+    engine = sa.create_engine(dburi, **engine_options)
+    try:
+        conn = engine.connect()
+        try:
+            transaction = conn.begin()
+            try:
+                inspector = sa.inspect(conn)
+                tables = inspector.get_table_names()
+                if model.TrackedEvent.__tablename__ not in tables:
+                    model.ModelBase.metadata.create_all(conn)
+                    transaction.commit()
+                    return False
+
+                changed = [
+                    step(conn, inspector) for step in (
+                        _migrate_variants,
+                        _migrate_participants,
+                        _migrate_events
+                    )
+                ]
+                transaction.commit()
+                return any(changed)
+            except Exception:
+                transaction.rollback()
+                raise
+        finally:
+            conn.close()
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':  # pragma: nocover
+    if len(sys.argv) != 2:
+        sys.stderr.write('Usage: %s <dburi>\n' % sys.argv[0])
+        sys.exit(1)
+    if migrate(sys.argv[1]):
+        print('Upgraded %s' % sys.argv[1])
+    else:
+        print('%s is up to date' % sys.argv[1])
@@ -1,6 +1,6 @@
 import sqlalchemy as sa
 from sqlalchemy.orm import relationship
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -14,6 +14,29 @@ class ModelBase(object):
 ModelBase = declarative_base(cls=ModelBase)
 
 
+class EventType(sa.types.TypeDecorator):
+    """
+    Stores event types (e.g., ``'CONVERSION'``) as small integers.
+    """
+
+    impl = sa.SmallInteger
+    cache_ok = True
+
+    def __init__(self, *types):
+        super(EventType, self).__init__()
+        self.types = types
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self.types.index(value) + 1
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.types[value - 1]
+
+
 class Experiment(ModelBase):
     __tablename__ = 'cleaver_experiment'
 
@@ -38,14 +61,19 @@ class Experiment(ModelBase):
 
 class Variant(ModelBase):
     __tablename__ = 'cleaver_variant'
+    __table_args__ = (
+        UniqueConstraint(
+            'experiment_id', 'name',
+            name='uq_cleaver_variant_experiment_id_name'
+        ),
+    )
 
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
-    name = sa.Column(sa.Unicode(255), unique=True)
+    name = sa.Column(sa.Unicode(255))
     order = sa.Column(sa.Integer)
     experiment_id = sa.Column(
         sa.Integer,
-        sa.ForeignKey('%s.id' % Experiment.__tablename__),
-        index=True
+        sa.ForeignKey('%s.id' % Experiment.__tablename__)
     )
 
     events = relationship(
@@ -61,7 +89,18 @@ class Variant(ModelBase):
 
 class Participant(ModelBase):
     __tablename__ = 'cleaver_participant'
-    __table_args__ = (UniqueConstraint('identity', 'experiment_id'),)
+    __table_args__ = (
+        # One assignment per visitor and experiment.  Where the database
+        # supports it, the index also covers variant_id, so assignment
+        # lookups never need to read the table itself.
+        Index(
+            'uq_cleaver_participant_assignment',
+            'identity', 'experiment_id',
+            unique=True,
+            postgresql_include=['variant_id'],
+            mssql_include=['variant_id']
+        ),
+    )
 
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     identity = sa.Column(sa.Unicode(255))
@@ -78,7 +117,9 @@ class Participant(ModelBase):
 
 class TrackedEvent(ModelBase):
     __tablename__ = 'cleaver_event'
-    __table_args__ = (UniqueConstraint('type', 'experiment_id', 'variant_id'),)
+    __table_args__ = (
+        UniqueConstraint('type', 'experiment_id', 'variant_id', 'shard'),
+    )
 
     TYPES = (
         'PARTICIPANT',
@@ -86,7 +127,7 @@ class TrackedEvent(ModelBase):
     )
 
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
-    type = sa.Column(sa.Enum(*TYPES))
+    type = sa.Column(EventType(*TYPES))
 
     experiment_id = sa.Column(
         sa.Integer,
@@ -96,6 +137,13 @@ class TrackedEvent(ModelBase):
         sa.Integer,
         sa.ForeignKey('%s.id' % Variant.__tablename__),
     )
+    # A tally can be split across several rows (see ``SQLAlchemyBackend``)
+    shard = sa.Column(
+        sa.SmallInteger,
+        default=0,
+        server_default='0',
+        nullable=False
+    )
     total = sa.Column(sa.Integer, default=0)
 
 
@@ -1,35 +1,124 @@
-from collections import defaultdict
+import os
+import threading
 
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import scoped_session, sessionmaker, mapper
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 from .model import ModelBase
 
-_SETUP = defaultdict(lambda: False)
-_ENGINES = {}
-_SESSIONS = {}
 
+class EngineRegistry(object):
+    """
+    Creates (and shares) a SQLAlchemy engine and a thread-local
+    ``scoped_session`` for each distinct database URI and set of engine
+    options, so that every backend pointed at the same database uses the
+    same connection pool.
 
-def get_engine(dburi, **kwargs):
-    if dburi not in _ENGINES:
-        _ENGINES[dburi] = create_engine(dburi, **kwargs)
-    return _ENGINES[dburi]
+    Engines are safe to use from forked child processes (e.g., in
+    preforking web servers); connections inherited from the parent process
+    are discarded (rather than shared) the first time the child checks them
+    out of the pool.
+    """
+
+    def __init__(self):
+        self._engines = {}
+        self._sessions = {}
+        self._created = set()
+        self._lock = threading.RLock()
+
+    def _key(self, dburi, options):
+        return (dburi, repr(sorted(options.items())))
+
+    def engine(self, dburi, **options):
+        """
+        Retrieve (or create) an engine.
+
+        :param dburi a SQLAlchemy database URI
+        :param options keyword arguments for ``sqlalchemy.create_engine``
+                       (e.g., ``pool_size``, ``max_overflow``,
+                       ``pool_recycle`` or ``pool_pre_ping``)
+        """
+        key = self._key(dburi, options)
+        self._lock.acquire()
+        try:
+            if key not in self._engines:
+                engine = create_engine(dburi, **options)
+                _discard_connections_after_fork(engine)
+                self._engines[key] = engine
+            return self._engines[key]
+        finally:
+            self._lock.release()
+
+    def session(self, dburi, create_tables=True, **options):
+        """
+        Retrieve (or create) a ``scoped_session`` bound to an engine.
+
+        :param dburi a SQLAlchemy database URI
+        :param create_tables when True, Cleaver's tables are created (if they
+                             don't exist yet) the first time a session is
+                             requested for the engine.
+        :param options keyword arguments for ``sqlalchemy.create_engine``
+        """
+        key = self._key(dburi, options)
+        self._lock.acquire()
+        try:
+            engine = self.engine(dburi, **options)
+            if key not in self._sessions:
+                self._sessions[key] = scoped_session(
+                    sessionmaker(bind=engine)
+                )
 
+            # For convenience, ``Model.query`` uses the session most
+            # recently asked for (backends themselves never rely on it).
+            ModelBase.query = self._sessions[key].query_property()
+            if create_tables and key not in self._created:
+                ModelBase.metadata.create_all(engine)
+                self._created.add(key)
+            return self._sessions[key]
+        finally:
+            self._lock.release()
 
-def session_for(dburi, **kwargs):
-    engine = get_engine(dburi, **kwargs)
-    if dburi not in _SESSIONS:
-        _SESSIONS[dburi] = scoped_session(sessionmaker(bind=engine))
-        ModelBase.query = _SESSIONS[dburi].query_property()
+    def dispose(self):
+        """
+        Close every session and engine (and forget them).
+        """
+        self._lock.acquire()
+        try:
+            for session in self._sessions.values():
+                session.remove()
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines, self._sessions = {}, {}
+            self._created = set()
+        finally:
+            self._lock.release()
 
-        # When a entity is instantiated, automatically add it to the Session
-        @event.listens_for(mapper, 'init')
-        def auto_add(target, args, kwargs):
-            if isinstance(target, ModelBase):
-                _SESSIONS[dburi].add(target)
 
-    if not _SETUP['results']:
-        ModelBase.metadata.create_all(engine)
-        _SETUP['results'] = True
+def _discard_connections_after_fork(engine):
+    # See "Using Connection Pools with Multiprocessing or os.fork()" in the
+    # SQLAlchemy documentation.
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                'Connection record belongs to pid %s, '
+                'attempting to check out in pid %s' %
+                (connection_record.info['pid'], pid)
+            )
+
+
+registry = EngineRegistry()
+
+
+def get_engine(dburi, **kwargs):
+    return registry.engine(dburi, **kwargs)
+
 
-    return _SESSIONS[dburi]
+def session_for(dburi, create_tables=True, **kwargs):
+    return registry.session(dburi, create_tables=create_tables, **kwargs)
@@ -0,0 +1,533 @@
+import atexit
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from datetime import datetime, timedelta
+
+from cleaver.compat import b, binary_type
+from cleaver.backend.memory import (MemoryBackend, _Experiment, _release_all,
+                                    _write_atomically)
+
+log = logging.getLogger(__name__)
+
+# Every record is RECORD_SIZE bytes: a (kind, length, index, id) header,
+# followed by a kind-specific payload
+HEADER = struct.Struct('<BBHI')
+RECORD_SIZE = 32
+PAYLOAD_SIZE = RECORD_SIZE - HEADER.size
+
+MAGIC = b('CLEAVER1')
+
+# Python 2.5 has no b'' literals
+_EMPTY = b('')
+_NUL = b('\0')
+
+# The first record of every file; id is the file's generation
+GENERATION = 0
+# A chunk of a UTF-8 encoded string; id is the string's ID, length is the
+# number of bytes in the chunk, and index is 1 if more chunks follow
+STRING = 1
+# id is the experiment ID, index is the number of variants, and the payload
+# is (name string ID, started_on in microseconds since the epoch); it follows
+# the VARIANT records for the experiment
+EXPERIMENT = 2
+# id is the experiment ID, index is the variant's position, and the payload
+# is the variant name's string ID
+VARIANT = 3
+# id is the identity's string ID
+HUMAN = 4
+# id is the identity's string ID, index is the variant's position, and the
+# payload is the experiment ID
+ASSIGNMENT = 5
+# id is the experiment ID, index is the variant's position, and the payload
+# is the number of events
+PARTICIPANTS = 6
+CONVERSIONS = 7
+
+PAYLOADS = {
+    GENERATION: struct.Struct('<8s'),
+    EXPERIMENT: struct.Struct('<IQ'),
+    VARIANT: struct.Struct('<I'),
+    ASSIGNMENT: struct.Struct('<I'),
+    PARTICIPANTS: struct.Struct('<Q'),
+    CONVERSIONS: struct.Struct('<Q')
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+LOG_NAME = re.compile(r'^log\.(\d+)$')
+
+
+def _record(kind, id, index=0, payload=_EMPTY, length=0):
+    return HEADER.pack(kind, length, index, id) + \
+        payload.ljust(PAYLOAD_SIZE, _NUL)
+
+
+def _pack(kind, id, index=0, *values):
+    payload = PAYLOADS[kind].pack(*values) if kind in PAYLOADS else _EMPTY
+    return _record(kind, id, index, payload)
+
+
+def _text(value):
+    if isinstance(value, binary_type):
+        return value.decode('utf-8')
+    return u'%s' % value
+
+
+def _string_records(id, value):
+    encoded = value.encode('utf-8')
+    chunks = [
+        encoded[i:i + PAYLOAD_SIZE]
+        for i in range(0, len(encoded), PAYLOAD_SIZE)
+    ] or [_EMPTY]
+    return [
+        _record(STRING, id, int(i < len(chunks) - 1), chunk, len(chunk))
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def _microseconds(value):
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def _write(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+class LogBackend(MemoryBackend):
+    """
+    Stores experiments, verified humans, variant assignments and event totals
+    in memory (like ``MemoryBackend``), and persists every change by
+    appending fixed-size binary records to a log file in ``directory``, for
+    single-process deployments without a database.
+
+    Appending to a log is much cheaper than updating rows in place, and
+    reads never touch the disk.  A background thread compacts the log (once
+    it has grown to ``compact_size`` bytes) into a snapshot in the same
+    format, which is memory-mapped and replayed (followed by any newer log)
+    when the backend is created.
+
+    Identities, experiment names and variant names are stored as (UTF-8)
+    strings; identities are converted to text when they're used (so, e.g.,
+    ``42`` and ``'42'`` are the same visitor).  Only one backend (in one
+    process) may use a directory at a time.
+
+    :param directory the filesystem path of a directory for the log and
+                     snapshot (created if it doesn't exist)
+    :param compact_size the size (in bytes) a log grows to before it's
+                        compacted
+    :param interval the number of seconds between checks of the log's size
+    :param fsync when True, the log is flushed to disk after every write
+                 (otherwise, writes which haven't been flushed by the
+                 operating system can be lost if the machine crashes)
+    """
+
+    def __init__(self, directory, compact_size=64 * 1024 * 1024, interval=60,
+                 fsync=False):
+        if compact_size < RECORD_SIZE or interval <= 0:
+            raise RuntimeError(
+                '`compact_size` and `interval` must be positive.'
+            )
+        super(LogBackend, self).__init__()
+        self.directory = directory
+        self.compact_size = compact_size
+        self.interval = interval
+        self.fsync = fsync
+
+        self._strings = {}  # string -> string ID
+        self._fd = None
+        self._log_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+
+        self._pid = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+        atexit.register(self.close)
+
+    #
+    # Files
+    #
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, 'snapshot')
+
+    def _log_path(self, generation):
+        return os.path.join(self.directory, 'log.%d' % generation)
+
+    def _log_generations(self):
+        generations = []
+        for name in os.listdir(self.directory):
+            match = LOG_NAME.match(name)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def _open(self, generation):
+        path = self._log_path(generation)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 420)  # 0644
+        try:
+            if os.fstat(fd).st_size == 0:
+                _write(fd, _pack(GENERATION, generation, 0, MAGIC))
+        except Exception:
+            os.close(fd)
+            raise
+        return fd
+
+    def _recover(self):
+        """
+        Load the snapshot (if there is one) and replay every newer log.
+        """
+        strings = {}  # string ID -> string
+        snapshotted = 0
+        if os.path.exists(self._snapshot_path()):
+            snapshotted, _ = self._replay(self._snapshot_path(), strings)
+
+        logs = [g for g in self._log_generations() if g >= snapshotted]
+        for g in logs:
+            _, end = self._replay(self._log_path(g), strings)
+            if g == logs[-1]:
+                # Discard a write that was interrupted part way through
+                if end < os.path.getsize(self._log_path(g)):
+                    f = open(self._log_path(g), 'r+b')
+                    try:
+                        f.truncate(end)
+                    finally:
+                        f.close()
+        generation = logs[-1] if logs else snapshotted
+
+        self._strings = dict((s, i) for i, s in strings.items())
+        self._generation = generation
+        self._size = os.path.getsize(self._log_path(generation)) \
+            if logs else 0
+
+        # Only logs the snapshot covers are removed; a compaction that was
+        # interrupted before its snapshot was written leaves several newer
+        # logs, which are all replayed until the next compaction
+        self._remove_logs(snapshotted)
+
+    def _replay(self, path, strings):
+        """
+        Apply every record in a log (or snapshot) file to the backend's state.
+
+        :param path the filesystem path to read from
+        :param strings a dictionary mapping string IDs to strings (which is
+                       updated with the file's strings)
+
+        Returns a (generation, end) tuple, where end is the offset just past
+        the last complete write.
+        """
+        f = open(path, 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            size -= size % RECORD_SIZE
+            if size == 0:
+                return 0, 0
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        try:
+            kind, _, _, generation = HEADER.unpack_from(data, 0)
+            if kind != GENERATION or PAYLOADS[GENERATION].unpack_from(
+                data, HEADER.size
+            )[0] != MAGIC:
+                raise RuntimeError('%s is not a Cleaver log.' % path)
+
+            chunks = {}  # string ID -> [bytes, ...]
+            variants = {}  # experiment ID -> {index: variant name}
+            uncommitted = []  # string IDs defined by an incomplete write
+            end = RECORD_SIZE
+            for start in range(RECORD_SIZE, size, RECORD_SIZE):
+                kind, length, index, id = HEADER.unpack_from(data, start)
+                offset = start + HEADER.size
+                if kind in PAYLOADS:
+                    payload = PAYLOADS[kind].unpack_from(data, offset)
+
+                if kind == STRING:
+                    chunks.setdefault(id, []).append(
+                        data[offset:offset + length]
+                    )
+                    if not index:
+                        strings[id] = _EMPTY.join(chunks.pop(id)).decode(
+                            'utf-8'
+                        )
+                        uncommitted.append(id)
+                elif kind == VARIANT:
+                    variants.setdefault(id, {})[index] = strings[payload[0]]
+                elif kind == EXPERIMENT:
+                    names = variants.pop(id)
+                    experiment = _Experiment(
+                        id,
+                        strings[payload[0]],
+                        EPOCH + timedelta(microseconds=payload[1]),
+                        [names[i] for i in range(index)]
+                    )
+                    self._experiments_by_id.append(experiment)
+                    self._experiments[experiment.name] = experiment
+                elif kind == HUMAN:
+                    self._humans.add(strings[id])
+                elif kind == ASSIGNMENT:
+                    self._assignments.setdefault(
+                        strings[id], {}
+                    )[payload[0]] = index
+                elif kind == PARTICIPANTS:
+                    self._experiments_by_id[id].participants[index] += \
+                        payload[0]
+                elif kind == CONVERSIONS:
+                    self._experiments_by_id[id].conversions[index] += \
+                        payload[0]
+                else:
+                    raise RuntimeError(
+                        'Unknown record type %s in %s.' % (kind, path)
+                    )
+
+                if not chunks and not variants:
+                    end = start + RECORD_SIZE
+                    uncommitted = []
+
+            # Strings written along with an experiment that never was are
+            # discarded with it
+            for id in uncommitted:
+                strings.pop(id)
+            return generation, end
+        finally:
+            data.close()
+
+    def _remove_logs(self, generation):
+        for g in self._log_generations():
+            if g < generation:
+                os.remove(self._log_path(g))
+
+    #
+    # Writes
+    #
+
+    def _identity(self, identity):
+        return _text(identity)
+
+    def _intern(self, value, records, new):
+        """
+        Look up the string ID for a string, adding records that define it to
+        ``records`` (and to ``new``) if it doesn't have one yet.
+        """
+        value = _text(value)
+        if value in self._strings:
+            return self._strings[value]
+        if value not in new:
+            new[value] = len(self._strings) + len(new)
+            records.extend(_string_records(new[value], value))
+        return new[value]
+
+    def _records(self, change, args, new):
+        records = []
+        if change == 'experiment':
+            experiment, = args
+            for index, variant in enumerate(experiment.variants):
+                variant_id = self._intern(variant, records, new)
+                records.append(_pack(VARIANT, experiment.id, index,
+                                     variant_id))
+            records.append(_pack(
+                EXPERIMENT,
+                experiment.id,
+                len(experiment.variants),
+                self._intern(experiment.name, records, new),
+                _microseconds(experiment.started_on)
+            ))
+        elif change == 'human':
+            identity, = args
+            records.append(_pack(HUMAN, self._intern(identity, records, new)))
+        elif change == 'assignments':
+            for identity, experiment, index in args[0]:
+                records.append(_pack(
+                    ASSIGNMENT,
+                    self._intern(identity, records, new),
+                    index,
+                    experiment.id
+                ))
+        else:
+            kind = PARTICIPANTS if change == 'participants' else CONVERSIONS
+            for (experiment, index), count in args[0].items():
+                records.append(_pack(kind, experiment.id, index, count))
+        return records
+
+    def _log(self, change, *args):
+        self._start()
+        self._log_lock.acquire()
+        try:
+            new = {}
+            data = _EMPTY.join(self._records(change, args, new))
+            if self._fd is None:
+                self._fd = self._open(self._generation)
+                self._size = os.fstat(self._fd).st_size
+            _write(self._fd, data)
+            if self.fsync:
+                os.fsync(self._fd)
+            self._size += len(data)
+
+            # Strings are only remembered once they've been written
+            self._strings.update(new)
+        finally:
+            self._log_lock.release()
+
+    #
+    # Compaction
+    #
+
+    def _start(self):
+        # Threads don't survive a fork
+        if self._pid == os.getpid():
+            return
+        self._log_lock.acquire()
+        try:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='cleaver-log-compactor'
+            )
+            self._thread.daemon = True
+            self._thread.start()
+        finally:
+            self._log_lock.release()
+
+    def _run(self):
+        stopped = self._stopped
+        while not stopped.wait(self.interval):
+            if self._size < self.compact_size:
+                continue
+            try:
+                self.compact()
+            except Exception:
+                log.exception('Failed to compact the Cleaver log')
+
+    def _snapshot_records(self, state):
+        experiments, humans, assignments, strings, generation = state
+        yield _pack(GENERATION, generation, 0, MAGIC)
+        for value, id in sorted(strings.items(), key=lambda s: s[1]):
+            for record in _string_records(id, value):
+                yield record
+        for id, name, started_on, variants, participants, conversions in \
+                experiments:
+            for index, variant in enumerate(variants):
+                yield _pack(VARIANT, id, index, strings[variant])
+            yield _pack(EXPERIMENT, id, len(variants), strings[name],
+                        _microseconds(started_on))
+            for index, total in enumerate(participants):
+                if total:
+                    yield _pack(PARTICIPANTS, id, index, total)
+            for index, total in enumerate(conversions):
+                if total:
+                    yield _pack(CONVERSIONS, id, index, total)
+        for identity in humans:
+            yield _pack(HUMAN, strings[identity])
+        for identity, assigned in assignments:
+            for experiment_id, index in assigned:
+                yield _pack(ASSIGNMENT, strings[identity], index,
+                            experiment_id)
+
+    def compact(self):
+        """
+        Rewrite the backend's state into a new snapshot, and discard the
+        logs it replaces.
+
+        New writes are appended to a new log while the snapshot is written.
+        """
+        self._compact_lock.acquire()
+        try:
+            # Start a new log before releasing the locks
+            locks = self._acquire_all(self._log_lock)
+            try:
+                generation = self._generation + 1
+                state = (
+                    [(
+                        e.id,
+                        e.name,
+                        e.started_on,
+                        e.variants,
+                        e.participants.tolist(),
+                        e.conversions.tolist()
+                    ) for e in self._experiments_by_id],
+                    [_text(identity) for identity in self._humans],
+                    [
+                        (_text(identity), list(assigned.items()))
+                        for identity, assigned in self._assignments.items()
+                    ],
+                    dict(self._strings),
+                    generation
+                )
+                fd = self._open(generation)
+                if self._fd is not None:
+                    os.close(self._fd)
+                self._fd, self._generation = fd, generation
+                self._size = os.fstat(fd).st_size
+            finally:
+                _release_all(locks)
+
+            def write(f):
+                batch = []
+                for record in self._snapshot_records(state):
+                    batch.append(record)
+                    if len(batch) == 4096:
+                        f.write(_EMPTY.join(batch))
+                        batch = []
+                f.write(_EMPTY.join(batch))
+
+            _write_atomically(self._snapshot_path(), write)
+            self._remove_logs(generation)
+        finally:
+            self._compact_lock.release()
+
+    def snapshot(self, path=None):
+        """
+        Compact the log into the backend's own snapshot (see ``compact``).
+
+        Every change is already persisted, so snapshots can't be written
+        elsewhere.
+        """
+        if path is not None:
+            raise RuntimeError(
+                '%s only writes snapshots to its directory.' %
+                self.__class__.__name__
+            )
+        self.compact()
+
+    def load(self, path=None):
+        """
+        Not supported; the backend's state is recovered from its directory
+        when it's created.
+        """
+        raise RuntimeError(
+            '%s can only load the snapshot in its directory (when it\'s '
+            'created).' % self.__class__.__name__
+        )
+
+    def close(self):
+        """
+        Stop the background thread, and close the log.
+        """
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        self._pid = None
+
+        self._log_lock.acquire()
+        try:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self._log_lock.release()
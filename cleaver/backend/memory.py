@@ -0,0 +1,512 @@
+import os
+import pickle
+import tempfile
+import threading
+from array import array
+from datetime import datetime
+
+from cleaver.experiment import Experiment as CleaverExperiment
+from cleaver.backend import CleaverBackend
+
+
+def _release_all(locks):
+    for lock in reversed(locks):
+        lock.release()
+
+
+def _write_atomically(path, write):
+    """
+    Replace the file at ``path`` with whatever ``write`` writes to the
+    (binary) file object it's called with.
+
+    The data is written to a temporary file first (and renamed into place),
+    so that a crash never leaves a partially written file behind.
+    """
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix='.cleaver-snapshot-'
+    )
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+class _Experiment(object):
+    """
+    Internal storage for a single experiment.
+
+    Variants are referred to by their position in ``variants``, and event
+    totals are kept in compact ``array``s (indexed by that position).
+    """
+
+    __slots__ = ('id', 'name', 'started_on', 'variants', 'index',
+                 'participants', 'conversions')
+
+    def __init__(self, id, name, started_on, variants):
+        self.id = id
+        self.name = name
+        self.started_on = started_on
+        self.variants = tuple(variants)
+        self.index = dict((v, i) for i, v in enumerate(self.variants))
+        self.participants = array('L', [0] * len(self.variants))
+        self.conversions = array('L', [0] * len(self.variants))
+
+
+class MemoryBackend(CleaverBackend):
+    """
+    Stores experiments, verified humans, variant assignments and event totals
+    in memory, for single-process deployments (and as an I/O-free baseline
+    for tests and benchmarks).
+
+    Experiments, humans, assignments and totals are each guarded by their own
+    lock, so that (for example) counting a conversion never waits on a visitor
+    being assigned a variant.
+
+    State can optionally be persisted with ``snapshot``; when ``path`` is
+    specified, an existing snapshot at that location is loaded when the
+    backend is created.
+
+    :param path an optional filesystem path to load snapshots from (and save
+                snapshots to).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+        self._experiments = {}  # name -> _Experiment
+        self._experiments_by_id = []
+        self._humans = set()
+        self._assignments = {}  # identity -> {experiment id: variant index}
+
+        self._experiment_lock = threading.Lock()
+        self._human_lock = threading.Lock()
+        self._assignment_lock = threading.Lock()
+        self._event_lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _log(self, change, *args):
+        """
+        Called (while the lock guarding the changed state is held) whenever
+        the backend's state changes, so that subclasses can persist each
+        change as it happens.
+
+        :param change one of ``'experiment'`` (with an ``_Experiment``),
+                      ``'human'`` (with an identity), ``'assignments'`` (with
+                      a list of (identity, _Experiment, variant index)
+                      tuples), ``'participants'`` or ``'conversions'`` (with
+                      a dictionary mapping (_Experiment, variant index)
+                      tuples to amounts)
+        """
+
+    def experiment_factory(self, experiment):
+        if experiment is None:
+            return None
+        return CleaverExperiment(
+            backend=self,
+            name=experiment.name,
+            started_on=experiment.started_on,
+            variants=experiment.variants
+        )
+
+    def all_experiments(self):
+        """
+        Retrieve every available experiment.
+
+        Returns a list of ``cleaver.experiment.Experiment``s
+        """
+        return [
+            self.experiment_factory(e)
+            for e in list(self._experiments_by_id)
+        ]
+
+    def get_experiment(self, name, variants):
+        """
+        Retrieve an experiment by its name and variants (assuming it exists).
+
+        :param name a unique string name for the experiment
+        :param variants a list of strings, each with a unique variant name
+
+        Returns a ``cleaver.experiment.Experiment`` or ``None``
+        """
+        return self.experiment_factory(self._experiments.get(name))
+
+    def get_experiments(self, experiments):
+        """
+        Retrieve many experiments at once.
+
+        :param experiments a dictionary mapping unique string experiment
+                           names to a list of variant names
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        found = {}
+        for name in experiments:
+            experiment = self._experiments.get(name)
+            if experiment is not None:
+                found[name] = self.experiment_factory(experiment)
+        return found
+
+    def save_experiment(self, name, variants):
+        """
+        Persist an experiment and its variants (unless they already exist).
+
+        :param name a unique string name for the experiment
+        :param variants a list of strings, each with a unique variant name
+        """
+        self._experiment_lock.acquire()
+        try:
+            if name not in self._experiments:
+                experiment = _Experiment(
+                    len(self._experiments_by_id),
+                    name,
+                    datetime.utcnow(),
+                    variants
+                )
+                self._experiments_by_id.append(experiment)
+                self._experiments[name] = experiment
+                self._log('experiment', experiment)
+        finally:
+            self._experiment_lock.release()
+
+    def _identity(self, identity):
+        """
+        Normalize an identity before it's used to store (or look up) humans
+        and assignments; subclasses that persist identities as text override
+        this so that they're found again after a restart.
+        """
+        return identity
+
+    def is_verified_human(self, identity):
+        return self._identity(identity) in self._humans
+
+    def mark_human(self, identity):
+        identity = self._identity(identity)
+        self._human_lock.acquire()
+        try:
+            if identity not in self._humans:
+                self._humans.add(identity)
+                self._log('human', identity)
+        finally:
+            self._human_lock.release()
+
+    def get_variant(self, identity, experiment_name):
+        """
+        Retrieve the variant for a specific user and experiment (if it exists).
+
+        :param identity a unique user identifier
+        :param experiment_name the string name of the experiment
+
+        Returns a ``String`` or `None`
+        """
+        experiment = self._experiments.get(experiment_name)
+        if experiment is None:
+            return None
+        index = self._assignments.get(
+            self._identity(identity), {}
+        ).get(experiment.id)
+        if index is None:
+            return None
+        return experiment.variants[index]
+
+    def get_variants(self, identity, experiment_names):
+        """
+        Retrieve the variants for a specific user and many experiments at
+        once.
+
+        :param identity a unique user identifier
+        :param experiment_names a list of string experiment names
+
+        Returns a dictionary mapping experiment names to variant names
+        (experiments the user hasn't been assigned a variant for are
+        omitted).
+        """
+        assigned = self._assignments.get(self._identity(identity))
+        if not assigned:
+            return {}
+        variants = {}
+        for experiment_name in experiment_names:
+            experiment = self._experiments.get(experiment_name)
+            if experiment is not None and experiment.id in assigned:
+                variants[experiment_name] = experiment.variants[
+                    assigned[experiment.id]
+                ]
+        return variants
+
+    def get_assignments(self, identity):
+        """
+        Retrieve every variant assigned to a specific user.
+
+        :param identity a unique user identifier
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        by_id = self._experiments_by_id
+        return dict(
+            (by_id[experiment_id].name, by_id[experiment_id].variants[index])
+            for experiment_id, index in list(
+                self._assignments.get(self._identity(identity), {}).items()
+            )
+        )
+
+    def set_variant(self, identity, experiment_name, variant):
+        """
+        Set the variant for a specific user.
+
+        :param identity a unique user identifier
+        :param experiment_name the string name of the experiment
+        :param variant the string name of the variant
+
+        Returns ``True`` if a new assignment was stored, and ``False`` if
+        the user already had a variant for the experiment (or the experiment
+        or variant doesn't exist).
+        """
+        experiment = self._experiments.get(experiment_name)
+        if experiment is None or variant not in experiment.index:
+            return False
+
+        identity = self._identity(identity)
+        self._assignment_lock.acquire()
+        try:
+            assigned = self._assignments.setdefault(identity, {})
+            if experiment.id in assigned:
+                return False
+            assigned[experiment.id] = experiment.index[variant]
+            self._log('assignments', [
+                (identity, experiment, experiment.index[variant])
+            ])
+            return True
+        finally:
+            self._assignment_lock.release()
+
+    def participate_many(self, identity, variants):
+        """
+        Set the variants for a specific user and mark a participation for
+        many experiments at once.
+
+        :param identity a unique user identifier
+        :param variants a dictionary mapping string experiment names to
+                        string variant names
+        """
+        identity = self._identity(identity)
+        new = []
+        self._assignment_lock.acquire()
+        try:
+            assigned = self._assignments.setdefault(identity, {})
+            for experiment_name, variant in variants.items():
+                experiment = self._experiments.get(experiment_name)
+                if experiment is None or variant not in experiment.index or \
+                        experiment.id in assigned:
+                    continue
+                assigned[experiment.id] = experiment.index[variant]
+                new.append((experiment, experiment.index[variant]))
+            if new:
+                self._log('assignments', [
+                    (identity, experiment, index) for experiment, index in new
+                ])
+        finally:
+            self._assignment_lock.release()
+
+        if new and self.is_verified_human(identity):
+            self._increment('participants', new)
+
+    def write_many(self, assignments, events):
+        """
+        Store many variant assignments and events at once.
+
+        :param assignments a list of (identity, experiment_name, variant)
+                           tuples
+        :param events a list of (type, experiment_name, variant) tuples, where
+                      type is ``'PARTICIPANT'`` or ``'CONVERSION'``
+        """
+        for identity, experiment_name, variant in assignments:
+            self.set_variant(identity, experiment_name, variant)
+
+        participants, conversions = [], []
+        for type, experiment_name, variant in events:
+            experiment = self._experiments.get(experiment_name)
+            if experiment is None or variant not in experiment.index:
+                continue
+            if type == 'PARTICIPANT':
+                participants.append((experiment, experiment.index[variant]))
+            else:
+                conversions.append((experiment, experiment.index[variant]))
+        self._increment('participants', participants)
+        self._increment('conversions', conversions)
+
+    def mark_event_totals(self, totals):
+        """
+        Add to many participation and conversion totals at once.
+
+        :param totals a dictionary mapping (type, experiment_name, variant)
+                      tuples, where type is ``'PARTICIPANT'`` or
+                      ``'CONVERSION'``, to integer amounts
+        """
+        amounts = {'participants': {}, 'conversions': {}}
+        for (type, experiment_name, variant), amount in totals.items():
+            experiment = self._experiments.get(experiment_name)
+            if experiment is None or variant not in experiment.index:
+                continue
+            key = (experiment, experiment.index[variant])
+            tally = amounts[
+                'participants' if type == 'PARTICIPANT' else 'conversions'
+            ]
+            tally[key] = tally.get(key, 0) + amount
+        for name, tally in amounts.items():
+            self._add(name, tally)
+
+    def _increment(self, totals, variants):
+        amounts = {}
+        for key in variants:
+            amounts[key] = amounts.get(key, 0) + 1
+        self._add(totals, amounts)
+
+    def _add(self, totals, amounts):
+        if not amounts:
+            return
+        self._event_lock.acquire()
+        try:
+            for (experiment, index), amount in amounts.items():
+                getattr(experiment, totals)[index] += amount
+            self._log(totals, amounts)
+        finally:
+            self._event_lock.release()
+
+    def _mark_event(self, totals, experiment_name, variant):
+        experiment = self._experiments.get(experiment_name)
+        if experiment is not None and variant in experiment.index:
+            self._increment(totals, [(experiment, experiment.index[variant])])
+
+    def mark_participant(self, experiment_name, variant):
+        """
+        Mark a participation for a specific experiment variant.
+
+        :param experiment_name the string name of the experiment
+        :param variant the string name of the variant
+        """
+        self._mark_event('participants', experiment_name, variant)
+
+    def mark_conversion(self, experiment_name, variant):
+        """
+        Mark a conversion for a specific experiment variant.
+
+        :param experiment_name the string name of the experiment
+        :param variant the string name of the variant
+        """
+        self._mark_event('conversions', experiment_name, variant)
+
+    def _total(self, totals, experiment_name, variant):
+        experiment = self._experiments.get(experiment_name)
+        if experiment is None or variant not in experiment.index:
+            return 0
+        return getattr(experiment, totals)[experiment.index[variant]]
+
+    def participants(self, experiment_name, variant):
+        """
+        The number of participants for a certain variant.
+
+        Returns an integer.
+        """
+        return self._total('participants', experiment_name, variant)
+
+    def conversions(self, experiment_name, variant):
+        """
+        The number of conversions for a certain variant.
+
+        Returns an integer.
+        """
+        return self._total('conversions', experiment_name, variant)
+
+    def _acquire_all(self, *extra):
+        """
+        Acquire every lock (always in the same order, followed by ``extra``)
+        for a consistent view of the backend's state.
+
+        Returns the locks, to be released with ``_release_all``.
+        """
+        locks = (self._experiment_lock, self._human_lock,
+                 self._assignment_lock, self._event_lock) + extra
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    def snapshot(self, path=None):
+        """
+        Atomically write the backend's state to disk.
+
+        :param path the filesystem path to write to (defaults to the ``path``
+                    the backend was created with).
+        """
+        path = path or self.path
+        if path is None:
+            raise RuntimeError('A snapshot path is required.')
+
+        locks = self._acquire_all()
+        try:
+            state = {
+                'experiments': [(
+                    e.name,
+                    e.started_on,
+                    e.variants,
+                    e.participants.tolist(),
+                    e.conversions.tolist()
+                ) for e in self._experiments_by_id],
+                'humans': list(self._humans),
+                'assignments': [
+                    (identity, list(assigned.items()))
+                    for identity, assigned in self._assignments.items()
+                ]
+            }
+        finally:
+            _release_all(locks)
+
+        _write_atomically(
+            path,
+            lambda f: pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        )
+
+    def load(self, path=None):
+        """
+        Replace the backend's state with a snapshot written by ``snapshot``.
+
+        Snapshots are pickled, so only load snapshots from trusted locations.
+
+        :param path the filesystem path to read from (defaults to the ``path``
+                    the backend was created with).
+        """
+        path = path or self.path
+        f = open(path, 'rb')
+        try:
+            state = pickle.load(f)
+        finally:
+            f.close()
+
+        experiments = {}
+        by_id = []
+        for name, started_on, variants, participants, conversions in \
+                state['experiments']:
+            experiment = _Experiment(len(by_id), name, started_on, variants)
+            experiment.participants = array('L', participants)
+            experiment.conversions = array('L', conversions)
+            by_id.append(experiment)
+            experiments[name] = experiment
+
+        self._experiments = experiments
+        self._experiments_by_id = by_id
+        self._humans = set(state['humans'])
+        self._assignments = dict(
+            (identity, dict(assigned))
+            for identity, assigned in state['assignments']
+        )
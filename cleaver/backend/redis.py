@@ -0,0 +1,412 @@
+from __future__ import absolute_import
+
+import json
+from datetime import datetime
+
+from cleaver.experiment import Experiment as CleaverExperiment
+from cleaver.backend import CleaverBackend
+
+
+def _redis_installed():
+    try:
+        import redis
+    except ImportError:  # pragma: nocover
+        raise ImportError(
+            'The Redis backend requires redis-py to be installed.  '
+            'See http://pypi.python.org/pypi/redis'
+        )
+    return redis
+redis = _redis_installed()
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# KEYS: experiment hash, experiment name list, variant set
+# ARGV: name, started_on, JSON-encoded variants, variant, variant, ...
+_SAVE_EXPERIMENT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HMSET', KEYS[1], 'started_on', ARGV[2], 'variants', ARGV[3])
+if #ARGV >= 4 then
+    redis.call('SADD', KEYS[3], unpack(ARGV, 4))
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: assignment hash, human set, then (variant set, participant hash) for
+#       each experiment
+# ARGV: identity, a participation mode, then (experiment name, variant) for
+#       each experiment
+#
+# When the identity is a verified human, a mode of '1' marks a participation
+# for new assignments, and '2' for every assignment (new or not).  Returns
+# the number of new assignments.
+_PARTICIPATE = """
+local human = ARGV[2] ~= '0' and
+    redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1
+local stored = 0
+for i = 1, (#ARGV - 2) / 2 do
+    local experiment, variant = ARGV[1 + 2 * i], ARGV[2 + 2 * i]
+    if redis.call('SISMEMBER', KEYS[1 + 2 * i], variant) == 1 then
+        local new = redis.call('HSETNX', KEYS[1], experiment, variant) == 1
+        if new then
+            stored = stored + 1
+        end
+        if human and (new or ARGV[2] == '2') then
+            redis.call('HINCRBY', KEYS[2 + 2 * i], variant, 1)
+        end
+    end
+end
+return stored
+"""
+
+# KEYS: variant set, event total hash
+# ARGV: variant, amount
+_MARK_EVENT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class RedisBackend(CleaverBackend):
+    """
+    Provides an interface for persisting and retrieving A/B test results
+    to Redis.
+
+    Every experiment is stored in a hash (with a set of its variant names),
+    each visitor's variant assignments in a hash keyed by experiment name,
+    verified humans in a set, and participant and conversion totals in
+    hashes (one per experiment) keyed by variant name.
+
+    Assigning variants and counting events are each performed by a single
+    server-side (Lua) script, so they're atomic, and take one round trip.
+
+    :param url a Redis URL, e.g., ``redis://localhost:6379/0``
+    :param prefix a string prepended to every key Cleaver stores
+    :param client an existing ``redis.StrictRedis`` (or compatible) client to
+                  use instead of connecting to ``url``.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='cleaver:',
+                 client=None):
+        self.url = url
+        self.prefix = prefix
+        if client is None:
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+
+        self._save_experiment = client.register_script(_SAVE_EXPERIMENT)
+        self._participate = client.register_script(_PARTICIPATE)
+        self._mark_event = client.register_script(_MARK_EVENT)
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join('%s' % p for p in parts)
+
+    def experiment_factory(self, name, data):
+        if not data:
+            return None
+        data = dict((_decode(k), _decode(v)) for k, v in data.items())
+        return CleaverExperiment(
+            backend=self,
+            name=name,
+            started_on=datetime.strptime(data['started_on'], _DATE_FORMAT),
+            variants=tuple(json.loads(data['variants']))
+        )
+
+    def _get_experiments(self, names):
+        pipe = self.client.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(self._key('experiment', name))
+        return [
+            self.experiment_factory(name, data)
+            for name, data in zip(names, pipe.execute())
+        ]
+
+    def all_experiments(self):
+        """
+        Retrieve every available experiment.
+
+        Returns a list of ``cleaver.experiment.Experiment``s
+        """
+        names = [
+            _decode(name)
+            for name in self.client.lrange(self._key('experiments'), 0, -1)
+        ]
+        return [e for e in self._get_experiments(names) if e is not None]
+
+    def get_experiment(self, name, variants):
+        """
+        Retrieve an experiment by its name and variants (assuming it exists).
+
+        :param name a unique string name for the experiment
+        :param variants a list of strings, each with a unique variant name
+
+        Returns a ``cleaver.experiment.Experiment`` or ``None``
+        """
+        return self.experiment_factory(
+            name,
+            self.client.hgetall(self._key('experiment', name))
+        )
+
+    def get_experiments(self, experiments):
+        """
+        Retrieve many experiments at once (with a single round trip).
+
+        :param experiments a dictionary mapping unique string experiment
+                           names to a list of variant names
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        names = list(experiments)
+        if not names:
+            return {}
+        return dict(
+            (e.name, e) for e in self._get_experiments(names)
+            if e is not None
+        )
+
+    def save_experiment(self, name, variants):
+        """
+        Persist an experiment and its variants (unless they already exist).
+
+        :param name a unique string name for the experiment
+        :param variants a list of strings, each with a unique variant name
+        """
+        variants = list(variants)
+        self._save_experiment(
+            keys=[
+                self._key('experiment', name),
+                self._key('experiments'),
+                self._key('variants', name)
+            ],
+            args=[
+                name,
+                datetime.utcnow().strftime(_DATE_FORMAT),
+                json.dumps(variants)
+            ] + variants
+        )
+
+    def is_verified_human(self, identity):
+        return bool(self.client.sismember(self._key('humans'), identity))
+
+    def mark_human(self, identity):
+        self.client.sadd(self._key('humans'), identity)
+
+    def get_variant(self, identity, experiment_name):
+        """
+        Retrieve the variant for a specific user and experiment (if it exists).
+
+        :param identity a unique user identifier
+        :param experiment_name the string name of the experiment
+
+        Returns a ``String`` or `None`
+        """
+        return _decode(self.client.hget(
+            self._key('assignments', identity),
+            experiment_name
+        ))
+
+    def get_variants(self, identity, experiment_names):
+        """
+        Retrieve the variants for a specific user and many experiments at
+        once.
+
+        :param identity a unique user identifier
+        :param experiment_names a list of string experiment names
+
+        Returns a dictionary mapping experiment names to variant names
+        (experiments the user hasn't been assigned a variant for are
+        omitted).
+        """
+        experiment_names = list(experiment_names)
+        if not experiment_names:
+            return {}
+        return dict(
+            (name, _decode(variant))
+            for name, variant in zip(experiment_names, self.client.hmget(
+                self._key('assignments', identity),
+                experiment_names
+            ))
+            if variant is not None
+        )
+
+    def get_assignments(self, identity):
+        """
+        Retrieve every variant assigned to a specific user.
+
+        :param identity a unique user identifier
+
+        Returns a dictionary mapping experiment names to variant names.
+        """
+        return dict(
+            (_decode(name), _decode(variant))
+            for name, variant in self.client.hgetall(
+                self._key('assignments', identity)
+            ).items()
+        )
+
+    def _assign(self, identity, variants, mode, client=None):
+        keys = [self._key('assignments', identity), self._key('humans')]
+        args = [identity, mode]
+        for experiment_name, variant in variants:
+            keys.extend([
+                self._key('variants', experiment_name),
+                self._key('participants', experiment_name)
+            ])
+            args.extend([experiment_name, variant])
+        return self._participate(keys=keys, args=args, client=client)
+
+    def set_variant(self, identity, experiment_name, variant):
+        """
+        Set the variant for a specific user.
+
+        :param identity a unique user identifier
+        :param experiment_name the string name of the experiment
+        :param variant the string name of the variant
+
+        Returns ``True`` if a new assignment was stored, and ``False`` if
+        the user already had a variant for the experiment (or the experiment
+        or variant doesn't exist).
+        """
+        return self._assign(
+            identity,
+            [(experiment_name, variant)],
+            '0'
+        ) == 1
+
+    def participate(self, identity, experiment_name, variant):
+        """
+        Set the variant for a specific user and mark a participation for the
+        experiment (for verified humans only), atomically.
+        """
+        self._assign(identity, [(experiment_name, variant)], '2')
+
+    def participate_many(self, identity, variants):
+        """
+        Set the variants for a specific user and mark a participation for
+        many experiments at once, atomically.
+
+        :param identity a unique user identifier
+        :param variants a dictionary mapping string experiment names to
+                        string variant names
+        """
+        if variants:
+            self._assign(identity, list(variants.items()), '1')
+
+    def _increment(self, type, experiment_name, variant, amount=1,
+                   client=None):
+        return self._mark_event(
+            keys=[
+                self._key('variants', experiment_name),
+                self._key(type, experiment_name)
+            ],
+            args=[variant, amount],
+            client=client
+        )
+
+    def mark_participant(self, experiment_name, variant):
+        """
+        Mark a participation for a specific experiment variant.
+
+        :param experiment_name the string name of the experiment
+        :param variant the string name of the variant
+        """
+        self._increment('participants', experiment_name, variant)
+
+    def mark_conversion(self, experiment_name, variant):
+        """
+        Mark a conversion for a specific experiment variant.
+
+        :param experiment_name the string name of the experiment
+        :param variant the string name of the variant
+        """
+        self._increment('conversions', experiment_name, variant)
+
+    def write_many(self, assignments, events):
+        """
+        Store many variant assignments and events at once (in a single
+        pipelined round trip).
+
+        :param assignments a list of (identity, experiment_name, variant)
+                           tuples
+        :param events a list of (type, experiment_name, variant) tuples, where
+                      type is ``'PARTICIPANT'`` or ``'CONVERSION'``
+        """
+        if not assignments and not events:
+            return
+
+        by_identity = {}
+        for identity, experiment_name, variant in assignments:
+            by_identity.setdefault(identity, []).append(
+                (experiment_name, variant)
+            )
+
+        totals = {}
+        for type, experiment_name, variant in events:
+            key = (
+                'participants' if type == 'PARTICIPANT' else 'conversions',
+                experiment_name,
+                variant
+            )
+            totals[key] = totals.get(key, 0) + 1
+
+        pipe = self.client.pipeline(transaction=False)
+        for identity, variants in by_identity.items():
+            self._assign(identity, variants, '0', client=pipe)
+        for (type, experiment_name, variant), amount in totals.items():
+            self._increment(type, experiment_name, variant, amount,
+                            client=pipe)
+        pipe.execute()
+
+    def mark_event_totals(self, totals):
+        """
+        Add to many participation and conversion totals at once (in a single
+        pipelined round trip).
+
+        :param totals a dictionary mapping (type, experiment_name, variant)
+                      tuples, where type is ``'PARTICIPANT'`` or
+                      ``'CONVERSION'``, to integer amounts
+        """
+        if not totals:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for (type, experiment_name, variant), amount in totals.items():
+            self._increment(
+                'participants' if type == 'PARTICIPANT' else 'conversions',
+                experiment_name, variant, amount,
+                client=pipe
+            )
+        pipe.execute()
+
+    def _total(self, type, experiment_name, variant):
+        return int(self.client.hget(
+            self._key(type, experiment_name),
+            variant
+        ) or 0)
+
+    def participants(self, experiment_name, variant):
+        """
+        The number of participants for a certain variant.
+
+        Returns an integer.
+        """
+        return self._total('participants', experiment_name, variant)
+
+    def conversions(self, experiment_name, variant):
+        """
+        The number of conversions for a certain variant.
+
+        Returns an integer.
+        """
+        return self._total('conversions', experiment_name, variant)
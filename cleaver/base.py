@@ -1,14 +1,56 @@
-from .compat import zip_longest, string_types, next
+import weakref
+
+from .compat import zip_longest, string_types
 from .backend import CleaverBackend
 from .identity import CleaverIdentityProvider
+from .registry import default_registry, _unwrap
 from cleaver import util
 
 
+# Compiled ``util.VariantSpec``s, keyed by (experiment name, variants, the
+# types of the variants' values), so that values which compare as equal but
+# differ in type (e.g., 1, 1.0 and True) don't share a spec.
+_SPECS = {}
+_MAX_SPECS = 4096
+
+
+# Hashed assignments this process has already stored, as a set of
+# (assignment identity, experiment name, variant) tuples per backend, so
+# that returning visitors don't cost a write on every request.
+_RECORDED = weakref.WeakKeyDictionary()
+_MAX_RECORDED = 65536
+
+
+def _unrecorded(backend, identity, variants):
+    recorded = _RECORDED.get(_unwrap(backend), ())
+    return dict(
+        (name, variant) for name, variant in variants.items()
+        if (identity, name, variant) not in recorded
+    )
+
+
+def _record(backend, identity, variants):
+    backend = _unwrap(backend)
+    recorded = _RECORDED.get(backend)
+    if recorded is None or len(recorded) >= _MAX_RECORDED:
+        recorded = _RECORDED[backend] = set()
+    for name, variant in variants.items():
+        recorded.add((identity, name, variant))
+
+
+def _types_of(value):
+    if isinstance(value, tuple):
+        return tuple(_types_of(v) for v in value)
+    return type(value)
+
+
 class Cleaver(object):
 
     def __init__(self, environ, identity, backend,
                  count_humans_only=False,
-                 human_callback_token='__cleaver_human_verification__'):
+                 human_callback_token='__cleaver_human_verification__',
+                 experiment_registry=default_registry,
+                 hash_assignment=False, hash_salt='', human_cookie=None):
         """
         Create a new Cleaver instance.
 
@@ -29,6 +71,26 @@ class Cleaver(object):
         :param human_callback_token when ``count_humans_only`` is True, this
                                     token in the URL will trigger a simple
                                     verification process for humans.
+        :param experiment_registry a ``cleaver.registry.ExperimentRegistry``
+                                   used to cache experiment definitions
+                                   (defaults to a process-wide registry).
+                                   When None, every call to ``split`` reads
+                                   the experiment from the backend.
+        :param hash_assignment when True, variants are chosen
+                               deterministically from a hash of the visitor's
+                               identity, the experiment name and
+                               ``hash_salt`` instead of being chosen randomly
+                               and read back from the backend on every request
+                               (defaults to False).  Hashed assignments are
+                               stored separately from random ones (see
+                               ``assignment_identity``).
+        :param hash_salt a string mixed into the hash used when
+                         ``hash_assignment`` is True; changing it reshuffles
+                         every visitor's variants (and starts counting their
+                         participation and conversions afresh).
+        :param human_cookie a ``cleaver.util.HumanCookie``; when specified,
+                            visitors carrying a valid cookie are treated as
+                            verified humans without consulting the backend.
         """
 
         if not isinstance(identity, CleaverIdentityProvider) and \
@@ -37,15 +99,19 @@ class Cleaver(object):
                 '%s must be callable or implement '
                 'cleaver.identity.CleaverIdentityProvider' % identity
             )
-        if not isinstance(backend, CleaverBackend):
-            raise RuntimeError(
-                '%s must implement cleaver.backend.CleaverBackend' % backend
-            )
+        self._check_backend(backend)
         self._identity = identity
         self._backend = backend
         self._environ = environ
         self.count_humans_only = count_humans_only
         self.human_callback_token = human_callback_token
+        self.experiment_registry = experiment_registry
+        self.hash_assignment = hash_assignment
+        self.hash_salt = hash_salt
+        self.human_cookie = human_cookie
+
+        # Per-request memoization of ``identity`` and ``human``
+        self._cache = {}
 
     def __call__(self, *args):
         return self.split(*args)
@@ -54,14 +120,61 @@ class Cleaver(object):
     def identity(self):
         """
         A unique identifier for the current visitor.
+
+        The identity provider is only consulted once per ``Cleaver`` instance
+        (i.e., once per request).
         """
-        if hasattr(self._identity, 'get_identity'):
-            return self._identity.get_identity(self._environ)
-        return self._identity(self._environ)
+        if 'identity' not in self._cache:
+            if hasattr(self._identity, 'get_identity'):
+                identity = self._identity.get_identity(self._environ)
+            else:
+                identity = self._identity(self._environ)
+            self._cache['identity'] = identity
+        return self._cache['identity']
+
+    @property
+    def assignment_identity(self):
+        """
+        The identifier that the current visitor's variant assignments are
+        stored under.
+
+        When ``hash_assignment`` is True, this includes ``hash_salt``, so that
+        the assignment stored for a visitor is always the one they're shown,
+        even after the salt is changed (or hashing is enabled for an existing
+        experiment).  Otherwise, it's ``identity``.
+        """
+        if self.hash_assignment:
+            return '%s:%s' % (self.hash_salt, self.identity)
+        return self.identity
 
     @property
     def human(self):
-        return self._backend.is_verified_human(self.identity)
+        """
+        Whether the current visitor has been verified as a human.
+
+        The backend is only consulted once per ``Cleaver`` instance (i.e., once
+        per request), and not at all if ``human_cookie`` is in use and the
+        request carries a valid cookie; the cached value is updated by
+        ``mark_human``.
+        """
+        if 'human' not in self._cache:
+            if self.human_cookie is not None and self.human_cookie.is_human(
+                self._environ,
+                self.identity
+            ):
+                self._cache['human'] = True
+            else:
+                self._cache['human'] = self._backend.is_verified_human(
+                    self.identity
+                )
+        return self._cache['human']
+
+    def mark_human(self):
+        """
+        Mark the current visitor as a verified human.
+        """
+        self._backend.mark_human(self.identity)
+        self._cache['human'] = True
 
     def split(self, experiment_name, *variants):
         """
@@ -98,38 +211,134 @@ class Cleaver(object):
                 experiment_name
             )
 
-        keys, values, weights = self._parse_variants(variants)
+        spec = self._compile_variants(experiment_name, variants)
+        keys = spec.keys
         b = self._backend
 
         # Record the experiment if it doesn't exist already
-        experiment = b.get_experiment(experiment_name, keys)
+        experiment = self._get_experiment(experiment_name, keys)
 
         # If the current visitor hasn't been verified as a human, and we've not
         # required human verification, go ahead and mark them as a human.
         if self.count_humans_only is False and self.human is not True:
-            b.mark_human(self.identity)
+            self.mark_human()
 
         if experiment is None:
-            b.save_experiment(experiment_name, keys)
-            experiment = b.get_experiment(experiment_name, keys)
+            self._save_experiment(experiment_name, keys)
+            experiment = self._get_experiment(experiment_name, keys)
         else:
-            if set(experiment.variants) != set(keys):
-                raise RuntimeError(
-                    'An experiment named %s already exists with different '
-                    'variants.' % experiment_name
-                )
+            self._check_variants(experiment, spec)
 
         # Retrieve the variant assigned to the current user
         if experiment.name in self._environ.get('cleaver.override', {}):
             variant = self._environ['cleaver.override'][experiment.name]
+        elif self.hash_assignment:
+            # The same visitor always hashes to the same variant, so there's
+            # no need to read their assignment back from the backend
+            variant = spec.hashed(self._hash_key(experiment.name))
+            self._store_hashed({experiment.name: variant})
         else:
-            variant = b.get_variant(self.identity, experiment.name)
+            variant = b.get_variant(self.assignment_identity, experiment.name)
             if variant is None:
                 # ...or choose (and store) one randomly if it doesn't exist yet
-                variant = next(util.random_variant(keys, weights))
-                b.participate(self.identity, experiment.name, variant)
+                variant = spec.random()
+                b.participate(self.assignment_identity, experiment.name,
+                              variant)
+
+        return spec.value_of[variant]
+
+    def split_many(self, experiments):
+        """
+        Used to split and track user experience amongst many experiments at
+        once, using a constant number of backend calls (rather than several
+        per experiment).
+
+        :param experiments a dictionary mapping unique string experiment
+                           names to a tuple of variants (in any format
+                           accepted by ``split``), e.g.,
+
+            >>> split_many({
+            ...     'text_color': (('red', '#F00'), ('blue', '#00F')),
+            ...     'include_sidebar': ()
+            ... })
+            {'text_color': '#00F', 'include_sidebar': True}
+
+        Returns a dictionary mapping each experiment name to the value of the
+        variant chosen for the current visitor.
+        """
+        specs = {}
+        for experiment_name, variants in experiments.items():
+            if not isinstance(experiment_name, string_types):
+                raise RuntimeError(
+                    'Invalid experiment name: %s must be a string.' %
+                    experiment_name
+                )
+            specs[experiment_name] = self._compile_variants(
+                experiment_name,
+                variants
+            )
 
-        return dict(zip(keys, values))[variant]
+        if not specs:
+            return {}
+
+        b = self._backend
+        requested = dict((name, spec.keys) for name, spec in specs.items())
+
+        # Record any experiments that don't exist already
+        found = self._get_experiments(requested)
+
+        if self.count_humans_only is False and self.human is not True:
+            self.mark_human()
+
+        missing = [name for name in requested if found.get(name) is None]
+        if missing:
+            for name in missing:
+                self._save_experiment(name, requested[name])
+            found.update(self._get_experiments(
+                dict((name, requested[name]) for name in missing)
+            ))
+
+        for name, experiment in found.items():
+            self._check_variants(experiment, specs[name])
+
+        overrides = self._environ.get('cleaver.override', {})
+        chosen = {}
+        for name in specs:
+            if name in overrides:
+                chosen[name] = overrides[name]
+
+        lookup = [name for name in specs if name not in chosen]
+        if self.hash_assignment:
+            # Hashed variants are derived from the visitor's identity, so
+            # there's nothing to retrieve; just store the ones not yet stored
+            hashed = {}
+            for name in lookup:
+                hashed[name] = specs[name].hashed(self._hash_key(name))
+            if hashed:
+                self._store_hashed(hashed)
+            chosen.update(hashed)
+        else:
+            # Retrieve the variants assigned to the current user...
+            assigned = {}
+            if lookup:
+                assigned = b.get_variants(self.assignment_identity,
+                                          lookup)
+
+            # ...and choose (and store) the rest
+            new = {}
+            for name in lookup:
+                variant = assigned.get(name)
+                if variant is None:
+                    variant = new[name] = specs[name].random()
+                chosen[name] = variant
+
+            if new:
+                b.participate_many(self.assignment_identity, new)
+
+        results = {}
+        for name, spec in specs.items():
+            results[name] = spec.value_of[chosen[name]]
+        return results
 
     def score(self, experiment_name):
         """
@@ -143,11 +352,119 @@ class Cleaver(object):
 
         :param experiment_name the string name of the experiment
         """
-        if self._backend.get_variant(self.identity, experiment_name) and \
-                self.human is True:
-            self._backend.mark_conversion(
-                experiment_name,
-                self._backend.get_variant(self.identity, experiment_name)
+        variant = self._backend.get_variant(
+            self.assignment_identity,
+            experiment_name
+        )
+        if variant and self.human is True:
+            self._backend.mark_conversion(experiment_name, variant)
+
+    def score_many(self, experiment_names):
+        """
+        Used to mark the current user's variants for many experiments as
+        "converted" at once (with a single read and a single write).
+
+        Experiments the current user hasn't been assigned a variant for are
+        ignored.
+
+        :param experiment_names a list of string experiment names
+        """
+        experiment_names = list(experiment_names)
+        if not experiment_names:
+            return
+        variants = self._backend.get_variants(
+            self.assignment_identity,
+            experiment_names
+        )
+        if variants and self.human is True:
+            self._backend.mark_conversions(variants)
+
+    def score_all(self):
+        """
+        Used to mark the current user's variants for *every* experiment they
+        participate in as "converted" at once (with a single read and
+        a single write).
+        """
+        variants = self._backend.get_assignments(self.assignment_identity)
+        if variants and self.human is True:
+            self._backend.mark_conversions(variants)
+
+    def _store_hashed(self, variants):
+        """
+        Store the current visitor's hashed variants (so that their
+        participation is counted once, and their conversions are credited to
+        the variants they were shown), skipping any this process has already
+        stored.
+
+        :param variants a dictionary mapping experiment names to variant
+                        names
+        """
+        b = self._backend
+        identity = self.assignment_identity
+        unrecorded = _unrecorded(b, identity, variants)
+        new = {}
+        for name, variant in unrecorded.items():
+            if b.set_variant(identity, name, variant):
+                new[name] = variant
+        if new and self.human is True:
+            b.mark_participants(new)
+        _record(b, identity, unrecorded)
+
+    def _check_backend(self, backend):
+        if not isinstance(backend, CleaverBackend):
+            raise RuntimeError(
+                '%s must implement cleaver.backend.CleaverBackend' % backend
+            )
+
+    def _hash_key(self, experiment_name):
+        return '%s:%s:%s' % (self.hash_salt, experiment_name, self.identity)
+
+    def _get_experiment(self, name, variants):
+        if self.experiment_registry is None:
+            return self._backend.get_experiment(name, variants)
+        return self.experiment_registry.get_experiment(
+            self._backend, name, variants
+        )
+
+    def _get_experiments(self, experiments):
+        if self.experiment_registry is None:
+            return self._backend.get_experiments(experiments)
+        return self.experiment_registry.get_experiments(
+            self._backend, experiments
+        )
+
+    def _save_experiment(self, name, variants):
+        if self.experiment_registry is None:
+            return self._backend.save_experiment(name, variants)
+        return self.experiment_registry.save_experiment(
+            self._backend, name, variants
+        )
+
+    def _compile_variants(self, experiment_name, variants):
+        """
+        Parse variants into a ``util.VariantSpec``, reusing a previously
+        compiled spec for the same experiment and variants when possible.
+        """
+        try:
+            key = (experiment_name, variants, _types_of(variants))
+            spec = _SPECS.get(key)
+        except TypeError:
+            # Variant values aren't hashable, so this spec can't be cached
+            return util.VariantSpec(*self._parse_variants(variants))
+
+        if spec is None:
+            spec = util.VariantSpec(*self._parse_variants(variants))
+            if len(_SPECS) >= _MAX_SPECS:
+                _SPECS.clear()
+            _SPECS[key] = spec
+        return spec
+
+    def _check_variants(self, experiment, spec):
+        if tuple(experiment.variants) != spec.keys and \
+                set(experiment.variants) != set(spec.keys):
+            raise RuntimeError(
+                'An experiment named %s already exists with different '
+                'variants.' % experiment.name
             )
 
     def _parse_variants(self, variants):
@@ -192,6 +509,9 @@ class Cleaver(object):
     def humanizing_javascript(self):
         if self.human:
             return ''
+        return self._humanizing_javascript()
+
+    def _humanizing_javascript(self):
         return """
             <script type="text/javascript">
                var x = Math.floor(Math.random()*100);
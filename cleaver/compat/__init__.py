@@ -13,7 +13,12 @@ except NameError:
 if PY3:
     from itertools import zip_longest
     from urllib.parse import urlencode, parse_qs, parse_qsl
+    from http.cookies import SimpleCookie, CookieError
     string_types = str
+    binary_type = bytes
+
+    def b(s):
+        return s.encode('latin-1')
 elif PY25:
     """
     http://docs.python.org/library/itertools.html#itertools.izip%5Flongest
@@ -44,10 +49,20 @@ elif PY25:
             pass
     from urllib import urlencode  # noqa
     from cgi import parse_qs, parse_qsl  # noqa
+    from Cookie import SimpleCookie, CookieError  # noqa
     string_types = basestring  # noqa
+    binary_type = str
+
+    def b(s):  # noqa
+        return s
 else:
     from itertools import izip_longest as zip_longest  # noqa
 
     from urllib import urlencode  # noqa
     from urlparse import parse_qs, parse_qsl  # noqa
+    from Cookie import SimpleCookie, CookieError  # noqa
     string_types = basestring  # noqa
+    binary_type = str
+
+    def b(s):  # noqa
+        return s
@@ -1,17 +1,26 @@
-import tempfile
-import cgi
-
 from .base import Cleaver
-from .compat import urlencode, parse_qsl
+from .compat import urlencode, parse_qsl, string_types, b
 from .backend import CleaverBackend
+from .backend.buffered import BufferedBackend
 from .identity import CleaverIdentityProvider
+from .registry import default_registry
+
+# Byte strings (built via ``compat.b``, as Python 2.5 has no ``b''`` literals)
+_EMPTY = b('')
+_AMPERSAND = b('&')
+_EQUALS = b('=')
+_CALLBACK_KEYS = (b('x'), b('y'), b('z'))
 
 
 class SplitMiddleware(object):
 
     def __init__(self, app, identity, backend, environ_key='cleaver',
                  allow_override=False, count_humans_only=False,
-                 human_callback_token='__cleaver_human_verification__'):
+                 human_callback_token='__cleaver_human_verification__',
+                 experiment_registry=default_registry,
+                 hash_assignment=False, hash_salt='', buffer_writes=False,
+                 bypass=None, human_cookie=None, max_body_size=1024,
+                 unit_of_work=False):
         """
         Makes a Cleaver instance available every request under
         ``environ['cleaver']``.
@@ -36,6 +45,41 @@ class SplitMiddleware(object):
         :param human_callback_token when ``count_humans_only`` is True, this
                                     token in the URL will trigger a simple
                                     verification process for humans.
+        :param experiment_registry a ``cleaver.registry.ExperimentRegistry``
+                                   used to cache experiment definitions
+                                   (defaults to a process-wide registry).
+                                   When None, experiments are always read
+                                   from the backend.
+        :param hash_assignment when True, variants are chosen
+                               deterministically from a hash of the visitor's
+                               identity and the experiment name, so they
+                               never need to be read back from the backend.
+        :param hash_salt a string mixed into the hash used when
+                         ``hash_assignment`` is True.
+        :param buffer_writes when True, variant assignments, participations
+                             and conversions made during a request are held
+                             in memory and written to the backend in a single
+                             batch after the response has been sent.
+        :param bypass a list of URL path prefixes (e.g., ``'/static/'``)
+                      and/or callables (which are passed the WSGI environ and
+                      return True or False) identifying requests that never
+                      use experiments.  Matching requests are passed straight
+                      through to ``app`` without ``environ['cleaver']``.
+        :param human_cookie a ``cleaver.util.HumanCookie``; when specified,
+                            a successful human verification callback sets
+                            a signed cookie, and visitors carrying a valid
+                            cookie are treated as humans without consulting
+                            the backend.
+        :param max_body_size the largest human verification request body (in
+                             bytes) that will be read; larger requests are
+                             rejected without being read.
+        :param unit_of_work when True, ``backend.begin()`` is called at the
+                            start of each request and ``backend.end()``
+                            after the response has been sent, so that
+                            backends which support it (like
+                            ``cleaver.backend.db.SQLAlchemyBackend``) can
+                            perform all of a request's work in a single
+                            transaction.
         """
         self.app = app
 
@@ -56,14 +100,78 @@ class SplitMiddleware(object):
         self.allow_override = allow_override
         self.count_humans_only = count_humans_only
         self.human_callback_token = human_callback_token
+        self.experiment_registry = experiment_registry
+        self.hash_assignment = hash_assignment
+        self.hash_salt = hash_salt
+        self.buffer_writes = buffer_writes
+        self.human_cookie = human_cookie
+        self.max_body_size = max_body_size
+        self.unit_of_work = unit_of_work
+
+        bypass = bypass or ()
+        self._bypass_prefixes = tuple(
+            b for b in bypass if isinstance(b, string_types)
+        )
+        self._bypass_predicates = tuple(
+            b for b in bypass if not isinstance(b, string_types)
+        )
+        for predicate in self._bypass_predicates:
+            if not callable(predicate):
+                raise RuntimeError(
+                    '%s must be a path prefix or a callable' % predicate
+                )
 
     def __call__(self, environ, start_response):
-        cleaver = Cleaver(
+        if self._bypassed(environ):
+            return self.app(environ, start_response)
+
+        if not self.buffer_writes and not self.unit_of_work:
+            return self._handle(environ, start_response, self._backend)
+
+        backend = self._backend
+        if self.unit_of_work:
+            backend.begin()
+        if self.buffer_writes:
+            backend = BufferedBackend(backend)
+
+        def finish():
+            try:
+                if self.buffer_writes:
+                    backend.flush()
+            finally:
+                if self.unit_of_work:
+                    self._backend.end()
+
+        try:
+            result = self._handle(environ, start_response, backend)
+        except Exception:
+            finish()
+            raise
+        return _FlushingIterable(result, finish)
+
+    def _bypassed(self, environ):
+        if self._bypass_prefixes and environ.get('PATH_INFO', '').startswith(
+            self._bypass_prefixes
+        ):
+            return True
+        for predicate in self._bypass_predicates:
+            if predicate(environ):
+                return True
+        return False
+
+    def _handle(self, environ, start_response, backend):
+        # The Cleaver instance isn't built until the application first uses
+        # it, so requests that never split don't pay for it.
+        cleaver = _LazyCleaver(lambda: Cleaver(
             environ,
             self._identity,
-            self._backend,
-            count_humans_only=self.count_humans_only
-        )
+            backend,
+            count_humans_only=self.count_humans_only,
+            experiment_registry=self.experiment_registry,
+            hash_assignment=self.hash_assignment,
+            hash_salt=self.hash_salt,
+            human_cookie=self.human_cookie
+        ))
         environ[self.environ_key] = cleaver
 
         if self.allow_override:
@@ -78,56 +186,34 @@ class SplitMiddleware(object):
                 environ.get('REQUEST_METHOD', '') == 'POST' and \
                 self.human_callback_token in environ.get('PATH_INFO', ''):
 
-            fp, length = SplitMiddleware._copy_body_to_tempfile(environ)
-            environ.setdefault('CONTENT_LENGTH', length)
+            body = self._read_body(environ)
+            x, y, z = _parse_callback(body or _EMPTY)
 
-            fs = cgi.FieldStorage(
-                fp=fp,
-                environ=environ,
-                keep_blank_values=True
-            )
+            # The AJAX call will include three POST arguments, X, Y, and Z
+            #
+            # Part of the "not a robot test" is validating that X + Y = Z
+            # (most web crawlers won't perform complicated Javascript
+            # execution like math and HTTP callbacks, because it's just too
+            # expensive at scale)
+            if x and y and z and x + y == z:
+                # Mark the visitor as a human
+                cleaver.mark_human()
 
-            try:
-                try:
-                    x = int(fs.getlist('x')[0])
-                except (IndexError, ValueError):
-                    x = 0
-                try:
-                    y = int(fs.getlist('y')[0])
-                except (IndexError, ValueError):
-                    y = 0
-                try:
-                    z = int(fs.getlist('z')[0])
-                except (IndexError, ValueError):
-                    z = 0
-
-                # The AJAX call will include three POST arguments, X, Y, and Z
-                #
-                # Part of the "not a robot test" is validating that X + Y = Z
-                # (most web crawlers won't perform complicated Javascript
-                # execution like math and HTTP callbacks, because it's just too
-                # expensive at scale)
-                if x and y and z and x + y == z:
-                    # Mark the visitor as a human
-                    self._backend.mark_human(cleaver.identity)
-
-                    # If the visitor has been assigned any experiment variants,
-                    # tally their participation.
-                    for e in self._backend.all_experiments():
-                        variant = self._backend.get_variant(
-                            cleaver.identity,
-                            e.name
-                        )
-                        if variant:
-                            self._backend.mark_participant(e.name, variant)
-
-                    start_response(
-                        '204 No Content',
-                        [('Content-Type', 'text/plain')]
+                # If the visitor has been assigned any experiment variants,
+                # tally their participation.
+                assignments = backend.get_assignments(
+                    cleaver.assignment_identity
+                )
+                if assignments:
+                    backend.mark_participants(assignments)
+
+                headers = [('Content-Type', 'text/plain')]
+                if self.human_cookie is not None:
+                    headers.append(
+                        self.human_cookie.header(cleaver.identity)
                     )
-                    return []
-            except (KeyError, ValueError):
-                pass
+                start_response('204 No Content', headers)
+                return []
 
             start_response(
                 '401 Unauthorized',
@@ -138,51 +224,140 @@ class SplitMiddleware(object):
         return self.app(environ, start_response)
 
     def _handle_variant_overrides(self, environ):
-        # Parse the QUERY_STRING into a dictionary, and make an editable copy
-        parsed = dict(parse_qsl(environ.get('QUERY_STRING', '')))
-        qs = parsed.copy()
-
-        # For each key that starts with cleaver: ...
-        for k in parsed:
-            if k.startswith('cleaver:'):
-                # Store the key -> value in ``environ['cleaver.override']``
-                # and remove it from the editable ``qs`` copy.
-                environ.setdefault('cleaver.override', {})[
-                    k.split('cleaver:')[1]
-                ] = qs.pop(k)
-
-        # If any overriden variables were changed, re-encode QUERY_STRING so
-        # that the next WSGI layer doesn't see the parsed ``cleaver:``
-        # arguments.
-        if 'cleaver.override' in environ:
-            environ['QUERY_STRING'] = urlencode(qs)
-
-    @classmethod
-    def _copy_body_to_tempfile(cls, environ):
+        parsed = _parse_overrides(environ.get('QUERY_STRING', ''))
+        if parsed is not None:
+            # Store the overrides in ``environ['cleaver.override']``, and
+            # re-encode QUERY_STRING so that the next WSGI layer doesn't see
+            # the parsed ``cleaver:`` arguments.
+            overrides, environ['QUERY_STRING'] = parsed
+            environ.setdefault('cleaver.override', {}).update(overrides)
+
+    def _read_body(self, environ):
         """
-        Copy wsgi.input to a tempfile so it can be reused.
+        Read the request body (up to ``max_body_size`` bytes) into memory.
+
+        Returns ``bytes``, or ``None`` if the body is too large or the client
+        disconnected.  Without a ``Content-Length``, the body is treated as
+        empty (per PEP 3333, ``wsgi.input`` mustn't be read past it).
         """
         try:
-            length = int(environ.get('CONTENT_LENGTH', 0))
+            length = int(environ.get('CONTENT_LENGTH') or 0)
         except ValueError:
             length = 0
+        if length > self.max_body_size:
+            return None
 
-        try:
-            fileobj = tempfile.SpooledTemporaryFile(1024*1024)
-        except AttributeError:  # pragma: nocover
-            fileobj = tempfile.TemporaryFile()  # py25 fallback
-        if length:
-            remaining = length
-            while remaining > 0:
-                data = environ['wsgi.input'].read(min(remaining, 65536))
-                if not data:
-                    raise IOError(
-                        "Client disconnected (%s more bytes were expected)"
-                        % remaining
-                    )
-                fileobj.write(data)
-                remaining -= len(data)
+        fp = environ['wsgi.input']
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            data = fp.read(remaining)
+            if not data:
+                return None  # client disconnected
+            chunks.append(data)
+            remaining -= len(data)
+        return _EMPTY.join(chunks)
+
+
+def _parse_overrides(query_string):
+    """
+    Parse ``cleaver:``-prefixed variant overrides from a query string.
 
-        fileobj.seek(0)
-        environ['wsgi.input'] = fileobj
-        return fileobj, length
+    Returns a tuple of (a dictionary mapping experiment names to variant
+    names, the query string without the overrides), or ``None`` if there are
+    no overrides.
+    """
+    # Most requests don't override anything, so avoid parsing (and
+    # re-encoding) their query strings at all.
+    if 'cleaver' not in query_string:
+        return None
+
+    # Parse the query string into a dictionary, and make an editable copy
+    parsed = dict(parse_qsl(query_string))
+    qs = parsed.copy()
+
+    # For each key that starts with cleaver: ...
+    overrides = {}
+    for k in parsed:
+        if k.startswith('cleaver:'):
+            overrides[k.split('cleaver:')[1]] = qs.pop(k)
+
+    if not overrides:
+        return None
+    return overrides, urlencode(qs)
+
+
+def _parse_callback(body):
+    """
+    Parse the ``x``, ``y`` and ``z`` integers from the (URL-encoded) body of
+    a human verification callback.
+
+    Returns a tuple of three integers (any that are missing or invalid are
+    ``0``).
+    """
+    values = {}
+    for pair in body.split(_AMPERSAND):
+        key, _, value = pair.partition(_EQUALS)
+        if key in _CALLBACK_KEYS and key not in values:
+            try:
+                values[key] = int(value)
+            except ValueError:
+                values[key] = 0
+    return tuple(values.get(key, 0) for key in _CALLBACK_KEYS)
+
+
+class _LazyCleaver(object):
+    """
+    A stand-in for a ``cleaver.Cleaver`` that builds the real instance (by
+    calling ``factory``) the first time it's used, and then delegates to it.
+    """
+
+    __slots__ = ('_cleaver_factory', '_cleaver')
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_cleaver_factory', factory)
+        object.__setattr__(self, '_cleaver', None)
+
+    def _resolve(self):
+        cleaver = object.__getattribute__(self, '_cleaver')
+        if cleaver is None:
+            cleaver = object.__getattribute__(self, '_cleaver_factory')()
+            object.__setattr__(self, '_cleaver', cleaver)
+        return cleaver
+
+    @property
+    def __class__(self):
+        return self._resolve().__class__
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+
+class _FlushingIterable(object):
+    """
+    Wraps a WSGI response iterable and calls ``flush`` once the server has
+    closed it (i.e., after the response has been sent).
+    """
+
+    def __init__(self, result, flush):
+        self.result = result
+        self.flush = flush
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.flush()
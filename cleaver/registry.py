@@ -0,0 +1,196 @@
+import threading
+import time
+
+__all__ = ['ExperimentRegistry', 'default_registry']
+
+
+class ExperimentRegistry(object):
+    """
+    A process-wide, thread-safe cache of experiment definitions that sits in
+    front of ``CleaverBackend.get_experiment`` and
+    ``CleaverBackend.save_experiment``.
+
+    Experiments are immutable once saved (their variants can't change), so
+    once an experiment has been retrieved from a backend it can generally be
+    served from memory until its entry expires.
+
+    Backends that wrap another backend (and expose it as their ``backend``
+    attribute, like ``cleaver.backend.buffered.BufferedBackend``) share cache
+    entries with the backend they wrap.
+
+    :param ttl the number of seconds an experiment is cached for
+               (defaults to 60).
+    :param maxsize the maximum number of experiments to cache; when full,
+                   expired and then least recently stored entries are evicted
+                   (defaults to 1024).  When 0, nothing is cached.
+    :param timer a callable that returns the current time in seconds (defaults
+                 to ``time.time``).
+    """
+
+    def __init__(self, ttl=60, maxsize=1024, timer=time.time):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.timer = timer
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_experiment(self, backend, name, variants):
+        """
+        Retrieve an experiment by its name and variants (assuming it exists),
+        consulting the backend only if it isn't cached (or has expired).
+
+        :param backend an instance of ``cleaver.backend.CleaverBackend``
+        :param name a unique string name for the experiment
+        :param variants a list of strings, each with a unique variant name
+
+        Returns a ``cleaver.experiment.Experiment`` or ``None``
+        """
+        key = (_unwrap(backend), name)
+        now = self.timer()
+
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+        finally:
+            self._lock.release()
+
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        experiment = backend.get_experiment(name, variants)
+        if experiment is not None:
+            self._store(key, experiment, now)
+        return experiment
+
+    def get_experiments(self, backend, experiments):
+        """
+        Retrieve many experiments at once, consulting the backend (with
+        a single call) only for those that aren't cached.
+
+        :param backend an instance of ``cleaver.backend.CleaverBackend``
+        :param experiments a dictionary mapping unique string experiment
+                           names to a list of variant names
+
+        Returns a dictionary mapping experiment names to
+        ``cleaver.experiment.Experiment``s (experiments that don't exist are
+        omitted).
+        """
+        found, missing = self.cached(backend, experiments)
+        if missing:
+            retrieved = backend.get_experiments(missing)
+            self.store(backend, retrieved)
+            found.update(retrieved)
+        return found
+
+    def cached(self, backend, experiments):
+        """
+        Look up many experiments at once without consulting the backend.
+
+        :param backend an instance of ``cleaver.backend.CleaverBackend``
+        :param experiments a dictionary mapping unique string experiment
+                           names to a list of variant names
+
+        Returns a tuple; the first item is a dictionary mapping the names of
+        cached experiments to ``cleaver.experiment.Experiment``s, and the
+        second is a dictionary of the experiments (and their variants) that
+        aren't cached.
+        """
+        backend = _unwrap(backend)
+        now = self.timer()
+        found = {}
+        missing = {}
+
+        self._lock.acquire()
+        try:
+            for name, variants in experiments.items():
+                entry = self._entries.get((backend, name))
+                if entry is not None and entry[0] > now:
+                    found[name] = entry[1]
+                else:
+                    missing[name] = variants
+        finally:
+            self._lock.release()
+        return found, missing
+
+    def store(self, backend, experiments):
+        """
+        Cache experiments that were retrieved from a backend.
+
+        :param backend an instance of ``cleaver.backend.CleaverBackend``
+        :param experiments a dictionary mapping experiment names to
+                           ``cleaver.experiment.Experiment``s
+        """
+        backend = _unwrap(backend)
+        now = self.timer()
+        for name, experiment in experiments.items():
+            if experiment is not None:
+                self._store((backend, name), experiment, now)
+
+    def save_experiment(self, backend, name, variants):
+        """
+        Persist an experiment and its variants (unless they already exist) and
+        discard any cached copy of it.
+
+        :param backend an instance of ``cleaver.backend.CleaverBackend``
+        :param name a unique string name for the experiment
+        :param variants a list of strings, each with a unique variant name
+        """
+        backend.save_experiment(name, variants)
+        self.invalidate(backend, name)
+
+    def invalidate(self, backend=None, name=None):
+        """
+        Discard cached experiments.
+
+        :param backend when specified, only discard experiments retrieved from
+                       this backend.
+        :param name when specified, only discard experiments with this name.
+        """
+        if backend is not None:
+            backend = _unwrap(backend)
+
+        self._lock.acquire()
+        try:
+            for key in list(self._entries):
+                if backend is not None and key[0] is not backend:
+                    continue
+                if name is not None and key[1] != name:
+                    continue
+                del self._entries[key]
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, key, experiment, now):
+        if self.maxsize <= 0:
+            return
+        self._lock.acquire()
+        try:
+            if key not in self._entries and \
+                    len(self._entries) >= self.maxsize:
+                self._evict(now)
+            self._entries[key] = (now + self.ttl, experiment)
+        finally:
+            self._lock.release()
+
+    def _evict(self, now):
+        # Discard everything that has expired...
+        for key, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                del self._entries[key]
+
+        # ...and if that wasn't enough, the entry closest to expiring.
+        if self._entries and len(self._entries) >= self.maxsize:
+            oldest = min(self._entries, key=lambda k: self._entries[k][0])
+            del self._entries[oldest]
+
+
+def _unwrap(backend):
+    while getattr(backend, 'backend', None) is not None:
+        backend = backend.backend
+    return backend
+
+
+default_registry = ExperimentRegistry()
@@ -0,0 +1,207 @@
+import time
+from unittest import TestCase
+
+from mock import patch
+
+from cleaver import Cleaver
+from cleaver.backend.memory import MemoryBackend
+from cleaver.backend.aggregate import AggregatingBackend
+
+
+class TestAggregating(TestCase):
+
+    def setUp(self):
+        self.wrapped = MemoryBackend()
+        self.wrapped.save_experiment('text_size', ('small', 'medium'))
+        self.wrapped.save_experiment('show_promo', ('True', 'False'))
+        self.b = AggregatingBackend(self.wrapped, interval=60)
+
+    def tearDown(self):
+        self.b.close()
+
+    def test_invalid_configuration(self):
+        self.assertRaises(RuntimeError, AggregatingBackend, object())
+        self.assertRaises(
+            RuntimeError, AggregatingBackend, self.wrapped, interval=0
+        )
+        self.assertRaises(
+            RuntimeError, AggregatingBackend, self.wrapped, max_pending=0
+        )
+
+    def test_events_are_held_until_flush(self):
+        b = self.b
+        for _ in range(3):
+            b.mark_conversion('text_size', 'medium')
+        b.mark_participant('text_size', 'small')
+
+        assert self.wrapped.conversions('text_size', 'medium') == 0
+        assert b.conversions('text_size', 'medium') == 3
+        assert b.participants('text_size', 'small') == 1
+
+        b.flush()
+        assert self.wrapped.conversions('text_size', 'medium') == 3
+        assert self.wrapped.participants('text_size', 'small') == 1
+        assert b.conversions('text_size', 'medium') == 3
+
+    def test_stats_include_pending_events(self):
+        b = self.b
+        self.wrapped.mark_conversion('text_size', 'medium')
+        b.mark_events([
+            ('CONVERSION', 'text_size', 'medium'),
+            ('PARTICIPANT', 'show_promo', 'True')
+        ])
+
+        assert b.stats(['text_size', 'show_promo']) == {
+            'text_size': {'small': (0, 0), 'medium': (0, 2)},
+            'show_promo': {'True': (1, 0), 'False': (0, 0)}
+        }
+        assert self.wrapped.conversions('text_size', 'medium') == 1
+
+    def test_flush_writes_once(self):
+        b = self.b
+        for _ in range(100):
+            b.mark_conversion('text_size', 'medium')
+        b.mark_conversions({'show_promo': 'True'})
+
+        with patch.object(self.wrapped, 'mark_event_totals',
+                          wraps=self.wrapped.mark_event_totals) as totals:
+            b.flush()
+            b.flush()  # nothing left to write
+            totals.assert_called_once_with({
+                ('CONVERSION', 'text_size', 'medium'): 100,
+                ('CONVERSION', 'show_promo', 'True'): 1
+            })
+
+        assert self.wrapped.conversions('text_size', 'medium') == 100
+        assert self.wrapped.conversions('show_promo', 'True') == 1
+
+    def test_max_pending(self):
+        b = AggregatingBackend(self.wrapped, interval=60, max_pending=5)
+        try:
+            for _ in range(4):
+                b.mark_conversion('text_size', 'small')
+            assert self.wrapped.conversions('text_size', 'small') == 0
+
+            # The background thread is woken up to write them
+            b.mark_conversion('text_size', 'small')
+            for _ in range(500):
+                if self.wrapped.conversions('text_size', 'small'):
+                    break
+                time.sleep(0.01)
+            assert self.wrapped.conversions('text_size', 'small') == 5
+        finally:
+            b.close()
+
+    def test_background_flush(self):
+        b = AggregatingBackend(self.wrapped, interval=0.01)
+        try:
+            b.mark_conversion('text_size', 'small')
+            for _ in range(500):
+                if self.wrapped.conversions('text_size', 'small'):
+                    break
+                time.sleep(0.01)
+            assert self.wrapped.conversions('text_size', 'small') == 1
+        finally:
+            b.close()
+
+    def test_close(self):
+        b = self.b
+        b.mark_conversion('text_size', 'small')
+        thread = b._thread
+        assert thread.is_alive()
+
+        b.close()
+        assert not thread.is_alive()
+        assert self.wrapped.conversions('text_size', 'small') == 1
+
+        # ...and starts again when needed
+        b.mark_conversion('text_size', 'small')
+        assert b._thread.is_alive()
+
+    def test_failed_flush(self):
+        b = self.b
+        b.mark_conversion('text_size', 'small')
+        with patch.object(self.wrapped, 'mark_event_totals',
+                          side_effect=IOError):
+            self.assertRaises(IOError, b.flush)
+
+        # The tally is kept for the next flush
+        b.mark_conversion('text_size', 'small')
+        b.flush()
+        assert self.wrapped.conversions('text_size', 'small') == 2
+
+    @patch.object(AggregatingBackend, '_start')
+    @patch('cleaver.backend.aggregate.log')
+    def test_failing_backend(self, log, _start):
+        b = AggregatingBackend(self.wrapped, interval=60, max_pending=100)
+        with patch.object(self.wrapped, 'mark_event_totals',
+                          side_effect=IOError) as totals:
+            # Recording events never writes (or raises)...
+            for _ in range(1000):
+                b.mark_conversion('text_size', 'small')
+            assert not totals.called
+            assert b._wake.is_set()
+
+            # ...and failed flushes keep at most ``max_pending`` increments
+            self.assertRaises(IOError, b.flush)
+            assert b._pending == 0
+            assert log.error.called
+
+            for _ in range(50):
+                b.mark_conversion('text_size', 'small')
+            self.assertRaises(IOError, b.flush)
+            assert b._pending == 50
+
+        b.flush()
+        assert self.wrapped.conversions('text_size', 'small') == 50
+
+    def test_fork(self):
+        b = self.b
+        b.mark_conversion('text_size', 'small')
+
+        # A forked process discards its parent's tallies
+        with patch('os.getpid', return_value=-1):
+            b.mark_conversion('text_size', 'medium')
+            b.flush()
+        assert self.wrapped.conversions('text_size', 'small') == 0
+        assert self.wrapped.conversions('text_size', 'medium') == 1
+
+    def test_assignments_pass_through(self):
+        b = self.b
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'small')
+        b.participate_many('ryan', {
+            'text_size': 'medium',
+            'show_promo': 'True'
+        })
+        b.write_many([('joe', 'text_size', 'medium')], [])
+
+        assert self.wrapped.get_assignments('ryan') == {
+            'text_size': 'small',
+            'show_promo': 'True'
+        }
+        assert self.wrapped.get_variant('joe', 'text_size') == 'medium'
+        assert b.participants('text_size', 'small') == 1
+        assert b.participants('show_promo', 'True') == 1
+        assert self.wrapped.participants('show_promo', 'True') == 0
+
+        b.flush()
+        assert self.wrapped.participants('text_size', 'small') == 1
+        assert self.wrapped.participants('show_promo', 'True') == 1
+
+    def test_cleaver_split_and_score(self):
+        b = self.b
+        b.mark_human('ryan')
+        cleaver = Cleaver({}, lambda environ: 'ryan', b,
+                          experiment_registry=None)
+
+        variant = cleaver.split('text_color', ('red', '#F00'),
+                                ('blue', '#00F'))
+        name = {'#F00': 'red', '#00F': 'blue'}[variant]
+        cleaver.score('text_color')
+        assert b.participants('text_color', name) == 1
+        assert b.conversions('text_color', name) == 1
+
+        b.close()
+        assert self.wrapped.participants('text_color', name) == 1
+        assert self.wrapped.conversions('text_color', name) == 1
@@ -0,0 +1,127 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from cleaver.tests import FakeBackend
+from cleaver.backend.buffered import BufferedBackend
+
+
+class TestBufferedBackend(TestCase):
+
+    def test_invalid_backend(self):
+        self.assertRaises(
+            RuntimeError,
+            BufferedBackend,
+            None
+        )
+
+    @patch.object(FakeBackend, 'get_variant', Mock(return_value=None))
+    @patch.object(FakeBackend, 'set_variant')
+    @patch.object(FakeBackend, 'write_many')
+    def test_set_variant_is_buffered(self, write_many, set_variant):
+        b = BufferedBackend(FakeBackend())
+
+        assert b.set_variant('ryan', 'text_size', 'small') is True
+        assert b.set_variant('ryan', 'text_size', 'large') is False
+        assert b.get_variant('ryan', 'text_size') == 'small'
+        assert set_variant.called is False
+        assert write_many.called is False
+
+        b.flush()
+        write_many.assert_called_once_with(
+            [('ryan', 'text_size', 'small')], []
+        )
+
+        # Flushing again doesn't write anything
+        b.flush()
+        assert write_many.call_count == 1
+
+    @patch.object(FakeBackend, 'get_variant', Mock(return_value='medium'))
+    def test_set_variant_existing(self):
+        b = BufferedBackend(FakeBackend())
+        assert b.set_variant('ryan', 'text_size', 'small') is False
+        assert b.assignments == []
+
+    @patch.object(FakeBackend, 'get_variants')
+    def test_get_variants_includes_pending(self, get_variants):
+        get_variants.return_value = {'show_promo': 'True'}
+        b = BufferedBackend(FakeBackend())
+        b._variants[('ryan', 'text_size')] = 'small'
+
+        assert b.get_variants('ryan', ['text_size', 'show_promo']) == {
+            'text_size': 'small',
+            'show_promo': 'True'
+        }
+        get_variants.assert_called_once_with('ryan', ['show_promo'])
+
+    @patch.object(FakeBackend, 'get_variant', Mock(return_value=None))
+    @patch.object(FakeBackend, 'get_assignments')
+    def test_get_assignments_includes_pending(self, get_assignments):
+        get_assignments.return_value = {'show_promo': 'True'}
+        b = BufferedBackend(FakeBackend())
+        b.set_variant('ryan', 'text_size', 'small')
+        b.set_variant('joe', 'text_size', 'large')
+
+        assert b.get_assignments('ryan') == {
+            'show_promo': 'True',
+            'text_size': 'small'
+        }
+        get_assignments.assert_called_with('ryan')
+
+    @patch.object(FakeBackend, 'write_many')
+    def test_mark_conversions_are_buffered(self, write_many):
+        b = BufferedBackend(FakeBackend())
+        b.mark_conversions({'text_size': 'small'})
+        assert write_many.called is False
+
+        b.flush()
+        write_many.assert_called_once_with(
+            [], [('CONVERSION', 'text_size', 'small')]
+        )
+
+    @patch.object(FakeBackend, 'get_variants', Mock(return_value={
+        'show_promo': 'True'
+    }))
+    @patch.object(FakeBackend, 'is_verified_human', Mock(return_value=True))
+    @patch.object(FakeBackend, 'write_many')
+    def test_participate_many(self, write_many):
+        b = BufferedBackend(FakeBackend())
+        b.participate_many('ryan', {
+            'show_promo': 'False',
+            'text_size': 'small'
+        })
+        b.flush()
+
+        write_many.assert_called_once_with(
+            [('ryan', 'text_size', 'small')],
+            [('PARTICIPANT', 'text_size', 'small')]
+        )
+
+    @patch.object(FakeBackend, 'participants', Mock(return_value=5))
+    @patch.object(FakeBackend, 'conversions', Mock(return_value=2))
+    @patch.object(FakeBackend, 'write_many')
+    def test_events_are_buffered(self, write_many):
+        b = BufferedBackend(FakeBackend())
+        b.mark_participant('text_size', 'small')
+        b.mark_participant('text_size', 'small')
+        b.mark_conversion('text_size', 'small')
+
+        assert b.participants('text_size', 'small') == 7
+        assert b.conversions('text_size', 'small') == 3
+        assert b.participants('text_size', 'large') == 5
+        assert write_many.called is False
+
+        b.flush()
+        write_many.assert_called_once_with([], [
+            ('PARTICIPANT', 'text_size', 'small'),
+            ('PARTICIPANT', 'text_size', 'small'),
+            ('CONVERSION', 'text_size', 'small')
+        ])
+
+    @patch.object(FakeBackend, 'mark_human')
+    @patch.object(FakeBackend, 'is_verified_human', Mock(return_value=True))
+    def test_humans_are_not_buffered(self, mark_human):
+        b = BufferedBackend(FakeBackend())
+        b.mark_human('ryan')
+        mark_human.assert_called_once_with('ryan')
+        assert b.is_verified_human('ryan') is True
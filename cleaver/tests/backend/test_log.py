@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from mock import patch
+
+from cleaver import Cleaver
+from cleaver.backend.log import LogBackend, RECORD_SIZE
+
+
+class TestLog(TestCase):
+
+    def setUp(self):
+        self.dir = os.path.join(tempfile.mkdtemp(), 'cleaver')
+        self.backends = []
+
+    def tearDown(self):
+        for b in self.backends:
+            b.close()
+        shutil.rmtree(os.path.dirname(self.dir))
+
+    def backend(self, **kwargs):
+        b = LogBackend(self.dir, **kwargs)
+        self.backends.append(b)
+        return b
+
+    def populate(self, b):
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('joe', 'show_promo', 'True')
+        b.mark_conversion('text_size', 'medium')
+        b.write_many([('joe', 'text_size', 'large')], [
+            ('PARTICIPANT', 'show_promo', 'True'),
+            ('PARTICIPANT', 'show_promo', 'True'),
+            ('CONVERSION', 'show_promo', 'True')
+        ])
+
+    def assert_populated(self, b):
+        assert [e.name for e in b.all_experiments()] == [
+            'text_size', 'show_promo'
+        ]
+        assert b.get_experiment('text_size', None).variants == (
+            'small', 'medium', 'large'
+        )
+        assert b.is_verified_human('ryan') is True
+        assert b.is_verified_human('joe') is False
+        assert b.get_assignments('ryan') == {'text_size': 'medium'}
+        assert b.get_assignments('joe') == {
+            'show_promo': 'True',
+            'text_size': 'large'
+        }
+        assert b.participants('text_size', 'medium') == 1
+        assert b.conversions('text_size', 'medium') == 1
+        assert b.participants('show_promo', 'True') == 2
+        assert b.conversions('show_promo', 'True') == 1
+
+    def test_invalid_configuration(self):
+        self.assertRaises(RuntimeError, LogBackend, self.dir, compact_size=0)
+        self.assertRaises(RuntimeError, LogBackend, self.dir, interval=0)
+
+    def test_valid_configuration(self):
+        b = self.backend()
+        cleaver = Cleaver({}, lambda environ: 'ryan', b)
+        assert cleaver._backend is b
+        assert os.path.isdir(self.dir)
+
+    def test_restart(self):
+        b = self.backend()
+        self.populate(b)
+        self.assert_populated(b)
+        started_on = b.get_experiment('text_size', None).started_on
+        b.close()
+
+        restored = self.backend()
+        self.assert_populated(restored)
+        assert restored.get_experiment(
+            'text_size', None
+        ).started_on == started_on
+
+        # The restored backend keeps working
+        restored.save_experiment('button_size', ('small', 'large'))
+        restored.participate('ryan', 'button_size', 'large')
+        restored.close()
+        assert self.backend().participants('button_size', 'large') == 1
+
+    def test_records_are_fixed_size(self):
+        b = self.backend()
+        self.populate(b)
+        size = os.path.getsize(os.path.join(self.dir, 'log.0'))
+        assert size % RECORD_SIZE == 0
+
+        # Repeated events are a record each
+        b.mark_conversion('text_size', 'medium')
+        assert os.path.getsize(
+            os.path.join(self.dir, 'log.0')
+        ) == size + RECORD_SIZE
+
+        # ...and so are totals, whatever their amount
+        b.mark_event_totals({('CONVERSION', 'text_size', 'medium'): 500})
+        assert os.path.getsize(
+            os.path.join(self.dir, 'log.0')
+        ) == size + 2 * RECORD_SIZE
+        b.close()
+        assert self.backend().conversions('text_size', 'medium') == 502
+
+    def test_non_string_identities(self):
+        b = self.backend()
+        b.save_experiment('text_size', ('small', 'medium'))
+        b.mark_human(42)
+        b.participate(42, 'text_size', 'medium')
+        b.close()
+
+        # Identities are found again after a restart
+        restored = self.backend()
+        assert restored.is_verified_human(42) is True
+        assert restored.get_variant(42, 'text_size') == 'medium'
+        assert restored.get_variants(42, ['text_size']) == {
+            'text_size': 'medium'
+        }
+        assert restored.set_variant(42, 'text_size', 'small') is False
+        assert restored.participants('text_size', 'medium') == 1
+
+    def test_long_strings(self):
+        identity = u'ryän-' * 20
+        b = self.backend()
+        b.save_experiment(u'ünïcode' * 10, ('a' * 100, 'b'))
+        b.mark_human(identity)
+        b.participate(identity, u'ünïcode' * 10, 'a' * 100)
+        b.close()
+
+        restored = self.backend()
+        assert restored.get_assignments(identity) == {
+            u'ünïcode' * 10: 'a' * 100
+        }
+        assert restored.participants(u'ünïcode' * 10, 'a' * 100) == 1
+
+    def test_interrupted_write(self):
+        b = self.backend()
+        self.populate(b)
+        b.close()
+
+        # An experiment (and its strings) without its final record, and
+        # half of a record
+        path = os.path.join(self.dir, 'log.0')
+        size = os.path.getsize(path)
+        b = self.backend()
+        b.save_experiment('button_size', ('small', 'large'))
+        b.close()
+        f = open(path, 'r+b')
+        try:
+            f.truncate(os.path.getsize(path) - RECORD_SIZE)
+            f.seek(0, 2)
+            f.write(b'\1' * (RECORD_SIZE // 2))
+        finally:
+            f.close()
+
+        restored = self.backend()
+        self.assert_populated(restored)
+        assert restored.get_experiment('button_size', None) is None
+        assert os.path.getsize(path) == size
+
+        restored.save_experiment('font', ('serif', 'sans'))
+        restored.mark_human('sam')
+        restored.close()
+        restored = self.backend()
+        assert restored.get_experiment('font', None).variants == (
+            'serif', 'sans'
+        )
+        assert restored.is_verified_human('sam') is True
+
+    def test_not_a_log(self):
+        os.makedirs(self.dir)
+        f = open(os.path.join(self.dir, 'log.0'), 'wb')
+        try:
+            f.write(b'\0' * RECORD_SIZE)
+        finally:
+            f.close()
+        self.assertRaises(RuntimeError, LogBackend, self.dir)
+
+    def test_compact(self):
+        b = self.backend()
+        self.populate(b)
+        b.compact()
+
+        assert sorted(os.listdir(self.dir)) == ['log.1', 'snapshot']
+        assert os.path.getsize(os.path.join(self.dir, 'log.1')) == \
+            RECORD_SIZE
+        self.assert_populated(b)
+
+        # Writes after compaction are appended to the new log
+        b.mark_conversion('text_size', 'small')
+        b.compact()
+        b.mark_conversion('text_size', 'small')
+        b.close()
+
+        assert sorted(os.listdir(self.dir)) == ['log.2', 'snapshot']
+        restored = self.backend()
+        self.assert_populated(restored)
+        assert restored.conversions('text_size', 'small') == 2
+
+    def test_interrupted_compaction(self):
+        b = self.backend()
+        self.populate(b)
+        path = os.path.join(self.dir, 'log.0')
+        f = open(path, 'rb')
+        try:
+            log = f.read()
+        finally:
+            f.close()
+        b.compact()
+        b.mark_conversion('text_size', 'medium')
+        b.close()
+
+        # A log that's already part of the snapshot is ignored (and removed)
+        f = open(path, 'wb')
+        try:
+            f.write(log)
+        finally:
+            f.close()
+        restored = self.backend()
+        assert restored.conversions('text_size', 'medium') == 2
+        assert sorted(os.listdir(self.dir)) == ['log.1', 'snapshot']
+
+        # ...and a snapshot that was never written leaves the logs in place
+        os.remove(os.path.join(self.dir, 'snapshot'))
+        f = open(path, 'wb')
+        try:
+            f.write(log)
+        finally:
+            f.close()
+        restored = self.backend()
+        assert restored.conversions('text_size', 'medium') == 2
+        assert restored.participants('show_promo', 'True') == 2
+
+    def test_failed_compaction(self):
+        b = self.backend()
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.compact()
+        b.mark_conversion('text_size', 'medium')
+
+        # The snapshot isn't written, but the next log was already started
+        with patch('cleaver.backend.log._write_atomically',
+                   side_effect=OSError):
+            self.assertRaises(OSError, b.compact)
+        b.close()
+        assert sorted(os.listdir(self.dir)) == ['log.1', 'log.2', 'snapshot']
+
+        # Logs newer than the snapshot are kept until the next compaction
+        for _ in range(2):
+            restored = self.backend()
+            assert restored.conversions('text_size', 'medium') == 1
+            restored.close()
+        assert sorted(os.listdir(self.dir)) == ['log.1', 'log.2', 'snapshot']
+
+    def test_snapshot_compacts(self):
+        b = self.backend()
+        self.populate(b)
+        b.snapshot()
+        assert sorted(os.listdir(self.dir)) == ['log.1', 'snapshot']
+
+        path = os.path.join(os.path.dirname(self.dir), 'elsewhere')
+        self.assertRaises(RuntimeError, b.snapshot, path)
+        self.assertRaises(RuntimeError, b.load)
+        self.assert_populated(b)
+
+    def test_background_compaction(self):
+        b = self.backend(compact_size=RECORD_SIZE * 4, interval=0.01)
+        self.populate(b)
+
+        for _ in range(500):
+            if os.path.exists(os.path.join(self.dir, 'snapshot')):
+                break
+            time.sleep(0.01)
+        b.close()
+
+        assert 'snapshot' in os.listdir(self.dir)
+        self.assert_populated(self.backend())
@@ -0,0 +1,334 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from datetime import datetime
+
+from cleaver import Cleaver
+from cleaver.experiment import Experiment
+from cleaver.tests import FakeIdentityProvider
+from cleaver.backend.memory import MemoryBackend
+
+
+class TestMemory(TestCase):
+
+    def setUp(self):
+        self.b = MemoryBackend()
+
+    def test_valid_configuration(self):
+        cleaver = Cleaver({}, FakeIdentityProvider(), MemoryBackend())
+        assert isinstance(cleaver._backend, MemoryBackend)
+
+    def test_save_experiment(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        experiments = b.all_experiments()
+        assert len(experiments) == 1
+        assert isinstance(experiments[0], Experiment)
+        assert experiments[0].name == 'text_size'
+        assert experiments[0].started_on.date() == datetime.utcnow().date()
+        assert experiments[0].variants == ('small', 'medium', 'large')
+        assert experiments[0].backend is b
+
+    def test_save_existing_experiment(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('text_size', ('tiny', 'huge'))
+
+        assert len(b.all_experiments()) == 1
+        assert b.get_experiment('text_size', None).variants == (
+            'small', 'medium', 'large'
+        )
+
+    def test_get_experiment(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        experiment = b.get_experiment('text_size', ('small', 'medium'))
+        assert experiment.name == 'text_size'
+        assert b.get_experiment('another_test', ('True', 'False')) is None
+
+    def test_get_experiments(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+
+        experiments = b.get_experiments({
+            'text_size': ('small', 'medium', 'large'),
+            'another_test': ('True', 'False')
+        })
+        assert list(experiments) == ['text_size']
+        assert experiments['text_size'].variants == (
+            'small', 'medium', 'large'
+        )
+
+    def test_verified_human(self):
+        b = self.b
+        assert b.is_verified_human('ryan') is False
+        b.mark_human('ryan')
+        b.mark_human('ryan')
+        assert b.is_verified_human('ryan') is True
+
+    def test_set_variant(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        assert b.set_variant('ryan', 'text_size', 'medium') is True
+        assert b.set_variant('ryan', 'text_size', 'large') is False
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.get_variant('joe', 'text_size') is None
+        assert b.get_variant('ryan', 'another_test') is None
+
+    def test_set_unknown_variant(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        assert b.set_variant('ryan', 'text_size', 'huge') is False
+        assert b.set_variant('ryan', 'another_test', 'True') is False
+        assert b.get_assignments('ryan') == {}
+
+    def test_get_variants(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('ryan', 'show_promo', 'False')
+        b.participate('joe', 'show_promo', 'True')
+
+        assert b.get_variants(
+            'ryan', ['text_size', 'show_promo', 'another_test']
+        ) == {'text_size': 'medium', 'show_promo': 'False'}
+        assert b.get_variants('joe', ['text_size', 'show_promo']) == {
+            'show_promo': 'True'
+        }
+        assert b.get_variants('someone-else', ['show_promo']) == {}
+
+    def test_get_assignments(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('ryan', 'show_promo', 'False')
+
+        assert b.get_assignments('ryan') == {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        }
+        assert b.get_assignments('joe') == {}
+
+    def test_verified_participate(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'medium')
+
+        assert b.participants('text_size', 'medium') == 1
+        assert b.participants('text_size', 'small') == 0
+
+    def test_unverified_participate(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.participate('ryan', 'text_size', 'medium')
+
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.participants('text_size', 'medium') == 0
+
+    def test_participate_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'small')
+
+        b.participate_many('ryan', {
+            'text_size': 'medium',
+            'show_promo': 'False',
+            'another_test': 'True'
+        })
+
+        # Existing assignments aren't changed (or counted again)
+        assert b.get_assignments('ryan') == {
+            'text_size': 'small',
+            'show_promo': 'False'
+        }
+        assert b.participants('text_size', 'small') == 1
+        assert b.participants('text_size', 'medium') == 0
+        assert b.participants('show_promo', 'False') == 1
+
+    def test_write_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+
+        b.write_many([
+            ('ryan', 'text_size', 'medium'),
+            ('joe', 'show_promo', 'False'),
+            ('joe', 'another_test', 'False')
+        ], [
+            ('PARTICIPANT', 'show_promo', 'False'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'another_test', 'False')
+        ])
+
+        assert b.get_assignments('ryan') == {'text_size': 'medium'}
+        assert b.get_assignments('joe') == {'show_promo': 'False'}
+        assert b.participants('show_promo', 'False') == 1
+        assert b.conversions('text_size', 'small') == 2
+
+    def test_mark_events(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_events([
+            ('PARTICIPANT', 'text_size', 'small'),
+            ('PARTICIPANT', 'text_size', 'small'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'another_test', 'False')
+        ])
+        b.mark_events([])
+
+        assert b.participants('text_size', 'small') == 2
+        assert b.conversions('text_size', 'small') == 1
+        assert b.conversions('another_test', 'False') == 0
+
+    def test_mark_event_totals(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_event_totals({
+            ('PARTICIPANT', 'text_size', 'small'): 250,
+            ('CONVERSION', 'text_size', 'small'): 12,
+            ('CONVERSION', 'another_test', 'False'): 3
+        })
+        b.mark_event_totals({})
+
+        assert b.participants('text_size', 'small') == 250
+        assert b.conversions('text_size', 'small') == 12
+        assert b.conversions('another_test', 'False') == 0
+
+    def test_stats(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_participants({'text_size': 'small', 'show_promo': 'True'})
+        b.mark_conversions({'text_size': 'small'})
+
+        assert b.stats(['text_size', 'show_promo', 'another_test']) == {
+            'text_size': {
+                'small': (1, 1),
+                'medium': (0, 0),
+                'large': (0, 0)
+            },
+            'show_promo': {
+                'True': (1, 0),
+                'False': (0, 0)
+            }
+        }
+        assert b.stats([]) == {}
+
+    def test_score(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_conversion('text_size', 'medium')
+        b.mark_conversion('text_size', 'medium')
+        b.mark_conversion('text_size', 'huge')
+        b.mark_conversion('another_test', 'True')
+
+        assert b.conversions('text_size', 'medium') == 2
+        assert b.conversions('text_size', 'small') == 0
+        assert b.conversions('text_size', 'huge') == 0
+        assert b.conversions('another_test', 'True') == 0
+
+    def test_concurrent_events(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        def work(i):
+            for _ in range(1000):
+                b.mark_participant('text_size', 'small')
+            b.mark_human(i)
+            b.participate(i, 'text_size', 'large')
+
+        threads = [
+            threading.Thread(target=work, args=(i,))
+            for i in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert b.participants('text_size', 'small') == 8000
+        assert b.participants('text_size', 'large') == 8
+
+    def test_cleaver_split_and_score(self):
+        b = self.b
+        b.mark_human('ryan')
+        cleaver = Cleaver({}, lambda environ: 'ryan', b,
+                          experiment_registry=None)
+
+        variant = cleaver.split('text_color', ('red', '#F00'),
+                                ('blue', '#00F'))
+        name = {'#F00': 'red', '#00F': 'blue'}[variant]
+        assert b.participants('text_color', name) == 1
+
+        cleaver.score('text_color')
+        assert b.conversions('text_color', name) == 1
+
+
+class TestMemorySnapshot(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cleaver.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_snapshot_requires_path(self):
+        self.assertRaises(RuntimeError, MemoryBackend().snapshot)
+
+    def test_snapshot_and_load(self):
+        b = MemoryBackend(self.path)
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('joe', 'show_promo', 'True')
+        b.mark_conversion('text_size', 'medium')
+        b.snapshot()
+
+        # No temporary files are left behind
+        assert os.listdir(self.dir) == ['cleaver.snapshot']
+
+        restored = MemoryBackend(self.path)
+        assert [e.name for e in restored.all_experiments()] == [
+            'text_size', 'show_promo'
+        ]
+        assert restored.is_verified_human('ryan') is True
+        assert restored.is_verified_human('joe') is False
+        assert restored.get_assignments('ryan') == {'text_size': 'medium'}
+        assert restored.get_assignments('joe') == {'show_promo': 'True'}
+        assert restored.participants('text_size', 'medium') == 1
+        assert restored.conversions('text_size', 'medium') == 1
+
+        # The restored backend keeps working
+        restored.save_experiment('button_size', ('small', 'large'))
+        restored.participate('ryan', 'button_size', 'large')
+        assert restored.participants('button_size', 'large') == 1
+
+    def test_snapshot_to_another_path(self):
+        b = MemoryBackend()
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.snapshot(self.path)
+
+        restored = MemoryBackend()
+        restored.load(self.path)
+        assert restored.get_experiment('text_size', None).variants == (
+            'small', 'medium', 'large'
+        )
+
+    def test_missing_snapshot(self):
+        b = MemoryBackend(self.path)
+        assert b.all_experiments() == []
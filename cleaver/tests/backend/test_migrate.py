@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import sqlalchemy as sa
+
+from cleaver.backend.db import model
+from cleaver.backend.db.migrate import migrate
+
+
+def _legacy_schema():
+    """
+    The schema created by earlier versions of Cleaver.
+    """
+    metadata = sa.MetaData()
+    sa.Table(
+        'cleaver_experiment', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.Unicode(255), unique=True),
+        sa.Column('started_on', sa.DateTime, index=True)
+    )
+    sa.Table(
+        'cleaver_variant', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.Unicode(255), unique=True),
+        sa.Column('order', sa.Integer),
+        sa.Column('experiment_id', sa.Integer,
+                  sa.ForeignKey('cleaver_experiment.id'), index=True)
+    )
+    sa.Table(
+        'cleaver_participant', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('identity', sa.Unicode(255)),
+        sa.Column('experiment_id', sa.Integer,
+                  sa.ForeignKey('cleaver_experiment.id')),
+        sa.Column('variant_id', sa.Integer,
+                  sa.ForeignKey('cleaver_variant.id'), index=True),
+        sa.UniqueConstraint('identity', 'experiment_id')
+    )
+    sa.Table(
+        'cleaver_event', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('type', sa.Enum('PARTICIPANT', 'CONVERSION')),
+        sa.Column('experiment_id', sa.Integer,
+                  sa.ForeignKey('cleaver_experiment.id')),
+        sa.Column('variant_id', sa.Integer,
+                  sa.ForeignKey('cleaver_variant.id')),
+        sa.Column('total', sa.Integer),
+        sa.UniqueConstraint('type', 'experiment_id', 'variant_id')
+    )
+    sa.Table(
+        'cleaver_human', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('identity', sa.Unicode(255), unique=True)
+    )
+    return metadata
+
+
+class TestMigrate(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dburi = 'sqlite:///%s' % os.path.join(self.dir, 'cleaver.db')
+        self.engine = sa.create_engine(self.dburi)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def _create_legacy(self):
+        legacy = _legacy_schema()
+        legacy.create_all(self.engine)
+        t = legacy.tables
+        self.engine.execute(t['cleaver_experiment'].insert(), [
+            {'id': 1, 'name': 'text_size'},
+            {'id': 2, 'name': 'show_promo'}
+        ])
+        self.engine.execute(t['cleaver_variant'].insert(), [
+            {'id': 1, 'name': 'small', 'order': 0, 'experiment_id': 1},
+            {'id': 2, 'name': 'large', 'order': 1, 'experiment_id': 1},
+            {'id': 3, 'name': 'True', 'order': 0, 'experiment_id': 2},
+            {'id': 4, 'name': 'False', 'order': 1, 'experiment_id': 2}
+        ])
+        self.engine.execute(t['cleaver_participant'].insert(), [
+            {'identity': 'ryan', 'experiment_id': 1, 'variant_id': 2},
+            {'identity': 'ryan', 'experiment_id': 2, 'variant_id': 3}
+        ])
+        self.engine.execute(t['cleaver_event'].insert(), [
+            {'type': 'PARTICIPANT', 'experiment_id': 1, 'variant_id': 2,
+             'total': 5},
+            {'type': 'CONVERSION', 'experiment_id': 1, 'variant_id': 2,
+             'total': 3}
+        ])
+
+    def test_migrate_legacy_schema(self):
+        self._create_legacy()
+        assert migrate(self.dburi) is True
+
+        inspector = sa.inspect(self.engine)
+        assert [
+            c['column_names']
+            for c in inspector.get_unique_constraints('cleaver_variant')
+        ] == [['experiment_id', 'name']]
+        # The existing unique constraint on assignments is kept (SQLite
+        # can't cover variant_id), and no extra index is added
+        assert [
+            sorted(c['column_names'])
+            for c in inspector.get_unique_constraints('cleaver_participant')
+        ] == [['experiment_id', 'identity']]
+        assert [
+            i['column_names']
+            for i in inspector.get_indexes('cleaver_participant')
+        ] == [['variant_id']]
+        assert isinstance([
+            c['type'] for c in inspector.get_columns('cleaver_event')
+            if c['name'] == 'type'
+        ][0], sa.Integer)
+
+        # Existing data is kept
+        conn = self.engine.connect()
+        try:
+            assert conn.execute(
+                'SELECT id, name, experiment_id FROM cleaver_variant '
+                'ORDER BY id'
+            ).fetchall() == [
+                (1, 'small', 1), (2, 'large', 1),
+                (3, 'True', 2), (4, 'False', 2)
+            ]
+            assert conn.execute(
+                'SELECT count(*) FROM cleaver_participant'
+            ).scalar() == 2
+            self.assertRaises(
+                sa.exc.IntegrityError,
+                conn.execute,
+                model.Participant.__table__.insert(),
+                {'identity': 'ryan', 'experiment_id': 1, 'variant_id': 1}
+            )
+            events = model.TrackedEvent.__table__
+            assert sorted(conn.execute(sa.select([
+                events.c.type, events.c.variant_id, events.c.shard,
+                events.c.total
+            ])).fetchall()) == [
+                ('CONVERSION', 2, 0, 3), ('PARTICIPANT', 2, 0, 5)
+            ]
+
+            # Variant names only need to be unique per experiment
+            conn.execute(model.Variant.__table__.insert(), {
+                'name': 'True', 'order': 2, 'experiment_id': 1
+            })
+            self.assertRaises(
+                sa.exc.IntegrityError,
+                conn.execute,
+                model.Variant.__table__.insert(),
+                {'name': 'True', 'order': 2, 'experiment_id': 2}
+            )
+        finally:
+            conn.close()
+
+        # Upgraded databases are left as they are
+        assert migrate(self.dburi) is False
+
+    def test_migrate_new_database(self):
+        assert migrate(self.dburi) is False
+        assert sorted(sa.inspect(self.engine).get_table_names()) == sorted(
+            model.ModelBase.metadata.tables
+        )
+        assert migrate(self.dburi) is False
@@ -0,0 +1,223 @@
+from unittest import TestCase, skipIf
+from datetime import datetime
+
+try:
+    import fakeredis
+    from cleaver.backend.redis import RedisBackend
+except ImportError:  # pragma: nocover
+    fakeredis = None
+
+from cleaver import Cleaver
+from cleaver.experiment import Experiment
+
+
+def _lua_available():
+    # fakeredis only supports scripting when ``lupa`` is installed
+    try:
+        fakeredis.FakeStrictRedis().eval('return 1', 0)
+    except Exception:
+        return False
+    return True
+
+
+@skipIf(fakeredis is None, 'fakeredis (and redis) are not installed')
+@skipIf(fakeredis is not None and not _lua_available(),
+        'fakeredis does not support Lua scripting (install lupa)')
+class TestRedis(TestCase):
+
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis()
+        self.client.flushall()
+        self.b = RedisBackend(client=self.client)
+
+    def test_save_experiment(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        experiments = b.all_experiments()
+        assert len(experiments) == 1
+        assert isinstance(experiments[0], Experiment)
+        assert experiments[0].name == 'text_size'
+        assert experiments[0].started_on.date() == datetime.utcnow().date()
+        assert experiments[0].variants == ('small', 'medium', 'large')
+
+    def test_save_existing_experiment(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('text_size', ('tiny', 'huge'))
+
+        assert len(b.all_experiments()) == 1
+        assert b.get_experiment('text_size', None).variants == (
+            'small', 'medium', 'large'
+        )
+
+    def test_prefix(self):
+        b = RedisBackend(client=self.client, prefix='ab:')
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        assert self.b.all_experiments() == []
+        assert [e.name for e in b.all_experiments()] == ['text_size']
+        assert all(
+            key.startswith(b'ab:') for key in self.client.keys('*')
+        )
+
+    def test_get_experiments(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+
+        experiments = b.get_experiments({
+            'text_size': ('small', 'medium', 'large'),
+            'another_test': ('True', 'False')
+        })
+        assert list(experiments) == ['text_size']
+        assert b.get_experiments({}) == {}
+        assert b.get_experiment('another_test', ('True', 'False')) is None
+
+    def test_verified_human(self):
+        b = self.b
+        assert b.is_verified_human('ryan') is False
+        b.mark_human('ryan')
+        assert b.is_verified_human('ryan') is True
+
+    def test_set_variant(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        assert b.set_variant('ryan', 'text_size', 'medium') is True
+        assert b.set_variant('ryan', 'text_size', 'large') is False
+        assert b.set_variant('ryan', 'text_size', 'huge') is False
+        assert b.set_variant('ryan', 'another_test', 'True') is False
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.get_variant('joe', 'text_size') is None
+
+    def test_get_variants(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('ryan', 'show_promo', 'False')
+        b.participate('joe', 'show_promo', 'True')
+
+        assert b.get_variants(
+            'ryan', ['text_size', 'show_promo', 'another_test']
+        ) == {'text_size': 'medium', 'show_promo': 'False'}
+        assert b.get_variants('joe', ['text_size', 'show_promo']) == {
+            'show_promo': 'True'
+        }
+        assert b.get_variants('ryan', []) == {}
+        assert b.get_assignments('ryan') == {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        }
+        assert b.get_assignments('someone-else') == {}
+
+    def test_verified_participate(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('ryan', 'text_size', 'medium')
+
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.participants('text_size', 'medium') == 2
+        assert b.participants('text_size', 'small') == 0
+
+    def test_unverified_participate(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.participate('ryan', 'text_size', 'medium')
+
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.participants('text_size', 'medium') == 0
+
+    def test_participate_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'small')
+
+        b.participate_many('ryan', {
+            'text_size': 'medium',
+            'show_promo': 'False',
+            'another_test': 'True'
+        })
+
+        # Existing assignments aren't changed (or counted again)
+        assert b.get_assignments('ryan') == {
+            'text_size': 'small',
+            'show_promo': 'False'
+        }
+        assert b.participants('text_size', 'small') == 1
+        assert b.participants('text_size', 'medium') == 0
+        assert b.participants('show_promo', 'False') == 1
+
+    def test_write_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'small')
+
+        b.write_many([
+            ('ryan', 'text_size', 'medium'),
+            ('ryan', 'show_promo', 'True'),
+            ('joe', 'show_promo', 'False'),
+            ('joe', 'another_test', 'False')
+        ], [
+            ('PARTICIPANT', 'show_promo', 'True'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'another_test', 'False')
+        ])
+
+        assert b.get_assignments('ryan') == {
+            'text_size': 'small',
+            'show_promo': 'True'
+        }
+        assert b.get_assignments('joe') == {'show_promo': 'False'}
+        assert b.participants('show_promo', 'True') == 1
+        assert b.conversions('text_size', 'small') == 2
+        assert b.conversions('another_test', 'False') == 0
+
+        # Nothing to write
+        b.write_many([], [])
+
+    def test_mark_event_totals(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_event_totals({
+            ('PARTICIPANT', 'text_size', 'small'): 250,
+            ('CONVERSION', 'text_size', 'small'): 12,
+            ('CONVERSION', 'another_test', 'False'): 3
+        })
+        b.mark_event_totals({})
+
+        assert b.participants('text_size', 'small') == 250
+        assert b.conversions('text_size', 'small') == 12
+        assert b.conversions('another_test', 'False') == 0
+
+    def test_score(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_conversion('text_size', 'medium')
+        b.mark_conversion('text_size', 'huge')
+        b.mark_participant('text_size', 'small')
+
+        assert b.conversions('text_size', 'medium') == 1
+        assert b.conversions('text_size', 'huge') == 0
+        assert b.participants('text_size', 'small') == 1
+
+    def test_cleaver_split_and_score(self):
+        b = self.b
+        b.mark_human('ryan')
+        cleaver = Cleaver({}, lambda environ: 'ryan', b,
+                          experiment_registry=None)
+
+        variant = cleaver.split('text_color', ('red', '#F00'),
+                                ('blue', '#00F'))
+        name = {'#F00': 'red', '#00F': 'blue'}[variant]
+        assert b.participants('text_color', name) == 1
+
+        cleaver.score('text_color')
+        assert b.conversions('text_color', name) == 1
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from mock import patch
+from sqlalchemy.pool import QueuePool
+
+from cleaver.backend.db import model
+from cleaver.backend.db.session import EngineRegistry
+
+
+class TestEngineRegistry(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dburi = 'sqlite:///%s' % os.path.join(self.dir, 'cleaver.db')
+        self.registry = EngineRegistry()
+
+    def tearDown(self):
+        self.registry.dispose()
+        shutil.rmtree(self.dir)
+
+    def test_engines_are_shared(self):
+        r = self.registry
+        assert r.engine(self.dburi) is r.engine(self.dburi)
+        assert r.session(self.dburi) is r.session(self.dburi)
+
+    def test_engine_options(self):
+        r = self.registry
+        engine = r.engine(self.dburi, poolclass=QueuePool, pool_size=3)
+        assert engine.pool.size() == 3
+        assert r.engine(self.dburi, poolclass=QueuePool, pool_size=3) is \
+            engine
+        assert r.engine(self.dburi) is not engine
+
+    def test_concurrent_engines(self):
+        r = self.registry
+        engines = []
+
+        def work():
+            engines.append(r.engine(self.dburi))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(engines) == 8
+        assert len(set(engines)) == 1
+
+    def test_create_tables(self):
+        r = self.registry
+        with patch.object(model.ModelBase.metadata, 'create_all') as c:
+            r.session(self.dburi, create_tables=False)
+            assert c.call_count == 0
+
+            r.session(self.dburi)
+            r.session(self.dburi)
+            assert c.call_count == 1
+
+            # Tables are created once per engine
+            r.session('sqlite://')
+            assert c.call_count == 2
+
+    def test_model_query_uses_latest_session(self):
+        r = self.registry
+        session = r.session(self.dburi)
+        assert model.Experiment.query.session is session()
+
+    def test_connections_are_discarded_after_fork(self):
+        engine = self.registry.engine(self.dburi, poolclass=QueuePool)
+        conn = engine.connect()
+        first = conn.connection.connection
+        conn.close()
+
+        # The same connection is reused within a process...
+        conn = engine.connect()
+        assert conn.connection.connection is first
+        conn.close()
+
+        # ...but not from a (forked) child process
+        with patch('os.getpid', return_value=-1):
+            conn = engine.connect()
+            assert conn.connection.connection is not first
+            assert conn.connection._connection_record.info['pid'] == -1
+            conn.close()
+
+    def test_dispose(self):
+        r = self.registry
+        engine = r.engine(self.dburi)
+        r.dispose()
+        assert r.engine(self.dburi) is not engine
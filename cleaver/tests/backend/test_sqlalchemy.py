@@ -64,6 +64,22 @@ class TestSQLAlchemy(TestCase):
         assert e.started_on.date() == datetime.utcnow().date()
         assert e.variants == ('small', 'medium', 'large')
 
+    def test_get_experiments(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+
+        experiments = b.get_experiments({
+            'text_size': ('small', 'medium', 'large'),
+            'show_promo': ('True', 'False'),
+            'another_test': ('a', 'b')
+        })
+        assert sorted(experiments) == ['show_promo', 'text_size']
+        assert experiments['text_size'].variants == (
+            'small', 'medium', 'large'
+        )
+        assert experiments['show_promo'].variants == ('True', 'False')
+
     def test_all_experiments(self):
         b = self.b
         b.save_experiment('text_size', ('small', 'medium', 'large'))
@@ -191,6 +207,29 @@ class TestSQLAlchemy(TestCase):
         assert participations[0].variant.name == 'medium'
         assert participations[0].total == 3
 
+    def test_set_variant(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        assert b.set_variant('ryan', 'text_size', 'medium') is True
+        assert b.set_variant('ryan', 'text_size', 'medium') is False
+        assert b.set_variant('ryan', 'text_size', 'large') is False
+        assert b.set_variant('ryan', 'another_test', 'large') is False
+
+        assert model.Participant.query.count() == 1
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+
+    def test_set_variant_without_insert_ignore(self):
+        b = self.b
+        b._insert_ignore = None
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        assert b.set_variant('ryan', 'text_size', 'medium') is True
+        assert b.set_variant('ryan', 'text_size', 'large') is False
+
+        assert model.Participant.query.count() == 1
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+
     def test_get_variant(self):
         b = self.b
         b.save_experiment('text_size', ('small', 'medium', 'large'))
@@ -199,6 +238,391 @@ class TestSQLAlchemy(TestCase):
         assert b.get_variant('ryan', 'text_size') == 'medium'
         assert b.get_variant('ryan', 'another_test') is None
 
+    def test_get_variants(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('ryan', 'show_promo', 'False')
+        b.participate('joe', 'show_promo', 'True')
+
+        assert b.get_variants(
+            'ryan', ['text_size', 'show_promo', 'another_test']
+        ) == {'text_size': 'medium', 'show_promo': 'False'}
+        assert b.get_variants('joe', ['text_size', 'show_promo']) == {
+            'show_promo': 'True'
+        }
+        assert b.get_variants('ryan', []) == {}
+
+    def test_unit_of_work(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        b.begin()
+        with patch.object(b.Session, 'commit', wraps=b.Session.commit) as c:
+            b.mark_human('ryan')
+            assert b.set_variant('ryan', 'text_size', 'medium') is True
+            b.mark_participant('text_size', 'medium')
+
+            # Changes are visible within the unit of work...
+            assert b.is_verified_human('ryan') is True
+            assert b.get_variant('ryan', 'text_size') == 'medium'
+            assert b.participants('text_size', 'medium') == 1
+
+            # ...but only committed at the end
+            assert c.call_count == 0
+            b.end()
+            assert c.call_count == 1
+
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.participants('text_size', 'medium') == 1
+
+        # Ending again does nothing
+        b.end()
+
+    def test_unit_of_work_existing_variant(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        b.begin()
+        assert b.set_variant('ryan', 'text_size', 'medium') is True
+        b.mark_conversion('text_size', 'medium')
+
+        # A conflicting assignment doesn't discard the rest of the work
+        assert b.set_variant('ryan', 'text_size', 'large') is False
+        b.end()
+
+        assert b.get_variant('ryan', 'text_size') == 'medium'
+        assert b.conversions('text_size', 'medium') == 1
+
+    def test_get_assignments(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'medium')
+        b.participate('ryan', 'show_promo', 'False')
+        b.participate('joe', 'show_promo', 'True')
+
+        assert b.get_assignments('ryan') == {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        }
+        assert b.get_assignments('joe') == {'show_promo': 'True'}
+        assert b.get_assignments('someone-else') == {}
+
+    def test_mark_conversions(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_conversion('text_size', 'medium')
+
+        b.mark_conversions({'text_size': 'medium', 'show_promo': 'False'})
+        assert b.conversions('text_size', 'medium') == 2
+        assert b.conversions('show_promo', 'False') == 1
+        assert b.conversions('show_promo', 'True') == 0
+
+    def test_mark_participants(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_participant('text_size', 'medium')
+
+        b.mark_participants({'text_size': 'medium', 'show_promo': 'False'})
+        assert b.participants('text_size', 'medium') == 2
+        assert b.participants('show_promo', 'False') == 1
+        assert b.participants('show_promo', 'True') == 0
+
+    def test_unverified_participate_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate_many('ryan', {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        })
+
+        assert b.get_variants('ryan', ['text_size', 'show_promo']) == {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        }
+        assert model.TrackedEvent.query.count() == 0
+
+    def test_verified_participate_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'small')
+
+        b.participate_many('ryan', {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        })
+        b.participate_many('ryan', {
+            'text_size': 'medium',
+            'show_promo': 'False'
+        })
+
+        # Existing assignments aren't changed (or counted again)
+        assert b.get_variants('ryan', ['text_size', 'show_promo']) == {
+            'text_size': 'small',
+            'show_promo': 'False'
+        }
+        assert b.participants('text_size', 'small') == 1
+        assert b.participants('text_size', 'medium') == 0
+        assert b.participants('show_promo', 'False') == 1
+
+    def test_write_many(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.participate('ryan', 'text_size', 'small')
+        b.mark_conversion('text_size', 'small')
+
+        b.write_many([
+            ('ryan', 'text_size', 'medium'),
+            ('ryan', 'show_promo', 'True'),
+            ('joe', 'show_promo', 'False'),
+            ('joe', 'another_test', 'False')
+        ], [
+            ('PARTICIPANT', 'show_promo', 'True'),
+            ('PARTICIPANT', 'show_promo', 'False'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'text_size', 'small'),
+            ('CONVERSION', 'another_test', 'False')
+        ])
+
+        # Existing assignments aren't changed
+        assert b.get_variants('ryan', ['text_size', 'show_promo']) == {
+            'text_size': 'small',
+            'show_promo': 'True'
+        }
+        assert b.get_variants('joe', ['show_promo', 'another_test']) == {
+            'show_promo': 'False'
+        }
+
+        assert b.participants('show_promo', 'True') == 1
+        assert b.participants('show_promo', 'False') == 1
+        assert b.conversions('text_size', 'small') == 3
+
+    def test_concurrent_assignments(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'small')
+
+        # Assignments stored (by a concurrent request) after they were
+        # checked for are skipped, rather than failing the transaction
+        with patch.object(b, '_assigned', return_value=set()):
+            b.participate_many('ryan', {'text_size': 'medium'})
+            b.write_many([
+                ('ryan', 'text_size', 'large'),
+                ('joe', 'text_size', 'large')
+            ], [('CONVERSION', 'text_size', 'small')])
+
+        assert b.get_variant('ryan', 'text_size') == 'small'
+        assert b.get_variant('joe', 'text_size') == 'large'
+        assert b.participants('text_size', 'small') == 1
+        assert b.participants('text_size', 'medium') == 0
+        assert b.conversions('text_size', 'small') == 1
+
+    def test_mark_event_single_commit(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        with patch.object(b.Session, 'commit', wraps=b.Session.commit) as c:
+            b.mark_conversion('text_size', 'medium')
+            b.mark_conversion('text_size', 'medium')
+            assert c.call_count == 2
+
+        assert b.conversions('text_size', 'medium') == 2
+        assert model.TrackedEvent.query.count() == 1
+
+    def test_mark_event_unknown_variant(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_conversion('text_size', 'huge')
+        b.mark_conversion('another_test', 'small')
+        assert model.TrackedEvent.query.count() == 0
+
+    def test_mark_event_without_upsert(self):
+        b = self.b
+        b._upsert = None
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_participant('text_size', 'medium')
+        b.mark_participant('text_size', 'medium')
+        b.mark_participants({'text_size': 'small'})
+
+        assert b.participants('text_size', 'medium') == 2
+        assert b.participants('text_size', 'small') == 1
+
+    def test_shared_variant_names(self):
+        b = self.b
+        b.save_experiment('show_promo', ('True', 'False'))
+        b.save_experiment('show_banner', ('True', 'False'))
+        assert model.Variant.query.count() == 4
+
+        assert b.set_variant('ryan', 'show_promo', 'True') is True
+        assert b.set_variant('ryan', 'show_banner', 'False') is True
+        assert b.get_assignments('ryan') == {
+            'show_promo': 'True',
+            'show_banner': 'False'
+        }
+
+        b.mark_conversion('show_banner', 'True')
+        assert b.conversions('show_banner', 'True') == 1
+        assert b.conversions('show_promo', 'True') == 0
+
+    def test_event_types_are_integers(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_conversion('text_size', 'medium')
+
+        assert model.TrackedEvent.query.filter_by(
+            type='CONVERSION'
+        ).one().total == 1
+        assert b.Session.execute(
+            'SELECT type FROM cleaver_event'
+        ).scalar() == 2
+
+    def _statements(self, fn):
+        from sqlalchemy import event
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = self.b.Session.bind
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            fn()
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return statements
+
+    def test_id_cache(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        def work():
+            assert b.set_variant('ryan', 'text_size', 'medium') is True
+            assert b.get_variant('ryan', 'text_size') == 'medium'
+            assert b.get_variants('ryan', ['text_size']) == {
+                'text_size': 'medium'
+            }
+            assert b.get_assignments('ryan') == {'text_size': 'medium'}
+            b.mark_conversion('text_size', 'medium')
+            assert b.conversions('text_size', 'medium') == 1
+
+        # Experiment and variant IDs are never looked up by name
+        statements = self._statements(work)
+        assert statements
+        assert not [
+            s for s in statements
+            if 'cleaver_experiment' in s or 'cleaver_variant' in s
+        ]
+
+    def test_id_cache_loads_missing_ids(self):
+        self.b.save_experiment('text_size', ('small', 'medium', 'large'))
+        self.b.participate('ryan', 'text_size', 'medium')
+
+        # A new backend (e.g., in another process) looks the IDs up once
+        b = SQLAlchemyBackend()
+        assert b.get_assignments('ryan') == {'text_size': 'medium'}
+        assert b.set_variant('ryan', 'text_size', 'huge') is False
+        assert b.get_variant('ryan', 'another_test') is None
+        assert b.conversions('another_test', 'True') == 0
+        assert b._variant_ids([('text_size', 'small')]) == {
+            ('text_size', 'small'): (
+                b._ids['text_size'][0],
+                b._ids['text_size'][1]['small']
+            )
+        }
+        assert not self._statements(
+            lambda: b.mark_participant('text_size', 'small')
+        )[0].startswith('SELECT')
+
+    def test_clear_id_cache(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        assert 'text_size' in b._ids
+
+        b.clear_id_cache()
+        assert b._ids == {}
+        assert b._names == {}
+        assert b.set_variant('ryan', 'text_size', 'medium') is True
+        assert 'text_size' in b._ids
+
+    def test_failed_unit_of_work_clears_id_cache(self):
+        b = self.b
+        b.begin()
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        assert 'text_size' in b._ids
+
+        with patch.object(b.Session, 'commit', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, b.end)
+        assert b._ids == {}
+
+    def test_event_shards(self):
+        b = SQLAlchemyBackend(event_shards=4)
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_human('ryan')
+        b.participate('ryan', 'text_size', 'medium')
+
+        shards = iter([0, 1, 2, 3, 1, 1])
+        with patch('random.randrange', lambda n: next(shards)):
+            for _ in range(6):
+                b.mark_conversion('text_size', 'medium')
+
+        assert b.conversions('text_size', 'medium') == 6
+        assert b.conversions('text_size', 'small') == 0
+        assert b.participants('text_size', 'medium') == 1
+        assert sorted(
+            (e.shard, e.total) for e in model.TrackedEvent.query.filter_by(
+                type='CONVERSION'
+            )
+        ) == [(0, 1), (1, 3), (2, 1), (3, 1)]
+
+    def test_event_shards_without_upsert(self):
+        b = SQLAlchemyBackend(event_shards=2)
+        b._upsert = None
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+
+        shards = iter([0, 1, 1])
+        with patch('random.randrange', lambda n: next(shards)):
+            for _ in range(3):
+                b.mark_participant('text_size', 'small')
+
+        assert b.participants('text_size', 'small') == 3
+        assert model.TrackedEvent.query.count() == 2
+
+    def test_invalid_event_shards(self):
+        self.assertRaises(RuntimeError, SQLAlchemyBackend, event_shards=0)
+
+    def test_upsert_dialects(self):
+        from sqlalchemy.dialects import mysql, postgresql
+
+        b = self.b
+        assert b._upsert is not None
+
+        dialect = b.Session.bind.dialect
+        with patch.object(dialect, 'name', 'postgresql'):
+            statement = str(b._build_upsert().compile(
+                dialect=postgresql.dialect()
+            ))
+            assert 'ON CONFLICT (type, experiment_id, variant_id, shard) ' \
+                'DO UPDATE SET total' in statement
+
+        with patch.object(dialect, 'name', 'mysql'):
+            statement = str(b._build_upsert().compile(
+                dialect=mysql.dialect()
+            ))
+            assert 'ON DUPLICATE KEY UPDATE total' in statement
+
+        with patch.object(dialect, 'name', 'oracle'):
+            assert b._build_upsert() is None
+
     def test_score(self):
         b = self.b
         b.save_experiment('text_size', ('small', 'medium', 'large'))
@@ -283,3 +707,59 @@ class TestSQLAlchemy(TestCase):
 
         assert b.conversions('show_promo', 'True') == 1
         assert b.conversions('show_promo', 'False') == 0
+
+    def test_mark_events(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_events([
+            ('PARTICIPANT', 'text_size', 'small'),
+            ('PARTICIPANT', 'text_size', 'small'),
+            ('CONVERSION', 'text_size', 'medium'),
+            ('CONVERSION', 'another_test', 'False')
+        ])
+
+        assert b.participants('text_size', 'small') == 2
+        assert b.conversions('text_size', 'medium') == 1
+
+    def test_mark_event_totals(self):
+        b = self.b
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.mark_event_totals({
+            ('PARTICIPANT', 'text_size', 'small'): 250,
+            ('CONVERSION', 'text_size', 'medium'): 12,
+            ('CONVERSION', 'another_test', 'False'): 3
+        })
+        b.mark_event_totals({('CONVERSION', 'text_size', 'medium'): 3})
+
+        assert b.participants('text_size', 'small') == 250
+        assert b.conversions('text_size', 'medium') == 15
+        assert model.TrackedEvent.query.count() == 2
+
+    def test_stats(self):
+        b = self.b = SQLAlchemyBackend(event_shards=4)
+        b.save_experiment('text_size', ('small', 'medium', 'large'))
+        b.save_experiment('show_promo', ('True', 'False'))
+        for _ in range(10):
+            b.mark_participants({'text_size': 'small', 'show_promo': 'True'})
+        b.mark_conversions({'text_size': 'small'})
+
+        found = []
+        statements = self._statements(lambda: found.append(
+            b.stats(['text_size', 'show_promo'])
+        ))
+        stats = found[0]
+
+        assert stats == {
+            'text_size': {
+                'small': (10, 1),
+                'medium': (0, 0),
+                'large': (0, 0)
+            },
+            'show_promo': {
+                'True': (10, 0),
+                'False': (0, 0)
+            }
+        }
+        # the IDs were already cached, so only the totals are queried
+        assert len(statements) == 1
+        assert list(b.stats(['text_size', 'another_test'])) == ['text_size']
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+from datetime import datetime
+
+from mock import patch
+
+try:
+    import aiosqlite  # noqa
+    from cleaver.backend.db.aio import AsyncSQLAlchemyBackend
+except ImportError:  # pragma: nocover
+    AsyncSQLAlchemyBackend = None
+
+from cleaver.asgi import AsyncCleaver
+from cleaver.experiment import Experiment
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@skipIf(
+    AsyncSQLAlchemyBackend is None,
+    'SQLAlchemy 1.4 (or newer) and aiosqlite are not installed'
+)
+class TestAsyncSQLAlchemy(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dburi = 'sqlite+aiosqlite:///%s' % os.path.join(
+            self.dir, 'cleaver.db'
+        )
+        self.b = AsyncSQLAlchemyBackend(self.dburi)
+
+    def tearDown(self):
+        run(self.b.close())
+        shutil.rmtree(self.dir)
+
+    def test_save_experiment(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            await b.save_experiment('text_size', ('tiny', 'huge'))
+            return await b.all_experiments()
+
+        experiments = run(test())
+        assert len(experiments) == 1
+        assert isinstance(experiments[0], Experiment)
+        assert experiments[0].name == 'text_size'
+        assert experiments[0].started_on.date() == datetime.utcnow().date()
+        assert experiments[0].variants == ('small', 'medium', 'large')
+
+    def test_get_experiments(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            await b.save_experiment('show_promo', ('True', 'False'))
+            assert (await b.get_experiment('show_promo', None)).variants == (
+                'True', 'False'
+            )
+            assert await b.get_experiment('another_test', None) is None
+            assert await b.get_experiments({}) == {}
+            return await b.get_experiments({
+                'text_size': ('small', 'medium', 'large'),
+                'another_test': ('True', 'False')
+            })
+
+        assert list(run(test())) == ['text_size']
+
+    def test_verified_human(self):
+        b = self.b
+
+        async def test():
+            assert await b.is_verified_human('ryan') is False
+            await b.mark_human('ryan')
+            await b.mark_human('ryan')
+            assert await b.is_verified_human('ryan') is True
+
+        run(test())
+
+    def test_set_variant(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('show_promo', ('True', 'False'))
+            await b.save_experiment('show_banner', ('True', 'False'))
+
+            assert await b.set_variant('ryan', 'show_promo', 'True') is True
+            assert await b.set_variant('ryan', 'show_promo', 'False') is False
+            assert await b.set_variant('ryan', 'show_promo', 'huge') is False
+            assert await b.set_variant('ryan', 'another_test', 'a') is False
+            assert await b.set_variant('ryan', 'show_banner', 'False') is True
+
+            assert await b.get_variant('ryan', 'show_promo') == 'True'
+            assert await b.get_variant('joe', 'show_promo') is None
+            assert await b.get_variants(
+                'ryan', ['show_promo', 'another_test']
+            ) == {'show_promo': 'True'}
+            assert await b.get_variants('ryan', []) == {}
+            assert await b.get_assignments('ryan') == {
+                'show_promo': 'True',
+                'show_banner': 'False'
+            }
+
+        run(test())
+
+    def test_participate(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            await b.save_experiment('show_promo', ('True', 'False'))
+            await b.participate('joe', 'text_size', 'small')
+            assert await b.participants('text_size', 'small') == 0
+
+            await b.mark_human('ryan')
+            await b.participate('ryan', 'text_size', 'small')
+            await b.participate_many('ryan', {
+                'text_size': 'medium',
+                'show_promo': 'False',
+                'another_test': 'True'
+            })
+
+            # Existing assignments aren't changed (or counted again)
+            assert await b.get_assignments('ryan') == {
+                'text_size': 'small',
+                'show_promo': 'False'
+            }
+            assert await b.participants('text_size', 'small') == 1
+            assert await b.participants('text_size', 'medium') == 0
+            assert await b.participants('show_promo', 'False') == 1
+
+        run(test())
+
+    def test_write_many(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            await b.save_experiment('show_promo', ('True', 'False'))
+            await b.set_variant('ryan', 'text_size', 'small')
+
+            await b.write_many([
+                ('ryan', 'text_size', 'medium'),
+                ('ryan', 'show_promo', 'True'),
+                ('joe', 'show_promo', 'False'),
+                ('joe', 'another_test', 'False')
+            ], [
+                ('PARTICIPANT', 'show_promo', 'True'),
+                ('CONVERSION', 'text_size', 'small'),
+                ('CONVERSION', 'text_size', 'small'),
+                ('CONVERSION', 'another_test', 'False')
+            ])
+            await b.write_many([], [])
+
+            assert await b.get_assignments('ryan') == {
+                'text_size': 'small',
+                'show_promo': 'True'
+            }
+            assert await b.get_assignments('joe') == {'show_promo': 'False'}
+            assert await b.participants('show_promo', 'True') == 1
+            assert await b.conversions('text_size', 'small') == 2
+            assert await b.conversions('another_test', 'False') == 0
+
+        run(test())
+
+    def test_stats(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            await b.save_experiment('show_promo', ('True', 'False'))
+            await b.mark_events([
+                ('PARTICIPANT', 'text_size', 'small'),
+                ('PARTICIPANT', 'text_size', 'small'),
+                ('PARTICIPANT', 'show_promo', 'True'),
+                ('CONVERSION', 'text_size', 'small')
+            ])
+            return (
+                await b.stats(['text_size', 'show_promo', 'another_test']),
+                await b.stats(['another_test'])
+            )
+
+        stats, missing = run(test())
+        assert stats == {
+            'text_size': {
+                'small': (2, 1),
+                'medium': (0, 0),
+                'large': (0, 0)
+            },
+            'show_promo': {
+                'True': (1, 0),
+                'False': (0, 0)
+            }
+        }
+        assert missing == {}
+
+    def test_score(self):
+        b = self.b
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            await b.mark_conversion('text_size', 'medium')
+            await b.mark_conversion('text_size', 'medium')
+            await b.mark_conversion('text_size', 'huge')
+            await b.mark_conversions({'text_size': 'small'})
+            await b.mark_participants({'text_size': 'small'})
+
+            assert await b.conversions('text_size', 'medium') == 2
+            assert await b.conversions('text_size', 'small') == 1
+            assert await b.conversions('text_size', 'huge') == 0
+            assert await b.participants('text_size', 'small') == 1
+
+        run(test())
+
+    def test_event_shards(self):
+        b = AsyncSQLAlchemyBackend(self.dburi, event_shards=3)
+
+        async def test():
+            await b.save_experiment('text_size', ('small', 'medium', 'large'))
+            shards = iter([0, 1, 2, 1])
+            with patch('random.randrange', lambda n: next(shards)):
+                for _ in range(4):
+                    await b.mark_conversion('text_size', 'medium')
+            assert await b.conversions('text_size', 'medium') == 4
+            await b.close()
+
+        run(test())
+
+    def test_invalid_configuration(self):
+        self.assertRaises(
+            RuntimeError, AsyncSQLAlchemyBackend, self.dburi, event_shards=0
+        )
+        with patch('cleaver.backend.db.aio._build_upsert', return_value=None):
+            self.assertRaises(RuntimeError, AsyncSQLAlchemyBackend, self.dburi)
+
+    def test_create_tables(self):
+        b = AsyncSQLAlchemyBackend(self.dburi, create_tables=False)
+
+        async def test():
+            try:
+                await b.all_experiments()
+            finally:
+                await b.close()
+
+        self.assertRaises(Exception, run, test())
+
+    def test_cleaver_split_and_score(self):
+        b = self.b
+
+        async def test():
+            await b.mark_human('ryan')
+            cleaver = AsyncCleaver({}, lambda environ: 'ryan', b,
+                                   experiment_registry=None)
+            variant = await cleaver.split(
+                'text_color', ('red', '#F00'), ('blue', '#00F')
+            )
+            name = {'#F00': 'red', '#00F': 'blue'}[variant]
+            assert await b.participants('text_color', name) == 1
+
+            await cleaver.score('text_color')
+            assert await b.conversions('text_color', name) == 1
+
+        run(test())
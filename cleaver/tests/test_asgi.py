@@ -0,0 +1,375 @@
+import asyncio
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from mock import patch
+
+from . import FakeIdentityProvider, FakeBackend
+from cleaver.asgi import AsyncCleaver, AsyncSplitMiddleware
+from cleaver.backend.aio import AsyncCleaverBackend, ThreadPoolBackend
+from cleaver.compat import urlencode
+from cleaver.experiment import Experiment
+
+
+class AsyncDictBackend(AsyncCleaverBackend):
+
+    def __init__(self):
+        self.experiments = {}
+        self.humans = set()
+        self.variants = {}
+        self.events = {}
+        self.calls = []
+
+    async def all_experiments(self):
+        return list(self.experiments.values())
+
+    async def get_experiment(self, name, variants):
+        self.calls.append('get_experiment')
+        return self.experiments.get(name)
+
+    async def save_experiment(self, name, variants):
+        self.experiments[name] = Experiment(
+            self, name, datetime.utcnow(), tuple(variants)
+        )
+
+    async def is_verified_human(self, identity):
+        self.calls.append('is_verified_human')
+        return identity in self.humans
+
+    async def mark_human(self, identity):
+        self.humans.add(identity)
+
+    async def get_variant(self, identity, experiment_name):
+        self.calls.append('get_variant')
+        return self.variants.get((identity, experiment_name))
+
+    async def set_variant(self, identity, experiment_name, variant):
+        if (identity, experiment_name) in self.variants:
+            return False
+        self.variants[(identity, experiment_name)] = variant
+        return True
+
+    async def mark_participant(self, experiment_name, variant):
+        key = ('PARTICIPANT', experiment_name, variant)
+        self.events[key] = self.events.get(key, 0) + 1
+
+    async def mark_conversion(self, experiment_name, variant):
+        key = ('CONVERSION', experiment_name, variant)
+        self.events[key] = self.events.get(key, 0) + 1
+
+    async def participants(self, experiment_name, variant):
+        return self.events.get(('PARTICIPANT', experiment_name, variant), 0)
+
+    async def conversions(self, experiment_name, variant):
+        return self.events.get(('CONVERSION', experiment_name, variant), 0)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestAsyncCleaver(TestCase):
+
+    def test_invalid_identity(self):
+        self.assertRaises(
+            RuntimeError,
+            AsyncCleaver,
+            {},
+            None,
+            AsyncDictBackend()
+        )
+
+    def test_invalid_backend(self):
+        self.assertRaises(
+            RuntimeError,
+            AsyncCleaver,
+            {},
+            FakeIdentityProvider(),
+            FakeBackend()
+        )
+
+    def test_split(self):
+        b = AsyncDictBackend()
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b,
+                               experiment_registry=None)
+
+        variant = run(cleaver('text_color', ('red', '#F00'),
+                              ('blue', '#00F')))
+        assert variant in ('#F00', '#00F')
+        assert 'text_color' in b.experiments
+        assert 'ryan' in b.humans
+
+        name = {'#F00': 'red', '#00F': 'blue'}[variant]
+        assert b.variants[('ryan', 'text_color')] == name
+        assert run(b.participants('text_color', name)) == 1
+
+        # The same visitor sees the same variant, and isn't counted again
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b,
+                               experiment_registry=None)
+        assert run(cleaver.split(
+            'text_color', ('red', '#F00'), ('blue', '#00F')
+        )) == variant
+        assert run(b.participants('text_color', name)) == 1
+
+    def test_split_conflict(self):
+        b = AsyncDictBackend()
+        run(b.save_experiment('show_promo', ('True', 'False')))
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b,
+                               experiment_registry=None)
+
+        self.assertRaises(
+            RuntimeError,
+            run,
+            cleaver.split('show_promo', ('T', True), ('F', False))
+        )
+
+    def test_split_many(self):
+        b = AsyncDictBackend()
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b,
+                               experiment_registry=None)
+        results = run(cleaver.split_many({
+            'show_promo': (),
+            'text_color': (('red', '#F00'), ('blue', '#00F'))
+        }))
+
+        assert results['show_promo'] in (True, False)
+        assert results['text_color'] in ('#F00', '#00F')
+        assert b.calls.count('get_experiment') == 4
+        assert b.calls.count('is_verified_human') == 2
+
+    def test_split_many_hash_assignment(self):
+        b = AsyncDictBackend()
+        for _ in range(2):
+            cleaver = AsyncCleaver({}, lambda scope: 'ryan', b,
+                                   hash_assignment=True, hash_salt='xyz')
+            results = run(cleaver.split_many({
+                'show_promo': (),
+                'text_color': (('red', '#F00'), ('blue', '#00F'))
+            }))
+
+        # Hashed variants are stored, but never looked up
+        assert 'get_variant' not in b.calls
+        name = {'#F00': 'red', '#00F': 'blue'}[results['text_color']]
+        assert b.variants[('xyz:ryan', 'text_color')] == name
+        assert run(b.participants('text_color', name)) == 1
+
+    def test_override(self):
+        b = AsyncDictBackend()
+        cleaver = AsyncCleaver({
+            'cleaver.override': {'show_promo': 'False'}
+        }, lambda scope: 'ryan', b, experiment_registry=None)
+        assert run(cleaver.split('show_promo')) is False
+        assert ('ryan', 'show_promo') not in b.variants
+
+    def test_score(self):
+        b = AsyncDictBackend()
+        b.humans.add('ryan')
+        b.variants[('ryan', 'show_promo')] = 'True'
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b)
+
+        run(cleaver.score('show_promo'))
+        run(cleaver.score('another_test'))
+        assert run(b.conversions('show_promo', 'True')) == 1
+        assert b.calls.count('get_variant') == 2
+        assert b.calls.count('is_verified_human') == 1
+
+    def test_score_many(self):
+        b = AsyncDictBackend()
+        b.humans.add('ryan')
+        b.variants[('ryan', 'show_promo')] = 'True'
+        b.variants[('ryan', 'text_color')] = 'red'
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b)
+
+        run(cleaver.score_many(['show_promo', 'another_test']))
+        assert run(b.conversions('show_promo', 'True')) == 1
+        assert run(b.conversions('text_color', 'red')) == 0
+
+    def test_score_all(self):
+        b = AsyncDictBackend()
+        b.humans.add('ryan')
+        run(b.save_experiment('show_promo', ('True', 'False')))
+        run(b.save_experiment('text_color', ('red', 'blue')))
+        b.variants[('ryan', 'show_promo')] = 'True'
+        b.variants[('ryan', 'text_color')] = 'red'
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b)
+
+        run(cleaver.score_all())
+        assert run(b.conversions('show_promo', 'True')) == 1
+        assert run(b.conversions('text_color', 'red')) == 1
+
+    def test_score_unverified(self):
+        b = AsyncDictBackend()
+        b.variants[('ryan', 'show_promo')] = 'True'
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b)
+
+        run(cleaver.score('show_promo'))
+        assert run(b.conversions('show_promo', 'True')) == 0
+
+    def test_humanizing_javascript(self):
+        b = AsyncDictBackend()
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b)
+        assert 'var url = "%s";' % cleaver.human_callback_token in \
+            run(cleaver.humanizing_javascript())
+
+        b.humans.add('ryan')
+        cleaver = AsyncCleaver({}, lambda scope: 'ryan', b)
+        assert run(cleaver.humanizing_javascript()) == ''
+
+
+class TestThreadPoolBackend(TestCase):
+
+    def test_invalid_backend(self):
+        self.assertRaises(
+            RuntimeError,
+            ThreadPoolBackend,
+            AsyncDictBackend()
+        )
+
+    @patch.object(FakeBackend, 'get_variants')
+    def test_calls_run_in_executor(self, get_variants):
+        get_variants.return_value = {'show_promo': 'True'}
+        executor = ThreadPoolExecutor(max_workers=1)
+        b = ThreadPoolBackend(FakeBackend(), executor)
+
+        assert run(b.get_variants('ryan', ['show_promo'])) == {
+            'show_promo': 'True'
+        }
+        get_variants.assert_called_once_with('ryan', ['show_promo'])
+        executor.shutdown()
+
+    @patch.object(FakeBackend, 'participate')
+    def test_participate_uses_wrapped_backend(self, participate):
+        b = ThreadPoolBackend(FakeBackend())
+        run(b.participate('ryan', 'show_promo', 'True'))
+        participate.assert_called_once_with('ryan', 'show_promo', 'True')
+
+    @patch.object(FakeBackend, 'stats')
+    def test_stats_uses_wrapped_backend(self, stats):
+        stats.return_value = {'show_promo': {'True': (1, 0)}}
+        b = ThreadPoolBackend(FakeBackend())
+        assert run(b.stats(['show_promo'])) == {
+            'show_promo': {'True': (1, 0)}
+        }
+        stats.assert_called_once_with(['show_promo'])
+
+
+class TestAsyncSplitMiddleware(TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.scope = None
+
+    async def app(self, scope, receive, send):
+        self.scope = scope
+        await send({'type': 'http.response.start', 'status': 200})
+        await send({'type': 'http.response.body', 'body': b'Hello world!'})
+
+    def _make_request(self, scope=None, body=None, backend=None, **kw):
+        scope = dict(scope or {})
+        scope.setdefault('type', 'http')
+        scope.setdefault('method', 'GET')
+        scope.setdefault('path', '/')
+        scope.setdefault('query_string', b'')
+
+        chunks = [body or b'']
+
+        async def receive():
+            return {
+                'type': 'http.request',
+                'body': chunks.pop(0),
+                'more_body': bool(chunks)
+            }
+
+        async def send(message):
+            self.messages.append(message)
+
+        middleware = AsyncSplitMiddleware(
+            self.app,
+            lambda scope: 'ryan',
+            backend or AsyncDictBackend(),
+            **kw
+        )
+        run(middleware(scope, receive, send))
+        return self.scope
+
+    def test_invalid_backend(self):
+        self.assertRaises(
+            RuntimeError,
+            AsyncSplitMiddleware,
+            self.app,
+            FakeIdentityProvider(),
+            None
+        )
+
+    def test_sync_backends_are_wrapped(self):
+        middleware = AsyncSplitMiddleware(
+            self.app,
+            FakeIdentityProvider(),
+            FakeBackend()
+        )
+        assert isinstance(middleware._backend, ThreadPoolBackend)
+
+    def test_cleaver_in_scope(self):
+        scope = self._make_request()
+        assert isinstance(scope['cleaver'], AsyncCleaver)
+        assert self.messages[0]['status'] == 200
+
+    def test_non_http_scopes_are_ignored(self):
+        scope = self._make_request({'type': 'lifespan'})
+        assert 'cleaver' not in scope
+
+    def test_cleaver_override(self):
+        scope = self._make_request({
+            'query_string': urlencode({
+                'cleaver:show_promo': 'False',
+                'article': 25
+            }).encode('latin-1')
+        }, allow_override=True)
+
+        assert scope['query_string'] == b'article=25'
+        assert scope['cleaver.override'] == {'show_promo': 'False'}
+
+    def test_query_string_untouched_without_overrides(self):
+        scope = self._make_request({
+            'query_string': b'b=2&a=1&cleaver=1'
+        }, allow_override=True)
+
+        assert scope['query_string'] == b'b=2&a=1&cleaver=1'
+        assert 'cleaver.override' not in scope
+
+    def test_human_callback(self):
+        b = AsyncDictBackend()
+        run(b.save_experiment('show_promo', ('True', 'False')))
+        b.variants[('ryan', 'show_promo')] = 'True'
+
+        self._make_request({
+            'method': 'POST',
+            'path': '/__cleaver_human_verification__'
+        }, body=b'x=1&y=2&z=3', backend=b, count_humans_only=True)
+
+        assert self.messages[0]['status'] == 204
+        assert self.scope is None
+        assert 'ryan' in b.humans
+        assert run(b.participants('show_promo', 'True')) == 1
+
+    def test_bad_math(self):
+        b = AsyncDictBackend()
+        self._make_request({
+            'method': 'POST',
+            'path': '/__cleaver_human_verification__'
+        }, body=b'x=5&y=10&z=250', backend=b, count_humans_only=True)
+
+        assert self.messages[0]['status'] == 401
+        assert b.humans == set()
+
+    def test_body_too_large(self):
+        b = AsyncDictBackend()
+        self._make_request({
+            'method': 'POST',
+            'path': '/__cleaver_human_verification__'
+        }, body=b'x=1&y=2&z=3&' + b'a' * 2048, backend=b,
+            count_humans_only=True)
+
+        assert self.messages[0]['status'] == 401
+        assert b.humans == set()
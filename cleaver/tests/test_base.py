@@ -4,7 +4,8 @@ from datetime import datetime
 from mock import patch
 
 from . import FakeIdentityProvider, FakeBackend
-from cleaver import Cleaver
+from cleaver import Cleaver, util
+from cleaver.backend.memory import MemoryBackend
 from cleaver.experiment import Experiment
 
 
@@ -44,6 +45,63 @@ class TestBase(TestCase):
         cleaver = Cleaver({}, lambda environ: 'ABC456', FakeBackend())
         assert cleaver.identity == 'ABC456'
 
+    @patch.object(FakeIdentityProvider, 'get_identity')
+    def test_identity_is_memoized(self, get_identity):
+        cleaver = Cleaver({}, FakeIdentityProvider(), FakeBackend())
+        get_identity.return_value = 'ABC123'
+
+        assert cleaver.identity == 'ABC123'
+        assert cleaver.identity == 'ABC123'
+        assert get_identity.call_count == 1
+
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_human_is_memoized(self, is_verified_human):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        is_verified_human.return_value = False
+
+        assert cleaver.human is False
+        assert cleaver.human is False
+        is_verified_human.assert_called_once_with('ABC123')
+
+    @patch.object(FakeBackend, 'mark_human')
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_mark_human_updates_cache(self, is_verified_human, mark_human):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        is_verified_human.return_value = False
+
+        assert cleaver.human is False
+        cleaver.mark_human()
+        mark_human.assert_called_once_with('ABC123')
+        assert cleaver.human is True
+        assert is_verified_human.call_count == 1
+
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_human_from_cookie(self, is_verified_human):
+        cookie = util.HumanCookie('secret')
+        cleaver = Cleaver(
+            {'HTTP_COOKIE': 'cleaver_human=%s' % cookie.sign('ABC123')},
+            lambda environ: 'ABC123',
+            FakeBackend(),
+            human_cookie=cookie
+        )
+
+        assert cleaver.human is True
+        assert not is_verified_human.called
+
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_invalid_cookie_falls_back_to_backend(self, is_verified_human):
+        is_verified_human.return_value = False
+        cookie = util.HumanCookie('secret')
+        cleaver = Cleaver(
+            {'HTTP_COOKIE': 'cleaver_human=%s' % cookie.sign('XYZ')},
+            lambda environ: 'ABC123',
+            FakeBackend(),
+            human_cookie=cookie
+        )
+
+        assert cleaver.human is False
+        is_verified_human.assert_called_once_with('ABC123')
+
 
 class TestSplit(TestCase):
 
@@ -126,6 +184,37 @@ class TestSplit(TestCase):
         assert cleaver.split('show_promo') in (True, False)
         get_experiment.assert_called_with('show_promo', ('True', 'False'))
 
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_experiment_get_is_cached(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = Experiment(
+            backend=backend,
+            name='show_promo',
+            started_on=datetime.utcnow(),
+            variants=['True', 'False']
+        )
+
+        for _ in range(3):
+            cleaver = Cleaver({}, FakeIdentityProvider(), backend)
+            assert cleaver.split('show_promo') in (True, False)
+        assert get_experiment.call_count == 1
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_experiment_get_without_registry(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = Experiment(
+            backend=backend,
+            name='show_promo',
+            started_on=datetime.utcnow(),
+            variants=['True', 'False']
+        )
+
+        for _ in range(3):
+            cleaver = Cleaver({}, FakeIdentityProvider(), backend,
+                              experiment_registry=None)
+            assert cleaver.split('show_promo') in (True, False)
+        assert get_experiment.call_count == 3
+
     @patch.object(FakeBackend, 'get_experiment')
     @patch.object(FakeBackend, 'mark_human')
     @patch.object(Cleaver, 'identity', 'ABC123')
@@ -143,21 +232,110 @@ class TestSplit(TestCase):
         assert cleaver.split('show_promo') in (True, False)
         mark_human.assert_called_with('ABC123')
 
-    @patch('cleaver.util.random_variant')
+    @patch('cleaver.util.WeightedSampler.choice')
     @patch.object(FakeBackend, 'get_experiment')
     @patch.object(FakeBackend, 'participate')
     @patch.object(FakeIdentityProvider, 'get_identity')
     def test_variant_participation(self, get_identity, participate,
-                                   get_experiment, random_variant):
+                                   get_experiment, choice):
         cleaver = Cleaver({}, FakeIdentityProvider(), FakeBackend())
         get_experiment.return_value.name = 'show_promo'
         get_experiment.return_value.variants = ('True', 'False')
         get_identity.return_value = 'ABC123'
-        random_variant.return_value = iter(['True'])
+        choice.return_value = 'True'
 
         assert cleaver.split('show_promo') in (True, False)
         participate.assert_called_with('ABC123', 'show_promo', 'True')
 
+    @patch.object(FakeBackend, 'get_experiment')
+    @patch.object(FakeBackend, 'get_variant')
+    @patch.object(FakeBackend, 'set_variant')
+    @patch.object(FakeBackend, 'mark_participant')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_hash_assignment(self, mark_participant, set_variant,
+                             get_variant, get_experiment):
+        get_experiment.return_value.name = 'show_promo'
+        get_experiment.return_value.variants = ('True', 'False')
+        set_variant.return_value = True
+
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend(),
+                          hash_assignment=True, hash_salt='xyz')
+        result = cleaver.split('show_promo')
+        variant = str(result)
+        assert variant == util.hashed_variant(
+            ('True', 'False'), (1, 1), 'xyz:show_promo:ABC123'
+        )
+
+        assert get_variant.called is False
+        set_variant.assert_called_with('xyz:ABC123', 'show_promo', variant)
+        mark_participant.assert_called_with('show_promo', variant)
+
+        # Returning visitors get the same variant, but aren't counted again
+        set_variant.return_value = False
+        mark_participant.reset_mock()
+        for _ in range(5):
+            cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend(),
+                              hash_assignment=True, hash_salt='xyz')
+            assert cleaver.split('show_promo') is result
+        assert get_variant.called is False
+        assert mark_participant.called is False
+
+    def test_hash_assignment_writes_once(self):
+        backend = MemoryBackend()
+        backend.mark_human('ABC123')
+
+        with patch.object(backend, 'set_variant',
+                          wraps=backend.set_variant) as set_variant:
+            for _ in range(5):
+                cleaver = Cleaver({}, lambda environ: 'ABC123', backend,
+                                  hash_assignment=True)
+                variant = str(cleaver.split('show_promo'))
+            assert set_variant.call_count == 1
+
+        assert backend.participants('show_promo', variant) == 1
+        assert backend.get_variant(':ABC123', 'show_promo') == variant
+
+    def test_hash_assignment_split_many(self):
+        backend = MemoryBackend()
+        backend.mark_human('ABC123')
+
+        with patch.object(backend, 'get_variants') as get_variants:
+            for _ in range(2):
+                cleaver = Cleaver({}, lambda environ: 'ABC123', backend,
+                                  hash_assignment=True)
+                results = cleaver.split_many({
+                    'show_promo': (),
+                    'text_color': (('red', '#F00'), ('blue', '#00F'))
+                })
+            assert get_variants.call_count == 0
+
+        variant = str(results['show_promo'])
+        color = {'#F00': 'red', '#00F': 'blue'}[results['text_color']]
+        assert backend.participants('show_promo', variant) == 1
+        assert backend.participants('text_color', color) == 1
+        assert backend.get_variant(':ABC123', 'text_color') == color
+
+    def test_hash_assignment_scores_shown_variant(self):
+        backend = MemoryBackend()
+
+        def shown(salt):
+            cleaver = Cleaver({}, lambda environ: 'ABC123', backend,
+                              experiment_registry=None,
+                              hash_assignment=True, hash_salt=salt)
+            variant = str(cleaver.split('show_promo'))
+            cleaver.score('show_promo')
+            return variant
+
+        # Changing the salt (or enabling hashing for an existing experiment)
+        # credits conversions to the variant the visitor is shown
+        Cleaver({}, lambda environ: 'ABC123', backend,
+                experiment_registry=None).split('show_promo')
+        counts = {'True': 0, 'False': 0}
+        for salt in ('a', 'a', 'b', 'b', 'c', 'd'):
+            counts[shown(salt)] += 1
+        assert backend.conversions('show_promo', 'True') == counts['True']
+        assert backend.conversions('show_promo', 'False') == counts['False']
+
     @patch.object(FakeBackend, 'get_experiment')
     def test_variant_override(self, get_experiment):
         cleaver = Cleaver({
@@ -168,6 +346,120 @@ class TestSplit(TestCase):
 
         assert cleaver.split('show_promo') is False
 
+    @patch.object(FakeBackend, 'get_experiments')
+    @patch.object(FakeBackend, 'get_variants')
+    @patch.object(FakeBackend, 'participate_many')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_split_many(self, participate_many, get_variants,
+                        get_experiments):
+        backend = FakeBackend()
+        get_experiments.return_value = {
+            'show_promo': Experiment(
+                backend=backend,
+                name='show_promo',
+                started_on=datetime.utcnow(),
+                variants=['True', 'False']
+            ),
+            'text_color': Experiment(
+                backend=backend,
+                name='text_color',
+                started_on=datetime.utcnow(),
+                variants=['red', 'blue']
+            )
+        }
+        get_variants.return_value = {'text_color': 'blue'}
+
+        cleaver = Cleaver({}, lambda environ: 'ABC123', backend)
+        result = cleaver.split_many({
+            'show_promo': (),
+            'text_color': (('red', '#F00'), ('blue', '#00F'))
+        })
+
+        assert result['show_promo'] in (True, False)
+        assert result['text_color'] == '#00F'
+        assert get_experiments.call_count == 1
+        get_experiments.assert_called_with({
+            'show_promo': ('True', 'False'),
+            'text_color': ('red', 'blue')
+        })
+        assert get_variants.call_count == 1
+        assert sorted(get_variants.call_args[0][1]) == [
+            'show_promo', 'text_color'
+        ]
+        participate_many.assert_called_once_with(
+            'ABC123', {'show_promo': str(result['show_promo'])}
+        )
+
+    @patch.object(FakeBackend, 'get_experiments')
+    @patch.object(FakeBackend, 'save_experiment')
+    @patch.object(FakeBackend, 'get_variants', lambda *args: {})
+    @patch.object(FakeBackend, 'participate_many', lambda *args: None)
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_split_many_experiment_save(self, save_experiment,
+                                        get_experiments):
+        backend = FakeBackend()
+        get_experiments.side_effect = [
+            {},  # the first call fails
+            {'show_promo': Experiment(
+                backend=backend,
+                name='show_promo',
+                started_on=datetime.utcnow(),
+                variants=['True', 'False']
+            )}  # but the second call succeeds after a successful save
+        ]
+
+        cleaver = Cleaver({}, lambda environ: 'ABC123', backend)
+        assert cleaver.split_many({'show_promo': ()})['show_promo'] in (
+            True, False
+        )
+        save_experiment.assert_called_with('show_promo', ('True', 'False'))
+
+    @patch.object(FakeBackend, 'get_experiments')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_split_many_conflict(self, get_experiments):
+        backend = FakeBackend()
+        get_experiments.return_value = {'show_promo': Experiment(
+            backend=backend,
+            name='show_promo',
+            started_on=datetime.utcnow(),
+            variants=['True', 'False']
+        )}
+
+        cleaver = Cleaver({}, lambda environ: 'ABC123', backend)
+        self.assertRaises(
+            RuntimeError,
+            cleaver.split_many,
+            {'show_promo': (('T', True), ('F', False))}
+        )
+
+    def test_split_many_experiment_names_must_be_strings(self):
+        cleaver = Cleaver({}, FakeIdentityProvider(), FakeBackend())
+        self.assertRaises(
+            RuntimeError,
+            cleaver.split_many,
+            {500: ()}
+        )
+
+    @patch.object(FakeBackend, 'get_experiments')
+    @patch.object(FakeBackend, 'get_variants')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_split_many_override(self, get_variants, get_experiments):
+        backend = FakeBackend()
+        get_experiments.return_value = {'show_promo': Experiment(
+            backend=backend,
+            name='show_promo',
+            started_on=datetime.utcnow(),
+            variants=['True', 'False']
+        )}
+
+        cleaver = Cleaver({
+            'cleaver.override': {'show_promo': 'False'}
+        }, lambda environ: 'ABC123', backend)
+        assert cleaver.split_many({'show_promo': ()}) == {
+            'show_promo': False
+        }
+        assert get_variants.called is False
+
     @patch.object(FakeBackend, 'mark_conversion')
     @patch.object(FakeBackend, 'get_variant')
     @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
@@ -179,6 +471,66 @@ class TestSplit(TestCase):
 
         cleaver.score('primary_color')
         mark_conversion.assert_called_with('primary_color', 'red')
+        get_variant.assert_called_once_with('ABC123', 'primary_color')
+
+    @patch.object(FakeBackend, 'mark_conversion')
+    @patch.object(FakeBackend, 'get_variant', lambda *args: None)
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_score_without_variant(self, is_verified_human, mark_conversion):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        cleaver.score('primary_color')
+        assert not mark_conversion.called
+        assert not is_verified_human.called
+
+    @patch.object(FakeBackend, 'write_many')
+    @patch.object(FakeBackend, 'get_variants')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_score_many(self, get_variants, write_many):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        get_variants.return_value = {
+            'primary_color': 'red',
+            'show_promo': 'True'
+        }
+
+        cleaver.score_many(['primary_color', 'show_promo', 'another_test'])
+        get_variants.assert_called_once_with(
+            'ABC123',
+            ['primary_color', 'show_promo', 'another_test']
+        )
+        assert write_many.call_count == 1
+        assignments, events = write_many.call_args[0]
+        assert assignments == []
+        assert sorted(events) == [
+            ('CONVERSION', 'primary_color', 'red'),
+            ('CONVERSION', 'show_promo', 'True')
+        ]
+
+    @patch.object(FakeBackend, 'write_many')
+    @patch.object(FakeBackend, 'get_variants')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: False)
+    def test_score_many_unverified(self, get_variants, write_many):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        get_variants.return_value = {'primary_color': 'red'}
+
+        cleaver.score_many(['primary_color'])
+        assert not write_many.called
+
+    @patch.object(FakeBackend, 'get_variants')
+    def test_score_many_empty(self, get_variants):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        cleaver.score_many([])
+        assert not get_variants.called
+
+    @patch.object(FakeBackend, 'mark_conversions')
+    @patch.object(FakeBackend, 'get_assignments')
+    @patch.object(FakeBackend, 'is_verified_human', lambda *args: True)
+    def test_score_all(self, get_assignments, mark_conversions):
+        cleaver = Cleaver({}, lambda environ: 'ABC123', FakeBackend())
+        get_assignments.return_value = {'primary_color': 'red'}
+
+        cleaver.score_all()
+        get_assignments.assert_called_once_with('ABC123')
+        mark_conversions.assert_called_once_with({'primary_color': 'red'})
 
 
 class TestVariants(TestCase):
@@ -270,6 +622,45 @@ class TestVariants(TestCase):
             (10, 1)
         )
 
+    def test_compiled_variants_are_cached(self):
+        first = Cleaver({}, FakeIdentityProvider(), FakeBackend())
+        second = Cleaver({}, FakeIdentityProvider(), FakeBackend())
+        variants = (('red', '#F00', 1), ('green', '#0F0', 2))
+
+        spec = first._compile_variants('text_color', variants)
+        assert spec.keys == ('red', 'green')
+        assert spec.values == ('#F00', '#0F0')
+        assert spec.weights == (1, 2)
+        assert spec.value_of == {'red': '#F00', 'green': '#0F0'}
+        assert spec.cumulative == [1, 3]
+
+        assert second._compile_variants('text_color', variants) is spec
+        assert second._compile_variants(
+            'text_color', (('red', '#F00', 1), ('green', '#0F0', 2))
+        ) is spec
+        assert second._compile_variants('other', variants) is not spec
+
+    def test_compiled_variants_with_equal_values(self):
+        c = Cleaver({}, FakeIdentityProvider(), FakeBackend())
+
+        for on, off in ((1, 0), (True, False), (1.0, 0.0), (1, 0)):
+            spec = c._compile_variants(
+                'show_promo', (('on', on), ('off', off))
+            )
+            assert spec.value_of['on'] is on
+            assert spec.value_of['off'] is off
+            assert type(spec.value_of['on']) is type(on)
+
+    def test_compiled_variants_with_unhashable_values(self):
+        c = Cleaver({}, FakeIdentityProvider(), FakeBackend())
+        variants = (('red', ['#F00']), ('green', {'color': '#0F0'}))
+
+        spec = c._compile_variants('text_color', variants)
+        assert spec.value_of == {
+            'red': ['#F00'],
+            'green': {'color': '#0F0'}
+        }
+
     def test_variant_weights_must_be_integers(self):
         c = Cleaver({}, FakeIdentityProvider(), FakeBackend())
         self.assertRaises(
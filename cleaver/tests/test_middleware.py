@@ -1,11 +1,15 @@
 from unittest import TestCase
+from io import BytesIO
 from wsgiref.util import setup_testing_defaults
 
 from mock import Mock, patch, call
 
 from . import FakeIdentityProvider, FakeBackend
 from cleaver import Cleaver, SplitMiddleware
+from cleaver.middleware import _parse_callback
+from cleaver.backend.buffered import BufferedBackend
 from cleaver.compat import urlencode, PY3
+from cleaver.util import HumanCookie
 
 
 class TestMiddleware(TestCase):
@@ -35,6 +39,7 @@ class TestMiddleware(TestCase):
 
         def start_response(status, response_headers, exc_info=None):
             self._resp['status'] = status
+            self._resp['headers'] = response_headers
 
         SplitMiddleware(self.app, lambda environ: 'ryan', FakeBackend(), **kw)(
             environ,
@@ -73,6 +78,208 @@ class TestMiddleware(TestCase):
         assert isinstance(environ['xyz'], Cleaver)
         assert callable(environ['xyz'])
 
+    @patch.object(Cleaver, '__init__')
+    def test_cleaver_is_built_lazily(self, init):
+        init.return_value = None
+        environ = self._make_request()
+        assert 'cleaver' in environ
+        assert not init.called
+
+        assert isinstance(environ['cleaver'], Cleaver)
+        assert isinstance(environ['cleaver'], Cleaver)
+        assert init.call_count == 1
+
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_lazy_cleaver_delegates(self, is_verified_human):
+        is_verified_human.return_value = True
+        environ = self._make_request()
+        cleaver = environ['cleaver']
+
+        assert cleaver.identity == 'ryan'
+        assert cleaver.human is True
+        cleaver.count_humans_only = True
+        assert cleaver.count_humans_only is True
+
+    def test_bypass_prefix(self):
+        environ = self._make_request(
+            {'PATH_INFO': '/static/app.css'},
+            bypass=['/static/', '/health']
+        )
+        assert 'cleaver' not in environ
+        assert self._resp['status'] == '200 OK'
+
+        environ = self._make_request(
+            {'PATH_INFO': '/checkout'},
+            bypass=['/static/', '/health']
+        )
+        assert isinstance(environ['cleaver'], Cleaver)
+
+    def test_bypass_predicate(self):
+        def is_api(environ):
+            return environ.get('HTTP_ACCEPT') == 'application/json'
+
+        environ = self._make_request(
+            {'HTTP_ACCEPT': 'application/json'},
+            bypass=[is_api]
+        )
+        assert 'cleaver' not in environ
+
+        environ = self._make_request(
+            {'HTTP_ACCEPT': 'text/html'},
+            bypass=[is_api]
+        )
+        assert 'cleaver' in environ
+
+    def test_invalid_bypass(self):
+        self.assertRaises(
+            RuntimeError,
+            SplitMiddleware,
+            self.app,
+            FakeIdentityProvider(),
+            FakeBackend(),
+            bypass=[5]
+        )
+
+    @patch.object(FakeBackend, 'get_variant')
+    def test_bypass_skips_backend(self, get_variant):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return []
+
+        environ = {}
+        setup_testing_defaults(environ)
+        environ['PATH_INFO'] = '/static/app.css'
+        SplitMiddleware(
+            app,
+            lambda environ: 'ryan',
+            FakeBackend(),
+            buffer_writes=True,
+            bypass=['/static/']
+        )(environ, lambda *args: None)
+
+        assert 'cleaver' not in environ
+        assert not get_variant.called
+
+    def test_buffered_writes(self):
+        flushed = []
+
+        def app(environ, start_response):
+            environ['cleaver']._backend.mark_conversion('show_promo', 'True')
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return ['Hello world!\n']
+
+        environ = {}
+        setup_testing_defaults(environ)
+        with patch.object(FakeBackend, 'write_many') as write_many:
+            write_many.side_effect = lambda *args: flushed.append(args)
+            result = SplitMiddleware(
+                app,
+                lambda environ: 'ryan',
+                FakeBackend(),
+                buffer_writes=True
+            )(environ, lambda *args: None)
+
+            assert isinstance(environ['cleaver']._backend, BufferedBackend)
+            assert list(result) == ['Hello world!\n']
+            assert flushed == []
+
+            # Writes are flushed once the response iterable is closed
+            result.close()
+            assert flushed == [([], [('CONVERSION', 'show_promo', 'True')])]
+
+    def test_buffered_writes_flushed_on_error(self):
+
+        def app(environ, start_response):
+            environ['cleaver']._backend.mark_conversion('show_promo', 'True')
+            raise ValueError()
+
+        environ = {}
+        setup_testing_defaults(environ)
+        with patch.object(FakeBackend, 'write_many') as write_many:
+            self.assertRaises(
+                ValueError,
+                SplitMiddleware(
+                    app,
+                    lambda environ: 'ryan',
+                    FakeBackend(),
+                    buffer_writes=True
+                ),
+                environ,
+                lambda *args: None
+            )
+            write_many.assert_called_once_with(
+                [], [('CONVERSION', 'show_promo', 'True')]
+            )
+
+    @patch.object(FakeBackend, 'end')
+    @patch.object(FakeBackend, 'begin')
+    def test_unit_of_work(self, begin, end):
+        def app(environ, start_response):
+            assert begin.called
+            start_response('200 OK', [])
+            return ['Hello world!']
+
+        environ = {}
+        setup_testing_defaults(environ)
+        result = SplitMiddleware(
+            app,
+            lambda environ: 'ryan',
+            FakeBackend(),
+            unit_of_work=True
+        )(environ, lambda *args: None)
+
+        assert list(result) == ['Hello world!']
+        assert not end.called
+        result.close()
+        end.assert_called_once_with()
+
+    @patch.object(FakeBackend, 'end')
+    @patch.object(FakeBackend, 'begin')
+    def test_unit_of_work_ended_on_error(self, begin, end):
+        def app(environ, start_response):
+            raise ValueError()
+
+        environ = {}
+        setup_testing_defaults(environ)
+        self.assertRaises(
+            ValueError,
+            SplitMiddleware(
+                app,
+                lambda environ: 'ryan',
+                FakeBackend(),
+                unit_of_work=True
+            ),
+            environ,
+            lambda *args: None
+        )
+        begin.assert_called_once_with()
+        end.assert_called_once_with()
+
+    @patch.object(FakeBackend, 'write_many')
+    @patch.object(FakeBackend, 'end')
+    @patch.object(FakeBackend, 'begin', Mock())
+    def test_unit_of_work_with_buffered_writes(self, end, write_many):
+        calls = []
+        write_many.side_effect = lambda *args: calls.append('write_many')
+        end.side_effect = lambda: calls.append('end')
+
+        def app(environ, start_response):
+            environ['cleaver']._backend.mark_conversion('show_promo', 'True')
+            start_response('200 OK', [])
+            return []
+
+        environ = {}
+        setup_testing_defaults(environ)
+        SplitMiddleware(
+            app,
+            lambda environ: 'ryan',
+            FakeBackend(),
+            buffer_writes=True,
+            unit_of_work=True
+        )(environ, lambda *args: None).close()
+
+        assert calls == ['write_many', 'end']
+
     def test_cleaver_override_disabled(self):
         environ = self._make_request({
             'QUERY_STRING': urlencode({
@@ -85,6 +292,13 @@ class TestMiddleware(TestCase):
         })
         assert 'cleaver.override' not in environ
 
+    def test_query_string_untouched_without_overrides(self):
+        environ = self._make_request({
+            'QUERY_STRING': 'b=2&a=1'
+        }, allow_override=True)
+        assert environ['QUERY_STRING'] == 'b=2&a=1'
+        assert 'cleaver.override' not in environ
+
     def test_cleaver_override_variable_consumption(self):
         environ = self._make_request({
             'QUERY_STRING': urlencode({
@@ -148,6 +362,30 @@ class TestMiddleware(TestCase):
 
         mark_human.assert_called_with('ryan')
 
+    @patch.object(FakeBackend, 'mark_human')
+    @patch.object(FakeBackend, 'all_experiments', lambda *args: [])
+    def test_human_callback_sets_cookie(self, mark_human):
+        cookie = HumanCookie('secret')
+        self._make_request({
+            'PATH_INFO': '/__cleaver_human_verification__'
+        }, postdata='x=1&y=2&z=3', count_humans_only=True,
+            human_cookie=cookie)
+        assert self._resp['status'] == '204 No Content'
+
+        headers = dict(self._resp['headers'])
+        value = headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+        assert cookie.verify(value, 'ryan')
+
+    @patch.object(FakeBackend, 'is_verified_human')
+    def test_human_cookie_skips_backend(self, is_verified_human):
+        cookie = HumanCookie('secret')
+        environ = self._make_request({
+            'HTTP_COOKIE': 'cleaver_human=%s' % cookie.sign('ryan')
+        }, human_cookie=cookie)
+
+        assert environ['cleaver'].human is True
+        assert not is_verified_human.called
+
     @patch.object(FakeBackend, 'mark_human')
     @patch.object(FakeBackend, 'mark_participant')
     @patch.object(FakeBackend, 'get_variant')
@@ -181,6 +419,36 @@ class TestMiddleware(TestCase):
             call('color', 'blue'),
         ])
 
+    @patch.object(FakeBackend, 'mark_human', Mock())
+    @patch.object(FakeBackend, 'all_experiments')
+    @patch.object(FakeBackend, 'mark_participants')
+    @patch.object(FakeBackend, 'get_assignments')
+    def test_callback_uses_assignments(self, get_assignments,
+                                       mark_participants, all_experiments):
+        get_assignments.return_value = {'show_promo': 'True', 'color': 'blue'}
+
+        self._make_request({
+            'PATH_INFO': '/__cleaver_human_verification__'
+        }, postdata='x=1&y=2&z=3', count_humans_only=True)
+        assert self._resp['status'] == '204 No Content'
+
+        get_assignments.assert_called_once_with('ryan')
+        mark_participants.assert_called_once_with({
+            'show_promo': 'True',
+            'color': 'blue'
+        })
+        assert not all_experiments.called
+
+    @patch.object(FakeBackend, 'mark_human', Mock())
+    @patch.object(FakeBackend, 'mark_participants')
+    @patch.object(FakeBackend, 'get_assignments', lambda *args: {})
+    def test_callback_without_assignments(self, mark_participants):
+        self._make_request({
+            'PATH_INFO': '/__cleaver_human_verification__'
+        }, postdata='x=1&y=2&z=3', count_humans_only=True)
+        assert self._resp['status'] == '204 No Content'
+        assert not mark_participants.called
+
     def test_missing_input(self):
         self._make_request({
             'PATH_INFO': '/__cleaver_human_verification__'
@@ -210,3 +478,71 @@ class TestMiddleware(TestCase):
             'PATH_INFO': '/__cleaver_human_verification__'
         }, postdata='x=5&y=10&z=250', count_humans_only=True)
         assert self._resp['status'] == '401 Unauthorized'
+
+    def test_body_too_large(self):
+        environ = {'PATH_INFO': '/__cleaver_human_verification__'}
+        setup_testing_defaults(environ)
+        environ['wsgi.input'] = Mock()
+
+        self._make_request(
+            environ,
+            postdata='x=1&y=2&z=3&' + 'a' * 2048,
+            count_humans_only=True
+        )
+        assert self._resp['status'] == '401 Unauthorized'
+        assert not environ['wsgi.input'].read.called
+
+    @patch.object(FakeBackend, 'mark_human')
+    @patch.object(FakeBackend, 'all_experiments', lambda *args: [])
+    def test_custom_body_size(self, mark_human):
+        self._make_request({
+            'PATH_INFO': '/__cleaver_human_verification__'
+        }, postdata='x=1&y=2&z=3', count_humans_only=True, max_body_size=5)
+        assert self._resp['status'] == '401 Unauthorized'
+        assert not mark_human.called
+
+    def _make_streaming_request(self, body, content_length=None):
+        environ = {
+            'PATH_INFO': '/__cleaver_human_verification__',
+            'REQUEST_METHOD': 'POST',
+            'wsgi.input': BytesIO(body)
+        }
+        setup_testing_defaults(environ)
+        if content_length is not None:
+            environ['CONTENT_LENGTH'] = str(content_length)
+        return self._make_request(environ, count_humans_only=True)
+
+    @patch.object(FakeBackend, 'mark_human')
+    def test_missing_content_length(self, mark_human):
+        environ = self._make_streaming_request(b'x=1&y=2&z=3')
+        assert self._resp['status'] == '401 Unauthorized'
+        assert not mark_human.called
+
+        # The body is treated as empty, and never read
+        assert environ['wsgi.input'].tell() == 0
+
+    def test_missing_content_length_too_large(self):
+        self._make_streaming_request(b'x=1&y=2&z=3&' + b'a' * 2048)
+        assert self._resp['status'] == '401 Unauthorized'
+
+    @patch.object(FakeBackend, 'mark_human')
+    def test_client_disconnected(self, mark_human):
+        self._make_streaming_request(b'x=1&y=2&z=3', content_length=100)
+        assert self._resp['status'] == '401 Unauthorized'
+        assert not mark_human.called
+
+
+class TestParseCallback(TestCase):
+
+    def test_parse(self):
+        assert _parse_callback(b'x=1&y=2&z=3') == (1, 2, 3)
+        assert _parse_callback(b'z=3&y=2&x=1&a=b') == (1, 2, 3)
+
+    def test_first_value_wins(self):
+        assert _parse_callback(b'x=1&x=5&y=2&z=3') == (1, 2, 3)
+
+    def test_missing_or_invalid(self):
+        assert _parse_callback(b'') == (0, 0, 0)
+        assert _parse_callback(b'x=5') == (5, 0, 0)
+        assert _parse_callback(b'x=5&y=10&z=dog') == (5, 10, 0)
+        assert _parse_callback(b'x&y=&z==') == (0, 0, 0)
@@ -0,0 +1,151 @@
+from unittest import TestCase
+from datetime import datetime
+
+from mock import patch
+
+from . import FakeBackend
+from cleaver.backend.buffered import BufferedBackend
+from cleaver.experiment import Experiment
+from cleaver.registry import ExperimentRegistry
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestExperimentRegistry(TestCase):
+
+    def _experiment(self, backend, name='show_promo'):
+        return Experiment(
+            backend=backend,
+            name=name,
+            started_on=datetime.utcnow(),
+            variants=('True', 'False')
+        )
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_experiment_is_cached(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = self._experiment(backend)
+        registry = ExperimentRegistry()
+
+        for _ in range(3):
+            e = registry.get_experiment(backend, 'show_promo', ())
+            assert e.name == 'show_promo'
+        assert get_experiment.call_count == 1
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_missing_experiment_is_not_cached(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = None
+        registry = ExperimentRegistry()
+
+        assert registry.get_experiment(backend, 'show_promo', ()) is None
+        assert registry.get_experiment(backend, 'show_promo', ()) is None
+        assert get_experiment.call_count == 2
+        assert len(registry) == 0
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_experiment_expires(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = self._experiment(backend)
+        timer = FakeTimer()
+        registry = ExperimentRegistry(ttl=30, timer=timer)
+
+        registry.get_experiment(backend, 'show_promo', ())
+        timer.now += 29
+        registry.get_experiment(backend, 'show_promo', ())
+        assert get_experiment.call_count == 1
+
+        timer.now += 1
+        registry.get_experiment(backend, 'show_promo', ())
+        assert get_experiment.call_count == 2
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_cache_is_per_backend(self, get_experiment):
+        first, second = FakeBackend(), FakeBackend()
+        get_experiment.return_value = self._experiment(first)
+        registry = ExperimentRegistry()
+
+        registry.get_experiment(first, 'show_promo', ())
+        registry.get_experiment(second, 'show_promo', ())
+        assert get_experiment.call_count == 2
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_maxsize(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.side_effect = lambda name, variants: \
+            self._experiment(backend, name)
+        timer = FakeTimer()
+        registry = ExperimentRegistry(maxsize=2, timer=timer)
+
+        registry.get_experiment(backend, 'a', ())
+        timer.now += 1
+        registry.get_experiment(backend, 'b', ())
+        timer.now += 1
+        registry.get_experiment(backend, 'c', ())
+        assert len(registry) == 2
+
+        # 'a' was the oldest entry, so it was evicted
+        registry.get_experiment(backend, 'c', ())
+        registry.get_experiment(backend, 'b', ())
+        assert get_experiment.call_count == 3
+        registry.get_experiment(backend, 'a', ())
+        assert get_experiment.call_count == 4
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_maxsize_zero(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.side_effect = lambda name, variants: \
+            self._experiment(backend, name)
+        registry = ExperimentRegistry(maxsize=0)
+
+        assert registry.get_experiment(backend, 'a', ()).name == 'a'
+        assert registry.get_experiment(backend, 'a', ()).name == 'a'
+        assert len(registry) == 0
+        assert get_experiment.call_count == 2
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_invalidate(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.side_effect = lambda name, variants: \
+            self._experiment(backend, name)
+        registry = ExperimentRegistry()
+
+        registry.get_experiment(backend, 'a', ())
+        registry.get_experiment(backend, 'b', ())
+        registry.invalidate(backend, 'a')
+        assert len(registry) == 1
+
+        registry.invalidate()
+        assert len(registry) == 0
+
+    @patch.object(FakeBackend, 'get_experiment')
+    @patch.object(FakeBackend, 'save_experiment')
+    def test_save_experiment(self, save_experiment, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = self._experiment(backend)
+        registry = ExperimentRegistry()
+
+        registry.get_experiment(backend, 'show_promo', ())
+        registry.save_experiment(backend, 'show_promo', ('True', 'False'))
+        save_experiment.assert_called_with('show_promo', ('True', 'False'))
+        assert len(registry) == 0
+
+    @patch.object(FakeBackend, 'get_experiment')
+    def test_wrapped_backends_share_cache(self, get_experiment):
+        backend = FakeBackend()
+        get_experiment.return_value = self._experiment(backend)
+        registry = ExperimentRegistry()
+
+        registry.get_experiment(backend, 'show_promo', ())
+        registry.get_experiment(BufferedBackend(backend), 'show_promo', ())
+        assert get_experiment.call_count == 1
+
+        registry.invalidate(BufferedBackend(backend))
+        assert len(registry) == 0
@@ -3,6 +3,7 @@ from itertools import cycle
 from datetime import datetime
 from wsgiref.util import setup_testing_defaults
 
+from mock import patch
 from sqlalchemy.engine.reflection import Inspector
 
 from cleaver import SplitMiddleware
@@ -133,3 +134,147 @@ class TestFullStack(TestCase):
         assert app(environ, lambda *args: None) == []
 
         assert experiment.conversions == 0
+
+    def test_split_many(self):
+
+        def _track(environ):
+            return [environ['cleaver'].split_many({
+                'Coin': (('Heads', 'Heads'), ('Tails', 'Tails')),
+                'Die': (('1', 1), ('2', 2), ('3', 3))
+            })]
+
+        def app(environ, start_response):
+            response_headers = [('Content-type', 'text/plain')]
+            start_response('200 OK', response_headers)
+            return _track(environ)
+
+        environ = {}
+        setup_testing_defaults(environ)
+
+        app = SplitMiddleware(
+            app,
+            lambda environ: 'ryan',
+            self.b
+        )
+
+        # The first request returns variants and stores them
+        variants = app(environ, lambda *args: None)[0]
+        assert variants['Coin'] in ('Heads', 'Tails')
+        assert variants['Die'] in (1, 2, 3)
+
+        assert sorted(
+            e.name for e in self.b.all_experiments()
+        ) == ['Coin', 'Die']
+        assert self.b.participants('Coin', variants['Coin']) == 1
+        assert self.b.participants('Die', str(variants['Die'])) == 1
+
+        # The second request returns the same variants
+        assert app(environ, lambda *args: None)[0] == variants
+        assert self.b.participants('Coin', variants['Coin']) == 1
+        assert self.b.participants('Die', str(variants['Die'])) == 1
+
+    def test_buffered_writes(self):
+
+        def _track(environ):
+            return [environ['cleaver'](
+                'Coin',
+                ('Heads', 'Heads'),
+                ('Tails', 'Tails')
+            )]
+
+        def _score(environ):
+            environ['cleaver'].score('Coin')
+            return []
+
+        handler = cycle((_track, _track, _score))
+
+        def app(environ, start_response):
+            response_headers = [('Content-type', 'text/plain')]
+            start_response('200 OK', response_headers)
+            return next(handler)(environ)
+
+        environ = {}
+        setup_testing_defaults(environ)
+
+        app = SplitMiddleware(
+            app,
+            lambda environ: 'ryan',
+            self.b,
+            buffer_writes=True
+        )
+
+        # Nothing is written until the response is closed
+        result = app(environ, lambda *args: None)
+        variant = list(result)[0]
+        assert variant in ('Heads', 'Tails')
+        assert self.b.get_variant('ryan', 'Coin') is None
+        assert self.b.participants('Coin', variant) == 0
+
+        result.close()
+        assert self.b.get_variant('ryan', 'Coin') == variant
+        assert self.b.participants('Coin', variant) == 1
+
+        # The second request returns the same cleaver variant
+        result = app(environ, lambda *args: None)
+        assert list(result)[0] == variant
+        result.close()
+        assert self.b.participants('Coin', variant) == 1
+
+        # The third request marks a conversion
+        result = app(environ, lambda *args: None)
+        assert list(result) == []
+        result.close()
+        assert self.b.conversions('Coin', variant) == 1
+
+    def test_unit_of_work(self):
+
+        def _track(environ):
+            return [environ['cleaver'](
+                'Coin',
+                ('Heads', 'Heads'),
+                ('Tails', 'Tails')
+            )]
+
+        def _score(environ):
+            environ['cleaver'].score('Coin')
+            return []
+
+        handler = cycle((_track, _score))
+
+        def app(environ, start_response):
+            response_headers = [('Content-type', 'text/plain')]
+            start_response('200 OK', response_headers)
+            return next(handler)(environ)
+
+        environ = {}
+        setup_testing_defaults(environ)
+
+        app = SplitMiddleware(
+            app,
+            lambda environ: 'ryan',
+            self.b,
+            unit_of_work=True
+        )
+
+        Session = self.b.Session
+        with patch.object(Session, 'commit', wraps=Session.commit) as commit:
+            # Everything is committed at once, when the response is closed
+            result = app(environ, lambda *args: None)
+            variant = list(result)[0]
+            assert variant in ('Heads', 'Tails')
+            assert commit.call_count == 0
+
+            result.close()
+            assert commit.call_count == 1
+
+        assert self.b.get_variant('ryan', 'Coin') == variant
+        assert self.b.participants('Coin', variant) == 1
+
+        result = app(environ, lambda *args: None)
+        result.close()
+        assert self.b.conversions('Coin', variant) == 1
+
+        # Without a unit of work, changes are committed immediately
+        assert self.b.set_variant('joe', 'Coin', 'Heads') is True
+        self.b.Session.close()
+        assert self.b.get_variant('joe', 'Coin') == 'Heads'
@@ -1,8 +1,10 @@
 from unittest import TestCase
+import random
 import timeit
 
 from cleaver.compat import next
-from cleaver.util import random_variant
+from cleaver.util import (random_variant, hashed_variant, WeightedSampler,
+                          VariantSpec, HumanCookie)
 
 
 class TestRandomVariant(TestCase):
@@ -86,3 +88,186 @@ class TestRandomVariant(TestCase):
         # ...would cause this test to fail.
         #
         assert elapsed < 0.01
+
+
+class TestWeightedSampler(TestCase):
+
+    def test_generally_random(self):
+        sampler = WeightedSampler(('True', 'False'), (1, 1))
+        results = {}
+        total = 50000
+
+        for _ in range(total):
+            v = sampler.choice()
+            results.setdefault(v, 0)
+            results[v] += 1
+
+        a = results['True'] / float(total)
+        b = results['False'] / float(total)
+        assert a > .49 and a < .51
+        assert b > .49 and b < .51
+
+    def test_generally_random_with_weights(self):
+        sampler = WeightedSampler(('A', 'B', 'C', 'D'), (1, 3, 6, 0))
+        results = {'D': 0}
+        total = 50000
+
+        for v in sampler.sample(total):
+            results.setdefault(v, 0)
+            results[v] += 1
+
+        a = results['A'] / float(total)
+        b = results['B'] / float(total)
+        c = results['C'] / float(total)
+        assert a > .09 and a < .11
+        assert b > .29 and b < .31
+        assert c > .59 and c < .61
+        assert results['D'] == 0
+
+    def test_exact_distribution(self):
+        """
+        Every (column, threshold) pair in the alias table should map to
+        a variant in exact proportion to its weight.
+        """
+        weights = (5, 1, 7, 3, 2)
+        sampler = WeightedSampler(range(5), weights)
+        n = len(weights)
+
+        counts = [0] * n
+        for i in range(n):
+            counts[i] += sampler._threshold[i]
+            counts[sampler._alias[i]] += sampler.total - sampler._threshold[i]
+        assert counts == [w * n for w in weights]
+
+    def test_injectable_rng(self):
+        first = WeightedSampler(range(10), range(1, 11), random.Random(42))
+        second = WeightedSampler(range(10), range(1, 11), random.Random(42))
+        assert first.sample(100) == second.sample(100)
+
+    def test_invalid_weights(self):
+        self.assertRaises(ValueError, WeightedSampler, (), ())
+        self.assertRaises(ValueError, WeightedSampler, ('A', 'B'), (1,))
+        self.assertRaises(ValueError, WeightedSampler, ('A', 'B'), (0, 0))
+        self.assertRaises(ValueError, WeightedSampler, ('A', 'B'), (2, -1))
+
+    def test_choice_speed(self):
+        """
+        Once built, choosing from a sampler should take constant time
+        regardless of the number (and weights) of variants.
+        """
+        elapsed = timeit.Timer(
+            "sampler.choice()",
+            "\n".join([
+                "from cleaver.util import WeightedSampler",
+                "from itertools import repeat",
+                "sampler = WeightedSampler(range(10000), repeat(1000000, "
+                "10000))",
+            ])
+        ).timeit(1000)
+
+        # See ``TestRandomVariant.test_random_choice_speed``
+        assert elapsed < 0.01
+
+
+class TestHashedVariant(TestCase):
+
+    def test_deterministic(self):
+        items = ('A', 'B', 'C')
+        weights = (1, 1, 1)
+        for identity in range(100):
+            key = 'salt:experiment:%s' % identity
+            assert hashed_variant(items, weights, key) == \
+                hashed_variant(items, weights, key)
+
+    def test_unicode_key(self):
+        assert hashed_variant(('A', 'B'), (1, 1), u'☃') in ('A', 'B')
+
+    def test_generally_distributed_with_weights(self):
+        items = ('A', 'B', 'C')
+        weights = (1, 3, 6)
+        results = {}
+        total = 50000
+
+        for identity in range(total):
+            v = hashed_variant(items, weights, 'experiment:%s' % identity)
+            results.setdefault(v, 0)
+            results[v] += 1
+
+        a = results['A'] / float(total)
+        b = results['B'] / float(total)
+        c = results['C'] / float(total)
+        assert a > .09 and a < .11
+        assert b > .29 and b < .31
+        assert c > .59 and c < .61
+
+
+class TestVariantSpec(TestCase):
+
+    def test_unpacking(self):
+        keys, values, weights = VariantSpec(('A', 'B'), (1, 2), (3, 4))
+        assert keys == ('A', 'B')
+        assert values == (1, 2)
+        assert weights == (3, 4)
+
+    def test_hashed(self):
+        items = ('A', 'B', 'C')
+        weights = (1, 3, 6)
+        spec = VariantSpec(items, (None, None, None), weights)
+        for identity in range(1000):
+            key = 'experiment:%s' % identity
+            assert spec.hashed(key) == hashed_variant(items, weights, key)
+
+
+class TestHumanCookie(TestCase):
+
+    def setUp(self):
+        self.now = 1000000
+        self.cookie = HumanCookie('secret', timer=lambda: self.now)
+
+    def test_secret_required(self):
+        self.assertRaises(RuntimeError, HumanCookie, '')
+
+    def test_sign_and_verify(self):
+        value = self.cookie.sign('ryan')
+        assert self.cookie.verify(value, 'ryan') is True
+
+    def test_wrong_identity(self):
+        value = self.cookie.sign('ryan')
+        assert self.cookie.verify(value, 'someone-else') is False
+
+    def test_wrong_secret(self):
+        value = HumanCookie('another-secret').sign('ryan')
+        assert self.cookie.verify(value, 'ryan') is False
+
+    def test_expired(self):
+        value = self.cookie.sign('ryan')
+        self.now += self.cookie.max_age
+        assert self.cookie.verify(value, 'ryan') is False
+
+    def test_tampered(self):
+        expires, signature = self.cookie.sign('ryan').split('.')
+        value = '%d.%s' % (int(expires) + 1000, signature)
+        assert self.cookie.verify(value, 'ryan') is False
+
+    def test_malformed(self):
+        for value in (None, '', 'abc', 'abc.def', '1.', u'9999999999.\xe9'):
+            assert self.cookie.verify(value, 'ryan') is False
+
+    def test_is_human(self):
+        environ = {
+            'HTTP_COOKIE': 'a=1; cleaver_human=%s' % self.cookie.sign('ryan')
+        }
+        assert self.cookie.is_human(environ, 'ryan') is True
+        assert self.cookie.is_human(environ, 'someone-else') is False
+        assert self.cookie.is_human({}, 'ryan') is False
+        assert self.cookie.is_human({'HTTP_COOKIE': 'a=1'}, 'ryan') is False
+
+    def test_header(self):
+        name, value = HumanCookie(
+            'secret',
+            max_age=60,
+            secure=True
+        ).header('ryan')
+        assert name == 'Set-Cookie'
+        assert value.startswith('cleaver_human=')
+        assert '; Max-Age=60; Path=/; HttpOnly; Secure' in value
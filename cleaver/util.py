@@ -1,7 +1,14 @@
+import hmac
+import random
+import time
 from random import randint
 from bisect import bisect
+from hashlib import md5, sha256
 
-__all__ = ['random_variant']
+from .compat import SimpleCookie, CookieError, binary_type
+
+__all__ = ['random_variant', 'hashed_variant', 'WeightedSampler',
+           'VariantSpec', 'HumanCookie']
 
 
 def random_variant(variants, weights):
@@ -17,3 +24,264 @@ def random_variant(variants, weights):
 
     r = randint(0, total - 1)
     yield variants[bisect(accumulator, r)]
+
+
+def hashed_variant(variants, weights, key):
+    """
+    Given a list of variants, a corresponding list of weights, and a string
+    key, returns one weighted selection that is always the same for the same
+    key (and the same variants and weights).
+
+    Selections are distributed amongst variants in the same proportions as
+    ``random_variant``.
+    """
+    total = 0
+    accumulator = []
+    for w in weights:
+        total += w
+        accumulator.append(total)
+
+    return variants[bisect(accumulator, _hash(key) % total)]
+
+
+def _hash(key):
+    if not isinstance(key, binary_type):
+        key = key.encode('utf-8')
+    return int(md5(key).hexdigest()[:16], 16)
+
+
+class WeightedSampler(object):
+    """
+    A reusable weighted random sampler for a fixed list of variants, based on
+    Walker's alias method (as described by Vose).
+
+    Building the sampler takes linear time, but every subsequent selection
+    takes constant time (regardless of the number of variants or the size of
+    their weights), and is distributed amongst variants in the same
+    proportions as ``random_variant``.
+
+    :param variants a list of variants
+    :param weights a list of non-negative integer weights (corresponding to
+                   ``variants``)
+    :param rng an optional ``random.Random`` instance to draw from (defaults
+               to the ``random`` module's shared instance).
+    """
+
+    __slots__ = ('variants', 'total', '_threshold', '_alias', '_randrange')
+
+    def __init__(self, variants, weights, rng=None):
+        variants = tuple(variants)
+        weights = tuple(weights)
+        n = len(variants)
+        total = sum(weights)
+        if n == 0 or n != len(weights) or total <= 0 or min(weights) < 0:
+            raise ValueError(
+                'WeightedSampler requires one positive weight per variant.'
+            )
+
+        # Scale every weight by ``n`` so that each of the ``n`` columns of the
+        # alias table has a capacity of exactly ``total`` (which keeps the
+        # arithmetic in integers, and the probabilities exact).
+        scaled = [w * n for w in weights]
+        threshold = [total] * n
+        alias = list(range(n))
+
+        small = [i for i in range(n) if scaled[i] < total]
+        large = [i for i in range(n) if scaled[i] >= total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            threshold[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= total - scaled[less]
+            if scaled[more] < total:
+                small.append(more)
+            else:
+                large.append(more)
+
+        self.variants = variants
+        self.total = total
+        self._threshold = threshold
+        self._alias = alias
+        self._randrange = (rng or random).randrange
+
+    def choice(self):
+        """
+        Returns one random weighted selection.
+        """
+        i = self._randrange(len(self.variants))
+        if self._randrange(self.total) >= self._threshold[i]:
+            i = self._alias[i]
+        return self.variants[i]
+
+    def sample(self, k):
+        """
+        Returns a list of ``k`` independent random weighted selections.
+        """
+        variants = self.variants
+        threshold = self._threshold
+        alias = self._alias
+        randrange = self._randrange
+        n = len(variants)
+        total = self.total
+
+        results = []
+        append = results.append
+        for _ in range(k):
+            i = randrange(n)
+            if randrange(total) >= threshold[i]:
+                i = alias[i]
+            append(variants[i])
+        return results
+
+
+class VariantSpec(object):
+    """
+    A compiled, reusable representation of an experiment's variants, with
+    lookup tables precomputed so that choosing a variant (and its value)
+    doesn't require rebuilding them.
+
+    :param keys a tuple of unique string variant names
+    :param values a tuple of variant values (corresponding to ``keys``)
+    :param weights a tuple of integer variant weights (corresponding to
+                   ``keys``)
+    """
+
+    __slots__ = ('keys', 'values', 'weights', 'value_of', 'cumulative',
+                 'total', 'sampler')
+
+    def __init__(self, keys, values, weights):
+        self.keys = keys
+        self.values = values
+        self.weights = weights
+        self.value_of = dict(zip(keys, values))
+
+        total = 0
+        cumulative = []
+        for w in weights:
+            total += w
+            cumulative.append(total)
+        self.cumulative = cumulative
+        self.total = total
+        self.sampler = WeightedSampler(keys, weights)
+
+    def __iter__(self):
+        return iter((self.keys, self.values, self.weights))
+
+    def random(self):
+        """
+        Returns one random weighted selection (in constant time).
+        """
+        return self.sampler.choice()
+
+    def hashed(self, key):
+        """
+        Equivalent to ``hashed_variant(self.keys, self.weights, key)``.
+        """
+        return self.keys[bisect(self.cumulative, _hash(key) % self.total)]
+
+
+class HumanCookie(object):
+    """
+    Signs and verifies an expiring cookie which records that a visitor has
+    been verified as a human, so that ``cleaver.Cleaver.human`` can be
+    answered without consulting the backend.
+
+    Cookie values take the form ``<expiry>.<signature>``, where the signature
+    is an HMAC (keyed with ``secret``) of the expiry and the visitor's
+    identity, so a cookie can't be forged, extended, or reused by another
+    visitor.
+
+    :param secret a secret string used to sign cookies
+    :param name the name of the cookie (defaults to ``cleaver_human``)
+    :param max_age the number of seconds a cookie is valid for (defaults to
+                   30 days)
+    :param path the path the cookie applies to (defaults to ``/``)
+    :param secure when True, the cookie is only sent over HTTPS
+    :param timer a callable that returns the current time in seconds (defaults
+                 to ``time.time``).
+    """
+
+    def __init__(self, secret, name='cleaver_human', max_age=60 * 60 * 24 * 30,
+                 path='/', secure=False, timer=time.time):
+        if not secret:
+            raise RuntimeError('HumanCookie requires a secret.')
+        if not isinstance(secret, binary_type):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.name = name
+        self.max_age = max_age
+        self.path = path
+        self.secure = secure
+        self.timer = timer
+
+    def sign(self, identity):
+        """
+        Returns a signed cookie value for ``identity``.
+        """
+        expires = int(self.timer()) + self.max_age
+        return '%d.%s' % (expires, self._signature(identity, expires))
+
+    def verify(self, value, identity):
+        """
+        Returns True if ``value`` is an unexpired cookie value signed for
+        ``identity``.
+        """
+        try:
+            expires, signature = value.split('.', 1)
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return False
+        if expires <= self.timer():
+            return False
+        try:
+            return _compare_digest(
+                signature,
+                self._signature(identity, expires)
+            )
+        except TypeError:  # non-ASCII signatures
+            return False
+
+    def is_human(self, environ, identity):
+        """
+        Returns True if the request described by the WSGI ``environ`` carries
+        a valid cookie for ``identity``.
+        """
+        header = environ.get('HTTP_COOKIE')
+        if not header or self.name not in header:
+            return False
+        try:
+            morsel = SimpleCookie(header).get(self.name)
+        except CookieError:
+            return False
+        return morsel is not None and self.verify(morsel.value, identity)
+
+    def header(self, identity):
+        """
+        Returns a ``('Set-Cookie', ...)`` response header tuple recording that
+        ``identity`` is a verified human.
+        """
+        value = '%s=%s; Max-Age=%d; Path=%s; HttpOnly' % (
+            self.name,
+            self.sign(identity),
+            self.max_age,
+            self.path
+        )
+        if self.secure:
+            value += '; Secure'
+        return ('Set-Cookie', value)
+
+    def _signature(self, identity, expires):
+        message = ('%s|%d' % (identity, expires)).encode('utf-8')
+        return hmac.new(self.secret, message, sha256).hexdigest()
+
+
+def _compare_digest(a, b):
+    if hasattr(hmac, 'compare_digest'):
+        return hmac.compare_digest(a, b)
+    if len(a) != len(b):  # pragma: nocover
+        return False
+    result = 0  # pragma: nocover
+    for x, y in zip(a, b):  # pragma: nocover
+        result |= ord(x) ^ ord(y)
+    return result == 0  # pragma: nocover